@@ -0,0 +1,248 @@
+#! /usr/bin/env python
+#  -*- coding: utf-8 -*-
+# author: Victor Shapovalov (@ArtificalSUN, https://github.com/ArtificalSUN), 2022
+
+"""
+Binary G-code (.bgcode) export in the format of PrusaSlicer and Prusa firmware
+File consists of a header and blocks: file, printer, print and slicer metadata (INI text) and G-code blocks
+G-code blocks are MeatPack encoded and compressed with deflate or heatshrink, every block is protected with CRC32
+Pure Python reader is included to verify written files
+"""
+
+import re, struct, zlib
+from math import pi, sqrt
+
+import kcalibrator_generator as generator
+import kcalibrator_meatpack as meatpack
+
+magic = b"GCDE"
+version = 1
+checksum_none, checksum_crc32 = 0, 1
+block_file_metadata, block_gcode, block_slicer_metadata, block_printer_metadata, block_print_metadata, block_thumbnail = range(6)
+compression_list = ['none', 'deflate', 'heatshrink11', 'heatshrink12',]
+encoding_none, encoding_meatpack, encoding_meatpack_comments = 0, 1, 2
+max_block_size = 65535 # uncompressed size of one G-code block
+
+class BitWriter:
+    def __init__(self):
+        self.out = bytearray()
+        self.acc = 0
+        self.bits = 0
+
+    def write(self, value, bits):
+        self.acc = self.acc << bits | value
+        self.bits += bits
+        while self.bits >= 8:
+            self.bits -= 8
+            self.out.append(self.acc >> self.bits & 0xFF)
+        self.acc &= (1 << self.bits)-1
+
+    def flush(self): # pads the last byte with zeros
+        if self.bits: self.out.append(self.acc << (8-self.bits) & 0xFF)
+        self.acc = self.bits = 0
+        return bytes(self.out)
+
+def heatshrink_compress(data, window = 11, lookahead = 4):
+    """
+    LZSS compression compatible with heatshrink: literal is tag 1 and 8 bits,
+    back reference is tag 0, (offset-1) in window bits and (count-1) in lookahead bits
+    """
+    out = BitWriter()
+    max_offset, max_count = 1 << window, 1 << lookahead
+    min_count = (1+window+lookahead)//9+1 # shorter matches are cheaper as literals
+    chains = {} # 2-byte prefix -> recent positions
+    i, n = 0, len(data)
+    while i < n:
+        best, offset = 0, 0
+        for j in reversed(chains.get(data[i:i+2], ())):
+            if i-j > max_offset: break
+            length = 0
+            while length < max_count and i+length < n and data[j+length] == data[i+length]: length += 1
+            if length > best:
+                best, offset = length, i-j
+                if length == max_count: break
+        count = best if best >= min_count else 1
+        for k in range(i, min(i+count, n-1)):
+            positions = chains.setdefault(data[k:k+2], [])
+            positions.append(k)
+            if len(positions) > 32: del positions[0]
+        if count > 1:
+            out.write(0, 1); out.write(offset-1, window); out.write(count-1, lookahead)
+        else:
+            out.write(1, 1); out.write(data[i], 8)
+        i += count
+    return out.flush()
+
+def heatshrink_decompress(data, window = 11, lookahead = 4):
+    out = bytearray()
+    acc, bits, pos = 0, 0, 0
+    def read(count):
+        nonlocal acc, bits, pos
+        while bits < count:
+            if pos >= len(data): return None
+            acc = acc << 8 | data[pos]; pos += 1; bits += 8
+        bits -= count
+        value = acc >> bits & ((1 << count)-1)
+        acc &= (1 << bits)-1
+        return value
+    while True:
+        tag = read(1)
+        if tag is None: break
+        if tag:
+            value = read(8)
+            if value is None: break
+            out.append(value)
+        else:
+            index = read(window)
+            count = read(lookahead)
+            if index is None or count is None: break # zero padding of the last byte
+            for _ in range(count+1): out.append(out[-index-1])
+    return bytes(out)
+
+def compress(data, compression):
+    if compression == 'deflate': return zlib.compress(data)
+    if compression == 'heatshrink11': return heatshrink_compress(data, 11, 4)
+    if compression == 'heatshrink12': return heatshrink_compress(data, 12, 4)
+    return data
+
+def decompress(data, compression):
+    if compression == 'deflate': return zlib.decompress(data)
+    if compression == 'heatshrink11': return heatshrink_decompress(data, 11, 4)
+    if compression == 'heatshrink12': return heatshrink_decompress(data, 12, 4)
+    return data
+
+def block(block_type, data, compression = 'none', encoding = 0):
+    """
+    Returns block with header, parameters, (compressed) data and CRC32
+    """
+    code = compression_list.index(compression)
+    packed = compress(data, compression)
+    header = struct.pack("<HHI", block_type, code, len(data))
+    if code: header += struct.pack("<I", len(packed))
+    header += struct.pack("<H", encoding)
+    return header+packed+struct.pack("<I", zlib.crc32(header+packed))
+
+def ini(metadata):
+    return "".join("{k}={v}\n".format(k=k, v=v) for k, v in metadata).encode()
+
+def duration(seconds): # time in PrusaSlicer format
+    h, m, s = int(seconds//3600), int(seconds%3600//60), int(seconds%60)
+    return ("{}h {}m {}s" if h else "{1}m {2}s").format(h, m, s)
+
+def estimate(lines):
+    """
+    Returns (filament length in mm, print time in seconds, maximal Z) for G-code lines
+    Print time is estimated from distances and feed rates without acceleration,
+    filament pushed back after a retraction is not counted again
+    """
+    position, e, feed = [0.0, 0.0, 0.0], 0.0, 1.0
+    filament = seconds = max_z = retracted = 0.0
+    word = re.compile(r"([XYZEF])(-?\d+(?:\.\d*)?)")
+    for line in lines:
+        if line.startswith("G92"):
+            for axis, value in word.findall(line):
+                if axis == "E": e = float(value)
+            continue
+        if not (line.startswith("G0") or line.startswith("G1")): continue
+        target, new_e = position[:], e
+        for axis, value in word.findall(line):
+            if axis == "F": feed = float(value)/60
+            elif axis == "E": new_e = float(value)
+            else: target["XYZ".index(axis)] = float(value)
+        length = sqrt(sum((a-b)**2 for a, b in zip(target, position)))
+        if new_e < e: retracted += e-new_e
+        elif new_e > e:
+            restored = min(new_e-e, retracted)
+            retracted -= restored
+            filament += new_e-e-restored
+        seconds += (length or abs(new_e-e))/feed if feed else 0.0
+        position, e = target, new_e
+        max_z = max(max_z, position[2])
+    return filament, seconds, max_z
+
+def metadata(currentConfig, lines):
+    """
+    Returns (file, printer, print, slicer) metadata derived from the configuration and G-code
+    """
+    filament, seconds, max_z = estimate(lines)
+    volume = filament*pi/4*currentConfig.def_fil_dia**2/1000
+    printer = [("printer_model", ""), ("filament_type", ""), # nozzle diameter is not known, line width is not the nozzle
+               ("bed_temperature", currentConfig.temperature[1]), ("brim_width", round(generator.brim_width(currentConfig), 2)),
+               ("fill_density", "0%"), ("layer_height", currentConfig.def_layer), ("temperature", currentConfig.temperature[0]),
+               ("ironing", 0), ("support_material", 0), ("max_layer_z", "{:.2f}".format(max_z)), ("extruder_colour", '""'),
+               ("filament used [mm]", "{:.2f}".format(filament)), ("estimated printing time (normal mode)", duration(seconds))]
+    print_ = [("filament used [mm]", "{:.2f}".format(filament)), ("filament used [cm3]", "{:.2f}".format(volume)),
+              ("estimated printing time (normal mode)", duration(seconds))]
+    slicer = [("k_start", currentConfig.k_start), ("k_end", currentConfig.k_end), ("k_step", currentConfig.k_step),
+              ("layers_per_k", currentConfig.layers_per_k), ("k_mode", currentConfig.k_mode), ("firmware", currentConfig.firmware),
+              ("speed_slow", currentConfig.speed_slow), ("speed_fast", currentConfig.speed_fast)]
+    return [("Producer", generator.versionstring)], printer, print_, slicer
+
+def gcode_blocks(lines, compression, use_meatpack):
+    """
+    Splits G-code lines into blocks of at most max_block_size bytes before compression
+    """
+    encoder = meatpack.Encoder() if use_meatpack else None
+    data, size = [], 0
+    for line in lines:
+        encoded = encoder.encode(encoder.prepare(line)+"\n") if encoder else (line+"\n").encode()
+        if size+len(encoded) > max_block_size-10 and data: # leave room for MeatPack commands
+            yield block_data(data, compression, encoder)
+            data, size = [], 0
+        data.append(encoded); size += len(encoded)
+    if data: yield block_data(data, compression, encoder)
+
+def block_data(data, compression, encoder):
+    if encoder: data = [encoder.start()]+data+[meatpack.command(meatpack.reset_all)]
+    return block(block_gcode, b"".join(data), compression, encoding_meatpack if encoder else encoding_none)
+
+def bgcode_chunks(currentConfig, *args, compression = 'heatshrink12', use_meatpack = True, **kwargs):
+    """
+    Generator yielding binary G-code of the pattern (bytes) piece by piece, other arguments are passed to the generator
+    """
+    lines = list(generator.commands(generator.generate(currentConfig, *args, **kwargs))) # metadata blocks come first and need the whole G-code
+    file_meta, printer_meta, print_meta, slicer_meta = metadata(currentConfig, lines)
+    yield magic+struct.pack("<IH", version, checksum_crc32)
+    yield block(block_file_metadata, ini(file_meta), 'deflate')
+    yield block(block_printer_metadata, ini(printer_meta), 'deflate')
+    yield block(block_print_metadata, ini(print_meta), 'deflate')
+    yield block(block_slicer_metadata, ini(slicer_meta), 'deflate')
+    yield from gcode_blocks(lines, compression, use_meatpack)
+
+def write_bgcode(currentConfig, path, *args, **kwargs):
+    """
+    Writes generated pattern to binary G-code file, arguments are passed to bgcode_chunks
+    """
+    with open(path, "wb") as out: out.writelines(bgcode_chunks(currentConfig, *args, **kwargs))
+
+def read_bgcode(path):
+    """
+    Reads binary G-code file, checks its checksums and returns dictionary with metadata of every kind and G-code text
+    Raises ValueError for damaged files
+    """
+    with open(path, "rb") as f: data = f.read()
+    if data[:4] != magic: raise ValueError("Not a binary G-code file")
+    file_version, checksum = struct.unpack_from("<IH", data, 4)
+    pos = 10
+    result = {'file': {}, 'printer': {}, 'print': {}, 'slicer': {}, 'gcode': []}
+    names = {block_file_metadata: 'file', block_printer_metadata: 'printer', block_print_metadata: 'print', block_slicer_metadata: 'slicer'}
+    while pos < len(data):
+        start = pos
+        block_type, code, size = struct.unpack_from("<HHI", data, pos); pos += 8
+        packed_size = size
+        if code: packed_size = struct.unpack_from("<I", data, pos)[0]; pos += 4
+        if block_type == block_thumbnail: pos += 6
+        else: encoding = struct.unpack_from("<H", data, pos)[0]; pos += 2
+        packed = data[pos:pos+packed_size]; pos += packed_size
+        if checksum == checksum_crc32:
+            if struct.unpack_from("<I", data, pos)[0] != zlib.crc32(data[start:pos]): raise ValueError("Block at {} is damaged".format(start))
+            pos += 4
+        if block_type == block_thumbnail: continue
+        content = decompress(packed, compression_list[code])
+        if len(content) != size: raise ValueError("Block at {} has wrong size".format(start))
+        if block_type == block_gcode:
+            result['gcode'].append(meatpack.Decoder().feed(content) if encoding != encoding_none else content.decode())
+        else:
+            result[names[block_type]].update(line.split("=", 1) for line in content.decode().splitlines() if "=" in line)
+    result['gcode'] = "".join(result['gcode'])
+    return result
@@ -0,0 +1,181 @@
+#! /usr/bin/env python
+#  -*- coding: utf-8 -*-
+# author: Victor Shapovalov (@ArtificalSUN, https://github.com/ArtificalSUN), 2022
+
+"""
+Command line interface for Kcalibrator
+Generates the pattern from configuration file without GUI
+"""
+
+import os, sys, argparse
+
+import kcalibrator_settings as settings
+import kcalibrator_generator as generator
+import kcalibrator_upload as upload
+import kcalibrator_serial as serial_sender
+import kcalibrator_meatpack as meatpack
+import kcalibrator_bgcode as bgcode
+import kcalibrator_compress as compress
+import kcalibrator_validate as validator
+import kcalibrator_profiles as profiles
+import kcalibrator_predict as predict
+import kcalibrator_cost as cost
+
+def band_range(text):
+    """
+    Parses band range "N-M" or single band "N" (bands are counted from 1 at the bottom of the pattern)
+    """
+    try:
+        first, _, last = text.partition("-")
+        first = int(first); last = int(last) if last else first
+    except ValueError:
+        raise argparse.ArgumentTypeError("band range should look like N-M or N")
+    if first < 1 or last < first: raise argparse.ArgumentTypeError("invalid band range {}".format(text))
+    return first-1, last-1
+
+def confirm_limits(messages, currentConfig, yes = False):
+    """
+    Returns True if the job over the limits may be generated: limit_action is Confirm and the user agrees (or --yes is given)
+    """
+    for message in messages: print("Over the limit: "+message)
+    if currentConfig.limit_action == 'Refuse': return False
+    if yes: return True
+    if not sys.stdin.isatty():
+        print("Use --yes to generate it anyway")
+        return False
+    return input("Generate anyway? [y/N] ").strip().lower() in ("y", "yes")
+
+def load_config(path):
+    currentConfig = settings.SettingClass()
+    if os.path.exists(path): currentConfig.read_config(path)
+    else: print("Configuration file {} not found, using defaults".format(path))
+    return currentConfig
+
+def make_parser():
+    parser = argparse.ArgumentParser(description="Generate K-factor calibration pattern without GUI")
+    parser.add_argument("-c", "--config", default="Kcalibrator.cfg", help="configuration file (default: %(default)s)")
+    parser.add_argument("-o", "--output", help="output G-code file, binary G-code is written for .bgcode extension, compressed G-code for .gz and .zst (default: name made from K-factor range and temperatures)")
+    parser.add_argument("--binary", action="store_true", help="write binary G-code (.bgcode) to the default output file")
+    parser.add_argument("--level", type=int, help="compression level for .gz (1-9) and .zst (1-22) output")
+    parser.add_argument("--compression", choices=bgcode.compression_list, default="heatshrink12", help="compression of G-code blocks of binary G-code (default: %(default)s)")
+    parser.add_argument("--db", default=profiles.db_path, help="profile database for --printer, --firmware-profile, --nozzle and --filament (default: %(default)s)")
+    for kind in profiles.kind_list:
+        option = "--firmware-profile" if kind == 'firmware' else "--"+kind
+        parser.add_argument(option, dest=kind, metavar="NAME", help="apply {} profile NAME from the profile database".format(kind))
+    parser.add_argument("--record", type=float, metavar="K", help="add K-factor K measured on the pattern of the configuration to the calibration history of the profile database and exit")
+    parser.add_argument("--height", type=float, help="height in mm the K-factor of --record was measured at")
+    parser.add_argument("--predict", action="store_true", help="use K-factor range predicted from calibration history of the profile database")
+    parser.add_argument("--pattern", choices=settings.SettingClass().pattern_type_list, help="pattern type: K-factor or max volumetric flow (default: from configuration)")
+    parser.add_argument("--tools", type=int, metavar="N", help="calibrate tools T0..TN-1 of multi-tool printer in one job, one pattern per tool (default: from configuration)")
+    parser.add_argument("--bands", type=band_range, help="print only bands N-M of the pattern (bands are counted from 1)")
+    parser.add_argument("--no-brim", action="store_true", help="skip the brim and resume at the height of the first band on the existing pattern")
+    parser.add_argument("--estimate", action="store_true", help="only print estimated size and print time of the job")
+    parser.add_argument("--yes", action="store_true", help="generate jobs over the limits of the configuration without asking (limit_action Confirm)")
+    parser.add_argument("--validate", action="store_true", help="check generated G-code (bed bounds, extrusion, feed rates) and stop if it has errors")
+    parser.add_argument("--max-flow", type=float, help="maximum volumetric flow in mm3/s checked by --validate (default: max_volumetric_flow of the configuration)")
+    parser.add_argument("--upload", metavar="URL", help="upload G-code directly to the printer host at URL instead of saving it (also saved if --output is given)")
+    parser.add_argument("--host", choices=upload.host_list, default="Moonraker", help="printer host for --upload (default: %(default)s)")
+    parser.add_argument("--api-key", help="API key for the printer host")
+    parser.add_argument("--start", action="store_true", help="start printing after upload")
+    parser.add_argument("--serial", metavar="PORT", help="stream G-code to the printer connected to serial PORT instead of saving it (also saved if --output is given)")
+    parser.add_argument("--baud", type=int, default=115200, help="baud rate for --serial (default: %(default)s)")
+    parser.add_argument("--meatpack", action="store_true", help="pack G-code with MeatPack for --serial if the firmware supports it, or save packed stream to --output")
+    parser.add_argument("--flow", choices=serial_sender.flow_list, default="count", help="flow control for --serial: character counting or ping-pong (default: %(default)s)")
+    return parser
+
+def main(argv=None):
+    args = make_parser().parse_args(argv)
+    currentConfig = load_config(args.config)
+    names = {kind: getattr(args, kind) for kind in profiles.kind_list if getattr(args, kind)}
+    if names:
+        try:
+            with profiles.ProfileStore(args.db) as store: store.load(currentConfig, **names)
+        except (KeyError, ValueError) as e:
+            print(e.args[0])
+            return 1
+    if args.record is not None:
+        if currentConfig.pattern_type == 'Max flow' or args.pattern == 'Max flow':
+            print("Only K-factor results are recorded in the history")
+            return 1
+        with profiles.ProfileStore(args.db) as store: store.record(currentConfig, args.record, args.height)
+        print("K-factor {} recorded in the history".format(args.record))
+        return 0
+    if args.predict:
+        result = predict.predict_range(currentConfig, args.db)
+        if result is None: print("Not enough calibration results in the history, using configured K-factor range")
+        else:
+            currentConfig.k_start, currentConfig.k_end, currentConfig.k_step = result
+            print("Predicted K-factor range: {} to {} by {}".format(*result))
+    if args.pattern: currentConfig.pattern_type = args.pattern
+    if args.tools: currentConfig.tool_count = max(args.tools, 1)
+    try: generator.plate_layout(currentConfig)
+    except ValueError as e:
+        print(e)
+        return 1
+    for config in generator.plate_configs(currentConfig):
+        for warning in generator.flow_warnings(config): print("Warning: "+warning)
+    for warning in generator.plate_warnings(currentConfig): print("Warning: "+warning)
+    first, last = args.bands if args.bands else (0, None)
+    if first >= generator.band_count(currentConfig):
+        print("Pattern has only {} bands".format(generator.band_count(currentConfig)))
+        return 1
+    job = cost.estimate(currentConfig, first, last, not args.no_brim)
+    print("Estimated job: "+job.text())
+    if args.estimate: return 0
+    messages = cost.exceeded(job, currentConfig)
+    if messages and not confirm_limits(messages, currentConfig, args.yes): return 1
+    if args.validate:
+        max_flow = args.max_flow or (currentConfig.max_volumetric_flow if currentConfig.pattern_type != 'Max flow' else None) or None
+        report = validator.validate(generator.generate(currentConfig, first, last, not args.no_brim), currentConfig, max_flow)
+        print(validator.report_text(report))
+        if report['error_count']: return 1
+    path = args.output or generator.default_filename(currentConfig)
+    if args.binary and not args.output: path = os.path.splitext(path)[0]+".bgcode"
+    if args.meatpack and not args.serial and (path.lower().endswith(".bgcode") or compress.is_compressed(path)):
+        print("--meatpack can not be combined with binary or compressed output (binary G-code is packed anyway)")
+        return 1
+    if args.upload:
+        uploader = upload.Uploader(args.upload, args.host, args.api_key)
+        if path.lower().endswith(".bgcode"): encoded = lambda: bgcode.bgcode_chunks(currentConfig, first, last, not args.no_brim, compression=args.compression)
+        elif compress.is_compressed(path): encoded = lambda: compress.compressed_chunks(path, generator.generate(currentConfig, first, last, not args.no_brim), args.level)
+        else: encoded = lambda: generator.generate(currentConfig, first, last, not args.no_brim)
+        try: uploader.upload(os.path.basename(path), encoded, args.start) # the host gets the file in the format its name says
+        except (IOError, ValueError) as e:
+            print(e)
+            return 1
+        print("G-code uploaded to {}".format(args.upload))
+        if not args.output: return 0
+    if args.serial:
+        port = serial_sender.open_port(args.serial, args.baud)
+        try:
+            sender = serial_sender.Sender(port, args.flow, use_meatpack=args.meatpack)
+            sender.wait_start()
+            print(serial_sender.report(sender.send(generator.generate(currentConfig, first, last, not args.no_brim))))
+        except IOError as e:
+            print(e)
+            return 1
+        finally:
+            port.close()
+        if not args.output: return 0
+    if path.lower().endswith(".bgcode"):
+        bgcode.write_bgcode(currentConfig, path, first, last, not args.no_brim, compression=args.compression)
+        print("Binary G-code saved to {}".format(path))
+        return 0
+    if compress.is_compressed(path):
+        try: size = compress.write_chunks(path, generator.generate(currentConfig, first, last, not args.no_brim), args.level)
+        except ValueError as e:
+            print(e)
+            return 1
+        print("G-code ({} kB) saved to {} ({} kB)".format(round(size/1024), path, round(os.path.getsize(path)/1024)))
+        return 0
+    if args.meatpack and not args.serial:
+        with open(path, "wb") as out:
+            out.writelines(meatpack.Encoder().pack(generator.generate(currentConfig, first, last, not args.no_brim)))
+        print("MeatPack stream saved to {}".format(path))
+        return 0
+    generator.write_gcode(currentConfig, path, first, last, not args.no_brim)
+    print("G-code saved to {}".format(path))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
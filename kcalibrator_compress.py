@@ -0,0 +1,74 @@
+#! /usr/bin/env python
+#  -*- coding: utf-8 -*-
+# author: Victor Shapovalov (@ArtificalSUN, https://github.com/ArtificalSUN), 2022
+
+"""
+Compressed output of generated G-code for archiving
+G-code is compressed while it is generated: .gz (gzip, always available) or .zst (Zstandard, requires zstandard package)
+Layers of the pattern differ only in Z and K-factor, so files are compressed many times
+"""
+
+import os, gzip, io, zlib
+
+try:
+    import zstandard # optional
+except ImportError:
+    zstandard = None
+
+suffix_list = ['.gz', '.zst',]
+
+def is_compressed(path):
+    return os.path.splitext(path)[1].lower() in suffix_list
+
+def open_sink(path, level = None):
+    """
+    Opens binary file object compressing everything written to it according to the extension of the path
+    level is the compression level (1-9 for gzip, 1-22 for zstd), default level of the library if None
+    """
+    suffix = os.path.splitext(path)[1].lower()
+    if suffix == '.gz':
+        return gzip.GzipFile(path, "wb", compresslevel=9 if level is None else level, mtime=0) # mtime=0 makes archives of the same G-code identical
+    if suffix == '.zst':
+        if zstandard is None: raise ValueError("zstandard package is required for .zst files")
+        compressor = zstandard.ZstdCompressor(level=3 if level is None else level)
+        return compressor.stream_writer(open(path, "wb"), closefd=True)
+    return open(path, "wb")
+
+def open_source(path):
+    """
+    Opens (compressed) G-code file for reading as text
+    """
+    suffix = os.path.splitext(path)[1].lower()
+    if suffix == '.gz': return gzip.open(path, "rt")
+    if suffix == '.zst':
+        if zstandard is None: raise ValueError("zstandard package is required for .zst files")
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True))
+    return open(path, "r")
+
+def write_chunks(path, chunks, level = None):
+    """
+    Writes G-code pieces to (compressed) file, returns number of uncompressed bytes
+    """
+    size = 0
+    with open_sink(path, level) as out:
+        for chunk in chunks:
+            data = chunk.encode()
+            out.write(data)
+            size += len(data)
+    return size
+
+def compressed_chunks(path, chunks, level = None):
+    """
+    Generator compressing G-code pieces according to the extension of the path (for uploads of compressed files)
+    Yields compressed bytes, raises ValueError for unknown extension, missing zstandard package or wrong level
+    """
+    suffix = os.path.splitext(path)[1].lower()
+    if suffix == '.gz': compressor = zlib.compressobj(9 if level is None else level, zlib.DEFLATED, 31) # gzip format without file name and time
+    elif suffix == '.zst':
+        if zstandard is None: raise ValueError("zstandard package is required for .zst files")
+        compressor = zstandard.ZstdCompressor(level=3 if level is None else level).compressobj()
+    else: raise ValueError("Unknown compression of {}".format(path))
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data: yield data
+    yield compressor.flush()
@@ -0,0 +1,121 @@
+#! /usr/bin/env python
+#  -*- coding: utf-8 -*-
+# author: Victor Shapovalov (@ArtificalSUN, https://github.com/ArtificalSUN), 2022
+
+"""
+Cost of the job estimated before generation: bands, lines, moves, size of G-code, memory, print time and filament
+Only the brim with the first band and the last band are generated and measured with the validator, other bands are interpolated,
+so the estimate takes as long as a few layers however large the job is
+Jobs over the limits of the configuration (limit_bands, limit_size, limit_time) are refused or confirmed by the user before generation
+"""
+
+import os, sys, argparse
+
+import kcalibrator_settings as settings
+import kcalibrator_generator as generator
+import kcalibrator_validate as validator
+
+line_overhead = 57 # bytes of memory for every line held in a list besides its text (string object and list slot)
+counters = ('lines', 'moves', 'bytes', 'seconds', 'filament')
+
+class LimitError(ValueError):
+    """
+    Job is over the limits of the configuration
+    """
+
+class Cost:
+    """
+    Estimated cost of the job
+    """
+    def __init__(self, bands, layers, lines, moves, size, memory, seconds, filament):
+        self.bands = bands
+        self.layers = layers
+        self.lines = lines
+        self.moves = moves
+        self.bytes = size
+        self.memory = memory # peak memory of streaming generation (the largest layer is built as a list)
+        self.seconds = seconds # print time without acceleration and heating
+        self.filament = filament # mm
+
+    def text(self):
+        return "{b} bands, {l} layers, {m} moves, {s}, about {t}".format(b=self.bands, l=self.layers, m=self.moves, s=size_text(self.bytes), t=time_text(self.seconds))
+
+def size_text(size):
+    return "{:.1f} MB".format(size/(1 << 20)) if size >= 1 << 20 else "{:.0f} kB".format(size/1024)
+
+def time_text(seconds):
+    minutes = int(round(seconds/60))
+    return "{}h {:02d}min".format(minutes//60, minutes%60) if minutes >= 60 else "{} min".format(minutes)
+
+def measure(currentConfig, *args):
+    """
+    Returns dict with counters of the G-code generated with args of generator.generate
+    """
+    size = [0]
+    def counted(chunks):
+        for chunk in chunks:
+            size[0] += len(chunk)
+            yield chunk
+    report = validator.validate(counted(generator.generate(currentConfig, *args)), currentConfig, max_errors=0)
+    return {'lines': report['lines'], 'moves': report['moves'], 'bytes': size[0], 'seconds': report['seconds'], 'filament': report['filament']}
+
+def difference(a, b):
+    return {key: a[key]-b[key] for key in counters}
+
+def estimate(currentConfig, first_band = 0, last_band = None, with_brim = True):
+    """
+    Returns Cost of the job generated with the same arguments as generator.generate
+    Start and end G-code, brim, the first and the last band are measured, bands in between are interpolated
+    (speeds of max flow pattern change from band to band, so its bands differ in print time)
+    """
+    bands = generator.band_count(currentConfig)
+    last_band = bands-1 if last_band is None else min(last_band, bands-1)
+    count = max(last_band-first_band+1, 0)
+    frame = measure(currentConfig, 0, -1, False) # start and end G-code without any band
+    first = difference(measure(currentConfig, first_band, first_band, False), frame) if count else dict.fromkeys(counters, 0)
+    last = difference(measure(currentConfig, last_band, last_band, False), frame) if count > 1 else first
+    brim = difference(difference(measure(currentConfig, first_band, first_band, True), frame), first) if with_brim else dict.fromkeys(counters, 0)
+    total = {key: frame[key]+brim[key]+count*(first[key]+last[key])/2 for key in counters}
+    memory = max(brim['bytes']+brim['lines']*line_overhead, first['bytes']+first['lines']*line_overhead)
+    return Cost(count, count*generator.layout(currentConfig)[0]+(1 if with_brim else 0), int(round(total['lines'])), int(round(total['moves'])),
+                int(round(total['bytes'])), int(memory), total['seconds'], total['filament'])
+
+def exceeded(cost, currentConfig):
+    """
+    Returns messages for every limit of the configuration the job is over (limits equal to 0 are not checked)
+    """
+    c = currentConfig
+    messages = []
+    if c.limit_bands and cost.bands > c.limit_bands: messages.append("{} bands, limit is {}".format(cost.bands, c.limit_bands))
+    if c.limit_size and cost.bytes > c.limit_size*(1 << 20): messages.append("{} of G-code, limit is {} MB".format(size_text(cost.bytes), c.limit_size))
+    if c.limit_time and cost.seconds > c.limit_time*60: messages.append("about {} of printing, limit is {}".format(time_text(cost.seconds), time_text(c.limit_time*60)))
+    return messages
+
+def check_limits(currentConfig, *args):
+    """
+    Returns Cost of the job, raises LimitError if it is over the limits (for services which can not ask the user)
+    """
+    cost = estimate(currentConfig, *args)
+    messages = exceeded(cost, currentConfig)
+    if messages: raise LimitError("Job is over the limits: "+"; ".join(messages))
+    return cost
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Estimate cost of the calibration job without generating it")
+    parser.add_argument("-c", "--config", default="Kcalibrator.cfg", help="configuration file (default: %(default)s)")
+    args = parser.parse_args(argv)
+    currentConfig = settings.SettingClass()
+    if os.path.exists(args.config): currentConfig.read_config(args.config)
+    try: generator.plate_layout(currentConfig)
+    except ValueError as e:
+        print(e)
+        return 1
+    cost = estimate(currentConfig)
+    print(cost.text())
+    print("{} lines, memory {}, filament {:.2f} m".format(cost.lines, size_text(cost.memory), cost.filament/1000))
+    messages = exceeded(cost, currentConfig)
+    for message in messages: print("Over the limit: "+message)
+    return 1 if messages else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,161 @@
+#! /usr/bin/env python
+#  -*- coding: utf-8 -*-
+# author: Victor Shapovalov (@ArtificalSUN, https://github.com/ArtificalSUN), 2022
+
+"""
+Fleet dispatcher: generates calibration patterns for many printers and uploads them concurrently
+Printers are described in a fleet file, every section is one printer:
+
+[Voron-1]
+url = http://voron1.local:7125
+host = Moonraker
+firmware = Klipper
+temperature = (240, 100)
+
+Keys url, host, api_key, start and config (base configuration file) describe the printer host,
+all other keys override settings of the base configuration (see Kcalibrator.cfg)
+"""
+
+import os, sys, time, argparse, asyncio, configparser
+
+import kcalibrator_settings as settings
+import kcalibrator_generator as generator
+import kcalibrator_upload as upload
+import kcalibrator_compress as compress
+import kcalibrator_cost as cost
+
+host_keys = ['url', 'host', 'api_key', 'start', 'config']
+
+class PrinterJob:
+    """
+    Calibration job for one printer of the fleet and its status
+    """
+    def __init__(self, name, currentConfig, url, host = 'Moonraker', api_key = None, start = False, archive = None):
+        self.name = name
+        self.config = currentConfig
+        self.url = url
+        self.host = host
+        self.api_key = api_key
+        self.start = start
+        self.archive = archive # path of compressed copy of the uploaded G-code
+        self.status = 'pending'
+        self.attempts = 0
+        self.seconds = 0.0
+        self.bytes = 0
+        self.error = None
+
+    def gcode(self): # generates G-code of the job counting its size, archives it on the way if needed
+        self.bytes = 0
+        if self.archive: # temporary file is renamed only after complete G-code is written
+            partial = os.path.join(os.path.dirname(self.archive), "."+os.path.basename(self.archive))
+            out = compress.open_sink(partial)
+        else: out = None
+        try:
+            for chunk in generator.generate(self.config):
+                self.bytes += len(chunk)
+                if out: out.write(chunk.encode())
+                yield chunk
+            if out:
+                out.close()
+                os.replace(partial, self.archive)
+        finally:
+            if out: out.close()
+
+def read_fleet(path, base = "Kcalibrator.cfg", archive = None, archive_format = '.gz'):
+    """
+    Reads fleet file and returns list of printer jobs
+    With archive directory G-code of every printer is also saved compressed to archive/<printer>/<file name><archive_format>
+    """
+    fleet = configparser.ConfigParser()
+    fleet.optionxform = str # setting names are case sensitive
+    if not fleet.read(path): raise IOError("Fleet file {} not found".format(path))
+    jobs = []
+    for name in fleet.sections():
+        section = fleet[name]
+        currentConfig = settings.SettingClass()
+        try:
+            if 'url' not in section: raise ValueError("Printer {} has no url".format(name))
+            config_path = os.path.join(os.path.dirname(path), section['config']) if 'config' in section else base
+            if os.path.exists(config_path): currentConfig.read_config(config_path)
+            currentConfig.apply_overrides({key: value for key, value in section.items() if key not in host_keys})
+            archive_path = os.path.join(archive, name, generator.default_filename(currentConfig)+archive_format) if archive else None
+            jobs.append(PrinterJob(name, currentConfig, section['url'], section.get('host', 'Moonraker'), section.get('api_key'), section.getboolean('start', False), archive_path))
+        except Exception as e: # wrong printer is reported with the others instead of stopping the whole fleet
+            job = PrinterJob(name, currentConfig, section.get('url', ''))
+            job.status, job.error = 'failed', "Invalid printer profile: {}".format(e.args[0] if isinstance(e, KeyError) and e.args else e)
+            jobs.append(job)
+    return jobs
+
+async def run_job(job, semaphore, retries, delay, connections):
+    if job.status == 'failed': return job # invalid printer profile
+    started = time.perf_counter()
+    try:
+        async with semaphore:
+            try:
+                generator.plate_layout(job.config)
+                await asyncio.to_thread(cost.check_limits, job.config) # nobody to confirm jobs over the limits
+                uploader = upload.Uploader(job.url, job.host, job.api_key, connections)
+                if job.archive: os.makedirs(os.path.dirname(job.archive), exist_ok=True)
+            except Exception as e: # no use retrying wrong configuration
+                job.status, job.error = 'failed', str(e)
+                return job
+        while True:
+            job.attempts += 1
+            try:
+                async with semaphore: await asyncio.to_thread(uploader.upload, generator.default_filename(job.config), job.gcode, job.start)
+                job.status, job.error = 'ok', None
+                break
+            except Exception as e: # also http.client.HTTPException and errors of generation, other printers go on
+                job.status, job.error = 'failed', str(e) or type(e).__name__
+                if job.attempts > retries: break
+            await asyncio.sleep(delay*2**(job.attempts-1)) # waiting printer does not take the slot of others
+    finally:
+        job.seconds = time.perf_counter()-started
+    return job
+
+async def dispatch(jobs, parallel = 4, retries = 2, delay = 1.0, connections = None):
+    """
+    Generates and uploads all jobs with at most parallel uploads at once
+    Failed uploads are retried with exponential backoff, returns jobs with their status
+    """
+    semaphore = asyncio.Semaphore(parallel)
+    connections = connections or upload.pool
+    return await asyncio.gather(*(run_job(job, semaphore, retries, delay, connections) for job in jobs))
+
+def report(jobs, elapsed):
+    """
+    Returns timing report of the dispatched jobs as text
+    """
+    lines = ["{:<20} {:<7} {:>8} {:>8} {:>9}".format("Printer", "Status", "Attempts", "Time, s", "Size, kB")]
+    for job in jobs:
+        lines.append("{:<20} {:<7} {:>8} {:>8.2f} {:>9.0f}".format(job.name, job.status, job.attempts, job.seconds, job.bytes/1024))
+        if job.error: lines.append("    {}".format(job.error))
+    times = [job.seconds for job in jobs] or [0.0]
+    ok = sum(job.status == 'ok' for job in jobs)
+    lines.append("Total: {ok} ok, {f} failed in {t:.2f} s (sum of job times {s:.2f} s, mean {m:.2f} s, max {x:.2f} s)".format(
+        ok=ok, f=len(jobs)-ok, t=elapsed, s=sum(times), m=sum(times)/len(times), x=max(times)))
+    return "\n".join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate and upload K-factor calibration patterns to a fleet of printers")
+    parser.add_argument("fleet", help="fleet file with printer profiles")
+    parser.add_argument("-c", "--config", default="Kcalibrator.cfg", help="base configuration file (default: %(default)s)")
+    parser.add_argument("-p", "--parallel", type=int, default=4, help="maximum number of concurrent uploads (default: %(default)s)")
+    parser.add_argument("--retries", type=int, default=2, help="number of retries of failed uploads (default: %(default)s)")
+    parser.add_argument("--archive", metavar="DIR", help="also save compressed G-code of every printer to DIR/<printer>/")
+    parser.add_argument("--archive-format", choices=compress.suffix_list, default=".gz", help="compression of archived G-code (default: %(default)s)")
+    args = parser.parse_args(argv)
+    if args.archive_format == '.zst' and compress.zstandard is None:
+        print("zstandard package is required for .zst archives")
+        return 1
+    try: jobs = read_fleet(args.fleet, args.config, args.archive, args.archive_format)
+    except (IOError, KeyError, ValueError) as e:
+        print(e)
+        return 1
+    started = time.perf_counter()
+    jobs = asyncio.run(dispatch(jobs, args.parallel, args.retries))
+    print(report(jobs, time.perf_counter()-started))
+    return 0 if all(job.status == 'ok' for job in jobs) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,209 @@
+#! /usr/bin/env python
+#  -*- coding: utf-8 -*-
+# author: Victor Shapovalov (@ArtificalSUN, https://github.com/ArtificalSUN), 2022
+
+"""
+Fuzzing of the generator across the configuration space
+Random configurations (mostly defaults with some settings changed to edge values: zero and negative steps, descending ranges,
+odd path fractions, Delta beds, several patterns and tools) are generated in parallel worker processes with time and memory limits
+and the G-code is checked with the validator: moves inside the bed and build volume, extrusion never goes backwards,
+expected number of layers, no negative pressure advance, termination within the time and memory limits
+Configurations rejected with ValueError before generation are fine (that is how invalid settings are reported to the user)
+Every case is reproducible from its seed, failing cases are shrunk to the smallest set of changed settings which still fails
+"""
+
+import os, re, sys, time, random, argparse, multiprocessing, multiprocessing.connection
+
+import kcalibrator_settings as settings
+import kcalibrator_generator as generator
+import kcalibrator_validate as validator
+
+try:
+    import resource # optional, limits memory of the worker processes (Unix only)
+except ImportError:
+    resource = None
+
+change_rate = 0.25 # probability that a setting is changed from its default
+negative_advance = re.compile(r"^(?:M900 (?:T\d+ )?K|SET_PRESSURE_ADVANCE .*ADVANCE=|M572 D\d+ S)-", re.M) # pressure advance commands with negative value
+ok_results = ('ok', 'rejected')
+
+def fraction_triples(rng): # path_spd_fractions: normal, zero parts, not summing to one
+    return rng.choice([(0.2, 0.6, 0.2), (0.0, 1.0, 0.0), (0.5, 0.0, 0.5), (0.1, 0.5, 0.4), (0.3, 0.3, 0.3), (0.4, 0.4, 0.4),
+                       tuple(round(rng.uniform(0, 1), 2) for i in range(3))])
+
+# setting -> function returning random value (edge values are chosen more often than a uniform range would give)
+space = {
+    'pattern_type': lambda rng: rng.choice(['K-factor', 'Max flow']),
+    'k_start': lambda rng: rng.choice([0.0, 0.0, 0.05, 0.5, 1.0, -0.05, round(rng.uniform(-0.1, 1.5), 3)]),
+    'k_end': lambda rng: rng.choice([0.0, 0.1, 0.2, 0.5, 1.0, -0.1, round(rng.uniform(-0.1, 1.5), 3)]),
+    'k_step': lambda rng: rng.choice([0.0, 0.001, 0.005, 0.01, 0.02, 0.05, 0.1, -0.01, 1.0, round(rng.uniform(0, 0.1), 4)]),
+    'layers_per_k': lambda rng: rng.choice([1, 1, 2, 3, 5, 10, 20]),
+    'k_mode': lambda rng: rng.choice(['Bands', 'Segmented', 'Ramp']),
+    'k_segments': lambda rng: rng.choice([2, 4]),
+    'flow_start': lambda rng: rng.choice([0.0, 1.0, 5.0, 20.0, round(rng.uniform(0, 30), 1)]),
+    'flow_end': lambda rng: rng.choice([0.0, 5.0, 15.0, 30.0, round(rng.uniform(0, 30), 1)]),
+    'flow_step': lambda rng: rng.choice([0.0, 0.5, 1.0, 2.5, 5.0, -1.0]),
+    'speed_slow': lambda rng: rng.choice([1.0, 5.0, 20.0, 60.0, round(rng.uniform(1, 100), 1)]),
+    'speed_fast': lambda rng: rng.choice([20.0, 100.0, 300.0, round(rng.uniform(1, 500), 1)]),
+    'max_volumetric_flow': lambda rng: rng.choice([0.0, 2.0, 8.0, 25.0]),
+    'cap_to_flow': lambda rng: rng.random() < 0.5,
+    'z_offset': lambda rng: rng.choice([0.0, -0.1, 0.1, 0.5]),
+    'size': lambda rng: rng.choice([(140.0, 70.0), (20.0, 20.0), (60.0, 30.0), (200.0, 100.0), (300.0, 300.0), (5.0, 5.0)]),
+    'retract': lambda rng: rng.choice([(4.0, 30.0), (0.0, 30.0), (0.8, 40.0), (10.0, 60.0)]),
+    'bed_size': lambda rng: rng.choice([(235.0, 235.0, 250.0), (120.0, 120.0, 120.0), (350.0, 350.0, 400.0), (180.0, 180.0, 20.0), (200.0, 200.0, 300.0)]),
+    'temperature': lambda rng: (rng.choice([190, 210, 250, 300]), rng.choice([0, 60, 110])),
+    'path_spd_fractions': fraction_triples,
+    'retract_at_layer_change': lambda rng: rng.random() < 0.5,
+    'double_perimeter': lambda rng: rng.random() < 0.5,
+    'use_ABL': lambda rng: rng.random() < 0.5,
+    'ABL_type': lambda rng: rng.choice(['G29', 'M83', 'G32', 'BED_MESH_CALIBRATE']),
+    'firmware': lambda rng: rng.choice(['Marlin/Lerdge', 'Klipper', 'RepRapFirmware']),
+    'kinematics': lambda rng: rng.choice(['Cartesian', 'Delta']),
+    'def_fil_dia': lambda rng: rng.choice([1.75, 2.85]),
+    'def_line_width': lambda rng: rng.choice([0.2, 0.4, 0.6, 1.0]),
+    'def_layer': lambda rng: rng.choice([0.05, 0.1, 0.2, 0.3]),
+    'def_speed_print': lambda rng: rng.choice([10.0, 40.0, 100.0]),
+    'def_speed_travel': lambda rng: rng.choice([50.0, 160.0, 500.0]),
+    'plate_spacing': lambda rng: rng.choice([0.0, 10.0, 30.0]),
+    'tool_count': lambda rng: rng.choice([1, 2, 3]),
+    'plate_patterns': lambda rng: [{'temperature': rng.choice([200, 220]), 'k_end': rng.choice([0.05, 0.1])} for i in range(rng.choice([2, 3, 4]))],
+}
+
+def random_overrides(seed):
+    """
+    Returns settings changed from defaults for the case with seed
+    """
+    rng = random.Random(seed)
+    return {key: make(rng) for key, make in space.items() if rng.random() < change_rate}
+
+def make_config(overrides):
+    currentConfig = settings.SettingClass()
+    for key, value in overrides.items(): setattr(currentConfig, key, value)
+    return currentConfig
+
+def expected_top(currentConfig):
+    """
+    Returns Z of the last layer of the job: brim layer and all bands of the tallest pattern
+    """
+    return currentConfig.def_layer*(1+generator.band_count(currentConfig)*generator.layout(currentConfig)[0])
+
+def check(overrides):
+    """
+    Generates G-code for the configuration and checks it, returns dict with result ('ok', 'rejected', 'error', 'invalid'),
+    message, output size and generation time
+    """
+    started = time.perf_counter()
+    result = {'result': 'ok', 'message': "", 'bytes': 0, 'seconds': 0.0}
+    try:
+        currentConfig = make_config(overrides)
+        try: generator.plate_layout(currentConfig)
+        except ValueError as e:
+            result.update(result='rejected', message=str(e))
+            return result
+        negative = []
+        def counted(chunks): # counts bytes of the G-code passed to the validator and looks for negative pressure advance
+            for chunk in chunks:
+                result['bytes'] += len(chunk)
+                if not negative: negative.extend(negative_advance.findall(chunk))
+                yield chunk
+        report = validator.validate(counted(generator.generate(currentConfig)), currentConfig, max_errors=5)
+        top = expected_top(currentConfig)
+        if negative:
+            result.update(result='invalid', message="negative pressure advance: {}".format(negative[0]))
+        elif report['error_count']:
+            result.update(result='invalid', message="; ".join("line {}: {}".format(*error) for error in report['errors']))
+        elif abs(report['max'][2]-top) > 1e-3 or abs(report['min'][2]-currentConfig.def_layer) > 1e-3:
+            result.update(result='invalid', message="extrusion from Z{:.3f} to Z{:.3f}, expected Z{:.3f} to Z{:.3f}".format(report['min'][2], report['max'][2], currentConfig.def_layer, top))
+    except MemoryError:
+        result.update(result='memory', message="memory limit exceeded")
+    except Exception as e:
+        result.update(result='error', message="{}: {}".format(type(e).__name__, e))
+    finally:
+        result['seconds'] = time.perf_counter()-started
+    return result
+
+def worker(connection, overrides, memory_limit):
+    if resource is not None and memory_limit:
+        limit = memory_limit << 20
+        try: resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        except (ValueError, OSError): pass
+    try: connection.send(check(overrides))
+    finally: connection.close()
+
+def run_cases(cases, jobs = None, timeout = 10.0, memory_limit = 1024):
+    """
+    Checks cases (list of (name, overrides)) in parallel worker processes, one process per case, so hanging generation can be killed
+    Yields (name, overrides, result) in the order the cases finish
+    """
+    jobs = jobs or os.cpu_count() or 1
+    context = multiprocessing.get_context()
+    waiting = list(cases)[::-1]
+    running = [] # (process, connection, name, overrides, deadline)
+    while waiting or running:
+        while waiting and len(running) < jobs:
+            name, overrides = waiting.pop()
+            receiver, sender = context.Pipe(duplex=False)
+            process = context.Process(target=worker, args=(sender, overrides, memory_limit), daemon=True)
+            process.start()
+            sender.close()
+            running.append((process, receiver, name, overrides, time.monotonic()+timeout))
+        ready = multiprocessing.connection.wait([item[1] for item in running], timeout=min(item[4] for item in running)-time.monotonic()) if running else []
+        still = []
+        for item in running:
+            process, receiver, name, overrides, deadline = item
+            if receiver in ready:
+                try: result = receiver.recv()
+                except EOFError: result = None
+                process.join()
+                receiver.close()
+                if result is None: result = {'result': 'error', 'message': "worker died with exit code {}".format(process.exitcode), 'bytes': 0, 'seconds': 0.0}
+                yield name, overrides, result
+            elif time.monotonic() >= deadline:
+                process.kill()
+                process.join()
+                receiver.close()
+                yield name, overrides, {'result': 'timeout', 'message': "generation did not finish in {} s".format(timeout), 'bytes': 0, 'seconds': timeout}
+            else: still.append(item)
+        running = still
+
+def failed(result):
+    return result['result'] not in ok_results
+
+def shrink(overrides, result, timeout = 10.0, memory_limit = 1024):
+    """
+    Returns the smallest overrides found which fail the same way: settings are reset to defaults one by one while the case still fails
+    """
+    current = dict(overrides)
+    for key in list(overrides):
+        candidate = {k: v for k, v in current.items() if k != key}
+        for name, o, r in run_cases([(key, candidate)], 1, timeout, memory_limit):
+            if r['result'] == result['result']: current = candidate
+    return current
+
+def describe(overrides):
+    return ", ".join("{}={!r}".format(key, value) for key, value in sorted(overrides.items())) or "defaults"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fuzz the generator with random configurations and check the G-code")
+    parser.add_argument("-n", "--cases", type=int, default=200, help="number of random configurations (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first case, case i uses seed+i (default: %(default)s)")
+    parser.add_argument("-j", "--jobs", type=int, help="number of worker processes (default: number of processors)")
+    parser.add_argument("--timeout", type=float, default=10.0, help="time limit of one generation in seconds (default: %(default)s)")
+    parser.add_argument("--memory", type=int, default=1024, help="memory limit of one worker in MB (default: %(default)s)")
+    parser.add_argument("--no-shrink", action="store_true", help="report failing configurations without shrinking them")
+    args = parser.parse_args(argv)
+    cases = [(args.seed+i, random_overrides(args.seed+i)) for i in range(args.cases)]
+    counts, failures, slowest = {}, [], (0.0, None)
+    for seed, overrides, result in run_cases(cases, args.jobs, args.timeout, args.memory):
+        counts[result['result']] = counts.get(result['result'], 0)+1
+        if result['seconds'] > slowest[0]: slowest = (result['seconds'], seed)
+        if failed(result): failures.append((seed, overrides, result))
+    for seed, overrides, result in sorted(failures, key=lambda item: item[0]):
+        if not args.no_shrink: overrides = shrink(overrides, result, args.timeout, args.memory)
+        print("seed {}: {} - {}\n  {}".format(seed, result['result'], result['message'], describe(overrides)))
+    print(", ".join("{} {}".format(count, name) for name, count in sorted(counts.items())))
+    if slowest[1] is not None: print("Slowest: seed {} in {:.2f} s".format(slowest[1], slowest[0]))
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,573 @@
+#! /usr/bin/env python
+#  -*- coding: utf-8 -*-
+# author: Victor Shapovalov (@ArtificalSUN, https://github.com/ArtificalSUN), 2022
+
+"""
+G-code generator for the K-factor calibration pattern
+Works without GUI, so the pattern can be generated from any other module
+"""
+
+versionstring = "Kcalibrator v1.0.4-bugfix (Victor Shapovalov, 2022)"
+import copy
+from decimal import Decimal
+from math import pi, sqrt, sin, cos, ceil, floor
+
+def moveabs(position, *args): # absolute move from position to new_position
+    new_position = position[:]
+    try:
+        for i, coordinate in enumerate(args): new_position[i]=coordinate
+    except IndexError: pass
+    return new_position
+
+def moverel(position, *args): # relative move from position to new_position
+    new_position = position[:]
+    try:
+        for i, coordinate in enumerate(args): new_position[i]+=coordinate
+    except IndexError: pass
+    return new_position
+
+def cornerMoves(startAngle, radius, center):
+    moves = []
+
+    movements_per_quater_circle = 50
+    for k in range(0, movements_per_quater_circle):
+        angle = startAngle - (k / movements_per_quater_circle) * pi / 2
+        moves.append((center[0] + cos(angle) * radius, center[1] + sin(angle) * radius))
+    return moves
+
+class Extruder: # virtual extruder class
+    def __init__(self, e, currentConfig):
+        self.e = e
+        self.def_line_width = currentConfig.def_line_width
+        self.def_layer = currentConfig.def_layer
+        # self.flow = currentConfig.def_flow
+        self.def_flow = 1.0
+        self.def_fil_dia = currentConfig.def_fil_dia
+
+    def extrude(self, l, width=None, height=None, flow=None, dia = None):
+        f = float(flow) if flow else self.def_flow
+        w = float(width) if width else self.def_line_width
+        h = float(height) if height else self.def_layer
+        d = float(dia) if dia else self.def_fil_dia
+        V = f*w*l*h
+        L = V*4/(pi*d**2)
+        self.e+=L
+        return self.e
+
+    def retract(self): pass
+    def deretract(self): pass
+
+
+def rectangle(x_center, y_center, x_size, y_size): # construct rectangle from center
+    return [(x_center-x_size/2, y_center-y_size/2), (x_center-x_size/2, y_center+y_size/2), (x_center+x_size/2, y_center+y_size/2), (x_center+x_size/2, y_center-y_size/2)]
+
+def G1(position, length, speed):
+    return "G1 X{p[0]:.3f} Y{p[1]:.3f} Z{p[2]:.3f} E{l:.5f} F{s}\n".format(p=position, l=length, s=speed*60)
+
+def G0(position, speed):
+    return "G0 X{p[0]:.3f} Y{p[1]:.3f} Z{p[2]:.3f} F{s}\n".format(p=position, s=speed*60)
+
+def M900(k, fw = 'Marlin/Lerdge', tool = None): # tool is given only in multi-tool jobs
+    if tool is not None: return M900_tool(k, fw, tool)
+    if fw=='Marlin/Lerdge': return "M900 K{kf:.3f}\nM117 K={kf:.3f}\n".format(kf=k)
+    elif fw=='Klipper': return "SET_PRESSURE_ADVANCE ADVANCE={kf:.3f}\n".format(kf=k)
+    elif fw=='RepRapFirmware': return "M572 D0 S{kf:.3f}\n".format(kf=k)
+    else: return "M900 K{kf:.3f}\nM117 K={kf:.3f}\n".format(kf=k)
+
+def M109_wait(fw): # parameter of M109 waiting for the temperature also when cooling (M109 S of Marlin and RepRapFirmware waits only when heating)
+    return "S" if fw=='Klipper' else "R"
+
+def M900_tool(k, fw, tool): # pressure advance of one tool of multi-tool printer
+    if fw=='Klipper': return "SET_PRESSURE_ADVANCE EXTRUDER={e} ADVANCE={kf:.3f}\n".format(e="extruder" if tool == 0 else "extruder{}".format(tool), kf=k)
+    elif fw=='RepRapFirmware': return "M572 D{t} S{kf:.3f}\n".format(t=tool, kf=k)
+    else: return "M900 T{t} K{kf:.3f}\nM117 T{t} K={kf:.3f}\n".format(t=tool, kf=k)
+
+def ABL(use, ABL_cmd = "G29"):
+    if not use: return ""
+    else: return ABL_cmd+"\n"
+
+def dist(start, end):
+    return sqrt((end[0]-start[0])**2+(end[1]-start[1])**2+(end[2]-start[2])**2)
+
+
+def bed_center(currentConfig):
+    return (currentConfig.bed_size[0]/2, currentConfig.bed_size[1]/2) if not currentConfig.kinematics=="Delta" else (0.0, 0.0)
+
+def brim_width(currentConfig):
+    return 10*currentConfig.def_line_width*0.9
+
+def volumetric_flow(currentConfig, speed): # mm3/s extruded at speed with default line width and layer height
+    return currentConfig.def_line_width*currentConfig.def_layer*speed
+
+def capped_speed(currentConfig, speed):
+    """
+    Returns speed reduced to maximum volumetric flow (rounded down to 0.1 mm/s) if capping is enabled
+    """
+    if not (currentConfig.cap_to_flow and currentConfig.max_volumetric_flow > 0): return speed
+    limit = floor(currentConfig.max_volumetric_flow/(currentConfig.def_line_width*currentConfig.def_layer)*10+1e-6)/10
+    return min(speed, limit)
+
+def flow_rates(currentConfig):
+    """
+    Returns {segment type: (speed, volumetric flow)} for segments of the pattern with capping applied
+    """
+    speeds = {'First layer': currentConfig.def_speed_print, 'Fast': currentConfig.speed_fast, 'Slow': currentConfig.speed_slow}
+    return {name: (capped_speed(currentConfig, v), volumetric_flow(currentConfig, capped_speed(currentConfig, v))) for name, v in speeds.items()}
+
+def flow_warnings(currentConfig):
+    """
+    Returns list of warnings for segments exceeding maximum volumetric flow (empty if there is no limit)
+    and for capping which leaves fast segments no faster than slow ones (the pattern shows no effect of K then)
+    """
+    if not currentConfig.max_volumetric_flow > 0 or currentConfig.pattern_type == 'Max flow': return [] # flow pattern exceeds the limit on purpose
+    rates = flow_rates(currentConfig)
+    warnings = ["{n} segments need {f:.1f} mm3/s at {v} mm/s, hotend maximum is {m} mm3/s".format(n=name, f=flow, v=speed, m=currentConfig.max_volumetric_flow)
+                for name, (speed, flow) in rates.items() if flow > currentConfig.max_volumetric_flow+1e-9]
+    if currentConfig.speed_fast > currentConfig.speed_slow and rates['Fast'][0] <= rates['Slow'][0]:
+        warnings.append("Fast segments are capped from {f} to {v} mm/s by maximum flow of {m} mm3/s, they are not faster than slow segments at {s} mm/s".format(
+            f=currentConfig.speed_fast, v=rates['Fast'][0], m=currentConfig.max_volumetric_flow, s=rates['Slow'][0]))
+    return warnings
+
+def plate_warnings(currentConfig):
+    """
+    Returns list of warnings for patterns of the plate printed by one tool at different temperatures
+    (the hotend waits for the temperature of every pattern on every layer, so such plates take much longer)
+    """
+    patterns = plate_configs(currentConfig)
+    warnings = []
+    for tool in sorted(set(pattern.tool for pattern in patterns)):
+        temperatures = sorted(set(pattern.temperature[0] for pattern in patterns if pattern.tool == tool))
+        if len(temperatures) > 1:
+            warnings.append("Tool T{t} prints patterns at {T} C, the hotend is heated or cooled at every pattern switch on every layer (print them with different tools or in separate jobs)".format(
+                t=tool, T=", ".join(str(T) for T in temperatures)))
+    return warnings
+
+def pattern_footprint(currentConfig): # (X, Y) size of the pattern together with its brim
+    return (currentConfig.size[0]+2*brim_width(currentConfig), currentConfig.size[1]+2*brim_width(currentConfig))
+
+def plate_configs(currentConfig):
+    """
+    Returns list of configurations for every pattern on the plate
+    Each pattern is a copy of the main configuration with its own overrides applied,
+    without [Pattern] sections every tool of multi-tool job prints one pattern
+    """
+    if not currentConfig.plate_patterns and currentConfig.tool_count < 2: return [currentConfig]
+    patterns = []
+    for overrides in currentConfig.plate_patterns or [{'tool': i} for i in range(currentConfig.tool_count)]:
+        pattern = copy.copy(currentConfig)
+        for key, value in overrides.items():
+            if key == 'temperature': pattern.temperature = (int(value), currentConfig.temperature[1])
+            else: setattr(pattern, key, value)
+        patterns.append(pattern)
+    return patterns
+
+def multi_tool(patterns): # job uses other tools than the default one
+    return any(pattern.tool != 0 for pattern in patterns)
+
+def fits_on_bed(currentConfig, center, footprint, margin = 5.0):
+    """
+    Checks that rectangle of footprint size placed at center lies on the bed (round bed for Delta)
+    """
+    corners = rectangle(center[0], center[1], footprint[0], footprint[1])
+    if currentConfig.kinematics == 'Delta':
+        return all(sqrt(x**2+y**2) <= currentConfig.bed_size[0]/2-margin for x, y in corners)
+    return all(margin <= x <= currentConfig.bed_size[0]-margin and margin <= y <= currentConfig.bed_size[1]-margin for x, y in corners)
+
+def check_pattern(currentConfig):
+    """
+    Raises ValueError for settings of the pattern which would give invalid G-code
+    """
+    if currentConfig.def_layer <= 0 or currentConfig.def_line_width <= 0: raise ValueError("Line width and layer height must be positive")
+    if currentConfig.def_layer+currentConfig.z_offset <= 0: raise ValueError("Z offset moves the nozzle into the bed")
+    if currentConfig.pattern_type == 'Max flow':
+        if min(currentConfig.flow_start, currentConfig.flow_end) <= 0: raise ValueError("Volumetric flow must be positive")
+    else:
+        if min(currentConfig.k_start, currentConfig.k_end) < 0: raise ValueError("K-factor can not be negative")
+        if min(currentConfig.speed_slow, currentConfig.speed_fast) <= 0: raise ValueError("Speeds must be positive")
+
+def job_top(currentConfig): # height the nozzle is lifted to above the whole pattern at the end of the job
+    return currentConfig.def_layer*(1+band_count(currentConfig)*layout(currentConfig)[0])+end_lift
+
+def plate_layout(currentConfig):
+    """
+    Places all patterns of the plate on the bed in a grid around the bed center
+    Returns list of pattern centers, raises ValueError if settings of some pattern are invalid or patterns do not fit into the build volume
+    """
+    patterns = plate_configs(currentConfig)
+    for pattern in patterns: check_pattern(pattern)
+    top = job_top(currentConfig)
+    if top > currentConfig.bed_size[2]: raise ValueError("Pattern is {h:.1f} mm high, it does not fit into {z} mm of build height".format(h=top-end_lift, z=currentConfig.bed_size[2]))
+    count = len(patterns)
+    center = bed_center(currentConfig)
+    footprint = pattern_footprint(currentConfig)
+    if count < 2:
+        if not fits_on_bed(currentConfig, center, footprint): raise ValueError("Pattern of {s[0]}x{s[1]} mm does not fit on the bed".format(s=currentConfig.size))
+        return [center]
+    gap = currentConfig.plate_spacing
+    for cols in range(1, count+1): # patterns are usually wide, so stacking them along Y is tried first
+        rows = int(ceil(count/cols))
+        x0 = center[0]-((cols-1)*(footprint[0]+gap))/2
+        y0 = center[1]+((rows-1)*(footprint[1]+gap))/2
+        centers = [(x0+(i%cols)*(footprint[0]+gap), y0-(i//cols)*(footprint[1]+gap)) for i in range(count)]
+        if all(fits_on_bed(currentConfig, c, footprint) for c in centers): return centers
+    raise ValueError("{n} patterns of {s[0]}x{s[1]} mm do not fit on the bed".format(n=count, s=currentConfig.size))
+
+def decimals(value): # number of decimal places of the value as it was entered
+    return min(max(-Decimal(repr(float(value))).normalize().as_tuple().exponent, 0), 9)
+
+class KSequence:
+    """
+    Sequence of K-factors of the sweep: k_i = k_start + i*k_step
+    Every value is computed directly from its index and rounded to the precision of k_start and k_step, so there is no accumulated error
+    The last value may overshoot k_end by less than a step, descending ranges are supported, zero step gives single value
+    """
+    def __init__(self, k_start, k_end, k_step):
+        self.start = k_start
+        self.step = abs(k_step) if k_end >= k_start else -abs(k_step)
+        self.decimals = max(decimals(k_start), decimals(k_step))
+        self.count = int(ceil(round(abs(k_end-k_start)/abs(k_step), 9)))+1 if k_step else 1
+
+    @classmethod
+    def from_config(cls, currentConfig):
+        return cls(currentConfig.k_start, currentConfig.k_end, currentConfig.k_step)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if isinstance(i, slice): return [self[j] for j in range(*i.indices(self.count))]
+        if not 0 <= i < self.count: raise IndexError("K-factor index out of range") # negative indexes are heights below the pattern, they do not wrap around
+        return round(self.start + i*self.step, self.decimals)
+
+    def __iter__(self):
+        return (self[i] for i in range(self.count))
+
+    def index(self, k):
+        """
+        Returns index of the value nearest to k, raises ValueError if k is outside of the sweep
+        """
+        i = int(round((k-self.start)/self.step)) if self.step else 0
+        if not 0 <= i < self.count: raise ValueError("K-factor {} is outside of the sweep".format(k))
+        return i
+
+# moves of the perimeter where K-factor is switched in segmented mode (each segment contains one or two corners)
+segment_starts = {1: [0], 2: [0, 5], 4: [0, 3, 5, 8]}
+segment_names = {1: ['Whole layer'], 2: ['Left', 'Right'], 4: ['Back-left', 'Front-left', 'Front-right', 'Back-right']}
+
+def k_layout(mode, layers_per_k, segments):
+    """
+    Returns (number of layers printed with one set of K-factors, number of K-factors along one layer) for K-factor mode
+    Bands: every K-factor is printed for layers_per_k full layers
+    Segmented: K-factor is switched several times along the perimeter, so one band of layers covers several K-factors
+    Ramp: K-factor is changed by one step on every layer
+    """
+    if mode == 'Ramp': return 1, 1
+    if mode == 'Segmented': return layers_per_k, segments
+    return layers_per_k, 1
+
+def pattern_height(k_start, k_end, k_step, layer, layers_per_k, mode = 'Bands', segments = 1):
+    """
+    Returns height of the pattern above the brim
+    """
+    layers, per_layer = k_layout(mode, layers_per_k, segments)
+    return int(ceil(len(KSequence(k_start, k_end, k_step))/per_layer))*layers*layer
+
+def k_at_height(height, k_start, k_end, k_step, layer, layers_per_k, mode = 'Bands', segments = 1, segment = 0):
+    """
+    Returns K-factor printed at measured height (and segment of the perimeter for segmented mode)
+    Raises IndexError if the height is above or below the pattern
+    """
+    layers, per_layer = k_layout(mode, layers_per_k, segments)
+    return KSequence(k_start, k_end, k_step)[int(floor(height/(layer*layers)))*per_layer + min(segment, per_layer-1)]
+
+def sweep(currentConfig): # values changed from band to band: K-factors or volumetric flows
+    if currentConfig.pattern_type == 'Max flow': return KSequence(currentConfig.flow_start, currentConfig.flow_end, currentConfig.flow_step)
+    return KSequence.from_config(currentConfig)
+
+def layout(currentConfig): # (number of layers in one band, number of values along one layer) of the pattern
+    if currentConfig.pattern_type == 'Max flow': return currentConfig.layers_per_k, 1
+    return k_layout(currentConfig.k_mode, currentConfig.layers_per_k, currentConfig.k_segments)
+
+def flow_speed(currentConfig, flow): # speed giving volumetric flow with default line width and layer height, rounded to 0.1 mm/s
+    return round(flow/(currentConfig.def_line_width*currentConfig.def_layer), 1)
+
+def flow_at_height(height, flow_start, flow_end, flow_step, layer, layers_per_band):
+    """
+    Returns volumetric flow printed at measured height of the max flow pattern
+    Raises IndexError if the height is above or below the pattern
+    """
+    return KSequence(flow_start, flow_end, flow_step)[int(floor(height/(layer*layers_per_band)))]
+
+def with_flow(currentConfig, flow):
+    """
+    Returns copy of the configuration printing whole perimeter at the speed of the volumetric flow
+    """
+    pattern = copy.copy(currentConfig)
+    pattern.speed_slow = pattern.speed_fast = flow_speed(currentConfig, flow)
+    pattern.cap_to_flow = False
+    return pattern
+
+def flow_message(flow):
+    return "M117 Flow={f} mm3/s\n".format(f=flow)
+
+
+def start_gcode(currentConfig, ex):
+    return \
+    """;Generated with {vs}
+M190 S{T_b}
+M109 S{T_h}
+G28
+{ABL}G90
+M82
+{zeroadv}G92 E0
+G0 Z{zo:.3f} F300
+G92 Z{zl:.3f}
+G0 Z2 F600
+M106 S{C}\n""".format(vs = versionstring, T_h=currentConfig.temperature[0], T_b=currentConfig.temperature[1], C=int(currentConfig.def_cooling/100*255), zl=currentConfig.def_layer, zo=currentConfig.def_layer+currentConfig.z_offset, F_t=currentConfig.def_speed_travel*60, F_p=currentConfig.def_speed_print*60, X1=1, Y1=10,
+                            Y2=currentConfig.bed_size[1]-10, X2=1+currentConfig.def_line_width, E1=ex.extrude(currentConfig.bed_size[1]-20), E2 = ex.extrude(currentConfig.bed_size[1]-20), ABL = ABL(currentConfig.use_ABL, currentConfig.ABL_type), zeroadv = M900(0, currentConfig.firmware))
+
+def delta_home(currentConfig):
+    """
+    Homing of Delta printer for resumed job: homing clears the Z offset, so the nozzle is moved to a known height above the pattern
+    and the offset is set again like in start G-code (the Z of the first job is the Z of the printer minus z_offset)
+    """
+    top = job_top(currentConfig)
+    return "G28\nG0 Z{z:.3f} F600\nG92 Z{zo:.3f}".format(z=top, zo=top-currentConfig.z_offset)
+
+def resume_gcode(currentConfig):
+    """
+    Start G-code for printing on top of the existing pattern: the nozzle is lifted off the pattern, X and Y are homed, then heating
+    Z is neither homed nor probed over the pattern, so the printer must keep its Z position since the pattern was printed
+    (Delta printers home all towers at the top of the build volume, away from the pattern, and set the Z offset of the first job again)
+    """
+    return \
+    """;Generated with {vs}
+{home}
+G90
+M190 S{T_b}
+M109 S{T_h}
+M82
+{zeroadv}G92 E0
+M106 S{C}\n""".format(vs = versionstring, T_h=currentConfig.temperature[0], T_b=currentConfig.temperature[1], C=int(currentConfig.def_cooling/100*255),
+                            home = delta_home(currentConfig) if currentConfig.kinematics == "Delta" else "G91\nG0 Z{lift} F600\nG28 X Y".format(lift=end_lift), zeroadv = M900(0, currentConfig.firmware))
+
+end_lift = 5 # mm the nozzle is lifted above the pattern at the end
+
+def end_gcode(currentConfig):
+    return \
+    """M104 S0
+M140 S0
+M107
+G91{retr}
+G0 Z{lift} F600
+G90
+G0 X0 Y0 F{F_t}""".format(retr = "" if currentConfig.retract_at_layer_change else "\nG1 E-{R} F{RS}".format(R=currentConfig.retract[0], RS = currentConfig.retract[1]*60), lift = end_lift, F_t = currentConfig.def_speed_travel*60)
+
+def brim(currentConfig, center, current_pos, ex):
+    """
+    Returns first layer moves (brim around the pattern at center) and position after the brim
+    """
+    layer = []
+    brimStart = -10
+    brim_line_width = currentConfig.def_line_width * 0.9
+    for i in range(10, brimStart, -1):
+        rect = rectangle(center[0], center[1], currentConfig.size[0]+2*i*brim_line_width, currentConfig.size[1]+2*i*brim_line_width)
+        if i > 0:
+            loop = []
+            rect = rectangle(center[0], center[1], currentConfig.size[0]+2*i*brim_line_width, currentConfig.size[1]+2*i*brim_line_width)
+
+            corner_radius = i*brim_line_width
+            loop.append((rect[-1][0] - corner_radius, rect[-1][1]))
+
+            c = (rect[0][0] + corner_radius, rect[0][1] + corner_radius)
+            loop += cornerMoves(-pi / 2, corner_radius, c)
+
+            c = (rect[1][0] + corner_radius, rect[1][1] - corner_radius)
+            loop += cornerMoves(pi, corner_radius, c)
+
+            c = (rect[2][0] - corner_radius, rect[2][1] - corner_radius)
+            loop += cornerMoves(pi / 2, corner_radius, c)
+
+            c = (rect[3][0] - corner_radius, rect[3][1] + corner_radius)
+            loop += cornerMoves(0, corner_radius, c)
+        else:
+            loop = rect
+
+        next_pos = moveabs(current_pos, loop[-1][0], loop[-1][1])
+        layer.append(G0(next_pos, currentConfig.def_speed_travel))
+        current_pos = next_pos[:]
+        for point in loop:
+            next_pos = moveabs(current_pos, point[0], point[1])
+            layer.append(G1(next_pos, ex.extrude(dist(current_pos, next_pos)), capped_speed(currentConfig, currentConfig.def_speed_print)))
+            current_pos = next_pos[:]
+    return layer, current_pos
+
+def perimeter(currentConfig, center, size, z, ex, closing_x = None):
+    """
+    Returns moves of one pattern perimeter starting and ending at the middle of its back side
+    closing_x is the X coordinate used to calculate extrusion of the closing move (left corner of the perimeter by default)
+    """
+    corners = rectangle(center[0], center[1], size[0], size[1])
+    closing_x = corners[1][0] if closing_x is None else closing_x
+    fr = currentConfig.path_spd_fractions
+    slow, fast = capped_speed(currentConfig, currentConfig.speed_slow), capped_speed(currentConfig, currentConfig.speed_fast)
+    return [G1((corners[1][0]+size[0]*fr[0], corners[1][1], z), ex.extrude(abs(corners[1][0]+size[0]*fr[0]-center[0])), slow),
+            G1((corners[1][0], corners[1][1], z), ex.extrude(abs(size[0]*fr[2])), fast),
+            G1((corners[1][0], corners[0][1]+size[1]/2, z), ex.extrude(abs(size[1]/2)), fast),
+            G1((corners[0][0], corners[0][1], z), ex.extrude(abs(size[1]/2)), slow),
+            G1((corners[0][0]+size[0]*fr[0], corners[0][1], z), ex.extrude(abs(size[0]*fr[0])), slow),
+            G1((corners[3][0]-size[0]*(fr[2]), corners[0][1], z), ex.extrude(abs(size[0]*fr[1])), fast),
+            G1((corners[3][0], corners[3][1], z), ex.extrude(abs(size[0]*fr[2])), slow),
+            G1((corners[3][0], corners[3][1]+size[1]/2, z), ex.extrude(abs(size[1]/2)), slow),
+            G1((corners[2][0], corners[2][1], z), ex.extrude(abs(size[1]/2)), fast),
+            G1((corners[2][0]-size[0]*fr[2], corners[2][1], z), ex.extrude(abs(size[0]*fr[2])), fast),
+            G1((center[0]+currentConfig.def_line_width/2, center[1]+size[1]/2, z), ex.extrude(abs(closing_x+size[0]*fr[0]-center[0])), slow)]
+
+def with_switches(moves, switches):
+    if not switches: return moves
+    result = []
+    for i, move in enumerate(moves):
+        if i in switches: result.append(switches[i])
+        result.append(move)
+    return result
+
+def pattern_layer(currentConfig, center, z, ex, switches = None):
+    """
+    Returns moves of one pattern layer (one or two perimeters)
+    switches maps index of perimeter move to G-code inserted before it (K-factor changes in segmented mode)
+    """
+    switches = switches or {}
+    retr = "G1 E-{R} F{S}\n".format(R=currentConfig.retract[0], S=currentConfig.retract[1]*60)
+    layer = []
+    ex.e = 0
+    layer.append(G0((center[0], center[1]+currentConfig.size[1]/2, z), currentConfig.def_speed_travel))
+    layer.append("G1 E0 F{S}\n".format(S=currentConfig.retract[1]*60) if currentConfig.retract_at_layer_change else "")
+    layer.extend(with_switches(perimeter(currentConfig, center, currentConfig.size, z, ex), switches))
+    layer.extend(["G92 E0\n", retr if (currentConfig.retract_at_layer_change and not currentConfig.double_perimeter) else ""])
+
+    if currentConfig.double_perimeter:
+        size2 = (currentConfig.size[0]+2*currentConfig.def_line_width, currentConfig.size[1]+2*currentConfig.def_line_width)
+        closing_x = rectangle(center[0], center[1], currentConfig.size[0], currentConfig.size[1])[1][0]
+        ex.e = 0
+        layer.append(G0((center[0], center[1]+size2[1]/2, z), currentConfig.def_speed_travel))
+        layer.append("")
+        layer.extend(with_switches(perimeter(currentConfig, center, size2, z, ex, closing_x), switches))
+        layer.extend(["G92 E0\n", retr if currentConfig.retract_at_layer_change else ""])
+    return layer
+
+
+def band_count(currentConfig): # number of bands of layers in the pattern
+    layers, per_layer = layout(currentConfig)
+    return max(int(ceil(len(sweep(pattern))/per_layer)) for pattern in plate_configs(currentConfig))
+
+def generate(currentConfig, first_band = 0, last_band = None, with_brim = True):
+    """
+    Generator yielding G-code of the calibration plate piece by piece
+    Patterns of the plate are printed layer by layer in the same job, each with its own K-factor range, speeds, hotend temperature and tool
+    In max flow mode every band is printed at one speed increasing volumetric flow from band to band instead of K-factor
+    Only bands first_band..last_band (zero-based, inclusive) are printed if specified:
+    with brim they are printed from the bed as a separate pattern, without brim printing resumes at the height of first_band on the existing pattern
+    """
+    patterns = plate_configs(currentConfig)
+    centers = plate_layout(currentConfig)
+    tools = multi_tool(patterns) # tool changes and per-tool pressure advance are emitted only for multi-tool jobs
+    hotend = {0: currentConfig.temperature[0]} # temperature of every tool, start G-code heats the default one
+    tool_current = None
+    pattern_current = currentConfig
+    retracted = set() # tools parked with retracted filament, E position is -retract for them and 0 for the others between patterns
+
+    def retract(pattern):
+        return "G1 E-{R} F{S}\n".format(R=pattern.retract[0], S=pattern.retract[1]*60)
+
+    def switch(pattern, retract_next): # selects and heats the tool of the pattern, retract_next is the state the following moves expect
+        nonlocal tool_current, pattern_current
+        if tools and pattern.tool != tool_current:
+            if tool_current is not None and tool_current not in retracted: # parked tool does not ooze
+                retracted.add(tool_current)
+                yield "G92 E0\n"+retract(pattern_current)
+            tool_current = pattern.tool
+            yield "T{t}\n".format(t=tool_current)
+            yield "G92 E-{R}\n".format(R=pattern.retract[0]) if tool_current in retracted else "G92 E0\n"
+        pattern_current = pattern
+        if hotend.get(pattern.tool) != pattern.temperature[0]:
+            wait = "S" if hotend.get(pattern.tool) is None else M109_wait(currentConfig.firmware) # hotend heated before may have to cool down
+            hotend[pattern.tool] = pattern.temperature[0]
+            yield "M109 T{t} {w}{T}\n".format(t=pattern.tool, w=wait, T=pattern.temperature[0]) if tools else "M109 {w}{T}\n".format(w=wait, T=pattern.temperature[0])
+        if not tools: return
+        if retract_next and tool_current not in retracted:
+            retracted.add(tool_current)
+            yield retract(pattern)
+        elif not retract_next and tool_current in retracted:
+            retracted.discard(tool_current)
+            yield "G1 E0 F{S}\n".format(S=pattern.retract[1]*60)
+        ex.e = 0
+
+    ex = Extruder(0, currentConfig)
+    yield start_gcode(currentConfig, ex) if with_brim else resume_gcode(currentConfig)
+
+    #first layer
+    ex.e=0
+    current_pos = [1+currentConfig.def_line_width, 10, currentConfig.def_layer]
+    for pattern, center in zip(patterns, centers):
+        if not with_brim: break
+        yield from switch(pattern, False)
+        layer, current_pos = brim(pattern, center, current_pos, ex)
+        yield from layer
+    yield "G92 E0\n"
+    yield retract(pattern_current) if pattern_current.retract_at_layer_change else ""
+    if pattern_current.retract_at_layer_change: retracted.add(0 if tool_current is None else tool_current)
+
+    #pattern generation
+    current_z = current_pos[2]
+    flow_mode = currentConfig.pattern_type == 'Max flow'
+    layers, per_layer = layout(currentConfig)
+    bands = [list(sweep(pattern)) for pattern in patterns]
+    bands = [[k[j:j+per_layer] for j in range(0, len(k), per_layer)] for k in bands] # K-factors printed along one layer of every band
+    last_band = len(max(bands, key=len))-1 if last_band is None else last_band
+    bands = [k[first_band:last_band+1] for k in bands]
+    if not with_brim: # resume above the bands printed before
+        current_z += first_band*layers*currentConfig.def_layer
+        yield "G0 Z{z:.3f} F600\n".format(z=current_z+currentConfig.def_layer+2)
+    k_current = {} # K-factor (or flow) currently set for every tool
+    for i in range(max(len(k) for k in bands)*layers):
+        current_z+=currentConfig.def_layer
+        for pattern, center, k in zip(patterns, centers, bands):
+            band = i//layers
+            if band >= len(k): continue
+            yield from switch(pattern, pattern.retract_at_layer_change) # layers start with un-retraction if they end with retraction
+            tool = pattern.tool if tools else None
+            if flow_mode:
+                if k[band][0] != k_current.get(pattern.tool):
+                    k_current[pattern.tool] = k[band][0]
+                    yield flow_message(k[band][0])
+                yield from pattern_layer(with_flow(pattern, k[band][0]), center, current_z, ex)
+                continue
+            if per_layer > 1:
+                switches = {segment_starts[per_layer][j]: M900(kf, currentConfig.firmware, tool) for j, kf in enumerate(k[band])}
+                k_current[pattern.tool] = k[band][-1]
+                yield from pattern_layer(pattern, center, current_z, ex, switches)
+                continue
+            if k[band][0] != k_current.get(pattern.tool): # K-factor is global for the tool, so it is set again when switching patterns
+                k_current[pattern.tool] = k[band][0]
+                yield M900(k[band][0], currentConfig.firmware, tool)
+            yield from pattern_layer(pattern, center, current_z, ex)
+
+    yield end_gcode(currentConfig)
+
+def commands(chunks):
+    """
+    Splits G-code pieces into commands without comments and empty lines
+    """
+    for chunk in chunks:
+        for line in chunk.splitlines():
+            line = line.split(";", 1)[0].strip()
+            if line: yield line
+
+def write_gcode(currentConfig, path, *args, **kwargs):
+    with open(path, "w") as out:
+        out.writelines(generate(currentConfig, *args, **kwargs))
+
+def default_filename(currentConfig):
+    if currentConfig.pattern_type == 'Max flow':
+        return "MF_{b}-{e}-{s}_H{t[0]}-B{t[1]}.gcode".format(b=currentConfig.flow_start, e=currentConfig.flow_end, s=currentConfig.flow_step, t=currentConfig.temperature)
+    return "KF_{b}-{e}-{s}_H{t[0]}-B{t[1]}.gcode".format(b=currentConfig.k_start, e=currentConfig.k_end, s=currentConfig.k_step, t=currentConfig.temperature)
@@ -5,7 +5,7 @@
 # in conjunction with Tcl version 8.6
 # Jan 05, 2021 07:06:20 AM +03  platform: Windows NT
 
-import sys, re, math
+import sys, re, math, copy, queue, threading
 from math import sqrt
 
 try:
@@ -21,6 +21,10 @@ except ImportError:
     py3 = True
 
 import kcalibrator_gui_support
+import kcalibrator_generator as generator
+import kcalibrator_settings as settings
+import kcalibrator_preview as preview
+import kcalibrator_cost as cost
 
 def vp_start_gui():
     '''Starting point when module is the main routine.'''
@@ -82,8 +86,8 @@ class Toplevel:
         self.style.map('.',background=
             [('selected', _compcolor), ('active',_ana2color)])
 
-        top.geometry("620x400+400+250")
-        top.minsize(620, 400)
+        top.geometry("940x400+250+250")
+        top.minsize(940, 400)
         top.maxsize(1920, 1080)
         top.resizable(1, 1)
         top.title("Kcalibrator")
@@ -91,7 +95,11 @@ class Toplevel:
         top.configure(highlightbackground="#d9d9d9")
         top.configure(highlightcolor="black")
 
-        self.lf_PatternConfig = tk.LabelFrame(top)
+        self.fr_Settings = tk.Frame(top) # settings keep their layout, preview pane is placed to the right of them
+        self.fr_Settings.place(relx=0.0, rely=0.0, relheight=1.0, relwidth=0.66)
+        self.fr_Settings.configure(background="#d9d9d9")
+
+        self.lf_PatternConfig = tk.LabelFrame(self.fr_Settings)
         self.lf_PatternConfig.place(relx=0.016, rely=0.001, relheight=0.59
                 , relwidth=0.581)
         self.lf_PatternConfig.configure(relief='groove')
@@ -102,9 +110,19 @@ class Toplevel:
         self.lf_PatternConfig.configure(highlightbackground="#d9d9d9")
         self.lf_PatternConfig.configure(highlightcolor="black")
 
+        self.cmb_PatternType = ttk.Combobox(self.lf_PatternConfig, state = ("readonly",))
+        self.cmb_PatternType.place(relx=0.014, rely=0.085, relheight=0.085
+                , relwidth=0.264, bordermode='ignore')
+        self.cmb_PatternType.configure(font="-family {Segoe UI} -size 10 -weight normal -slant roman -underline 0 -overstrike 0")
+        self.cmb_PatternType.configure(takefocus="")
+        self.cmb_PatternType_var = tk.StringVar()
+        self.cmb_PatternType.configure(textvariable = self.cmb_PatternType_var)
+        self.ranges = {} # (start, stop, step) of K-factor and max flow patterns, entries show the range of the current one
+        self.range_type = None
+
         self._lbl_StartStopStep = ttk.Label(self.lf_PatternConfig)
-        self._lbl_StartStopStep.place(relx=0.014, rely=0.085, height=19
-                , width=299, bordermode='ignore')
+        self._lbl_StartStopStep.place(relx=0.292, rely=0.085, height=19
+                , width=55, bordermode='ignore')
         self._lbl_StartStopStep.configure(background="#d9d9d9")
         self._lbl_StartStopStep.configure(foreground="#000000")
         self._lbl_StartStopStep.configure(font="-family {Segoe UI} -size 10 -weight normal -slant roman -underline 0 -overstrike 0")
@@ -112,7 +130,27 @@ class Toplevel:
         self._lbl_StartStopStep.configure(anchor='w')
         self._lbl_StartStopStep.configure(justify='left')
         self._lbl_StartStopStep.configure(takefocus="0")
-        self._lbl_StartStopStep.configure(text='''Start, stop and step values for K-factor calibration''')
+        self._lbl_StartStopStep.configure(text='''range''')
+
+        self._lbl_KMode = ttk.Label(self.lf_PatternConfig)
+        self._lbl_KMode.place(relx=0.472, rely=0.085, height=19, width=45
+                , bordermode='ignore')
+        self._lbl_KMode.configure(background="#d9d9d9")
+        self._lbl_KMode.configure(foreground="#000000")
+        self._lbl_KMode.configure(font="-family {Segoe UI} -size 10 -weight normal -slant roman -underline 0 -overstrike 0")
+        self._lbl_KMode.configure(relief="flat")
+        self._lbl_KMode.configure(anchor='w')
+        self._lbl_KMode.configure(justify='left')
+        self._lbl_KMode.configure(takefocus="0")
+        self._lbl_KMode.configure(text='''Mode''')
+
+        self.cmb_KMode = ttk.Combobox(self.lf_PatternConfig, state = ("readonly",))
+        self.cmb_KMode.place(relx=0.636, rely=0.085, relheight=0.085
+                , relwidth=0.347, bordermode='ignore')
+        self.cmb_KMode.configure(font="-family {Segoe UI} -size 10 -weight normal -slant roman -underline 0 -overstrike 0")
+        self.cmb_KMode.configure(takefocus="")
+        self.cmb_KMode_var = tk.StringVar()
+        self.cmb_KMode.configure(textvariable = self.cmb_KMode_var)
 
         self.ent_StartK = ttk.Entry(self.lf_PatternConfig)
         self.ent_StartK.place(relx=0.189, rely=0.191, relheight=0.085
@@ -209,17 +247,41 @@ class Toplevel:
         self.ent_SlowSpeed_var = tk.StringVar()
         self.ent_SlowSpeed.configure(textvariable = self.ent_SlowSpeed_var)
 
-        self._lbl_Speeds = ttk.Label(self.lf_PatternConfig)
-        self._lbl_Speeds.place(relx=0.014, rely=0.426, height=22, width=325
+        self.lbl_Flow = ttk.Label(self.lf_PatternConfig)
+        self.lbl_Flow.place(relx=0.014, rely=0.426, height=22, width=190
                 , bordermode='ignore')
-        self._lbl_Speeds.configure(background="#d9d9d9")
-        self._lbl_Speeds.configure(foreground="#000000")
-        self._lbl_Speeds.configure(font="-family {Segoe UI} -size 10 -weight normal -slant roman -underline 0 -overstrike 0")
-        self._lbl_Speeds.configure(relief="flat")
-        self._lbl_Speeds.configure(anchor='w')
-        self._lbl_Speeds.configure(justify='left')
-        self._lbl_Speeds.configure(takefocus="0")
-        self._lbl_Speeds.configure(text='''Speed values for pattern generation''')
+        self.lbl_Flow.configure(background="#d9d9d9")
+        self.lbl_Flow.configure(foreground="#000000")
+        self.lbl_Flow.configure(font="-family {Segoe UI} -size 10 -weight normal -slant roman -underline 0 -overstrike 0")
+        self.lbl_Flow.configure(relief="flat")
+        self.lbl_Flow.configure(anchor='w')
+        self.lbl_Flow.configure(justify='left')
+        self.lbl_Flow.configure(takefocus="0")
+        self.lbl_Flow.configure(text='''Flow, mm³/s; max''')
+
+        self.ent_MaxFlow = ttk.Entry(self.lf_PatternConfig)
+        self.ent_MaxFlow.place(relx=0.542, rely=0.426, relheight=0.085
+                , relwidth=0.111, bordermode='ignore')
+        self.ent_MaxFlow.configure(takefocus="")
+        self.ent_MaxFlow_var = tk.StringVar()
+        self.ent_MaxFlow.configure(textvariable = self.ent_MaxFlow_var)
+
+        self.chk_CapFlow = tk.Checkbutton(self.lf_PatternConfig)
+        self.chk_CapFlow.place(relx=0.675, rely=0.415, relheight=0.094
+                , relwidth=0.31, bordermode='ignore')
+        self.chk_CapFlow.configure(activebackground="#ececec")
+        self.chk_CapFlow.configure(activeforeground="#000000")
+        self.chk_CapFlow.configure(background="#d9d9d9")
+        self.chk_CapFlow.configure(borderwidth="0")
+        self.chk_CapFlow.configure(disabledforeground="#a3a3a3")
+        self.chk_CapFlow.configure(font="-family {Segoe UI} -size 10 -weight normal -slant roman -underline 0 -overstrike 0")
+        self.chk_CapFlow.configure(foreground="#000000")
+        self.chk_CapFlow.configure(highlightbackground="#d9d9d9")
+        self.chk_CapFlow.configure(highlightcolor="black")
+        self.chk_CapFlow.configure(justify='left')
+        self.chk_CapFlow.configure(text='''cap speeds''')
+        self.chk_CapFlow_var = tk.BooleanVar()
+        self.chk_CapFlow.configure(variable=self.chk_CapFlow_var)
 
         self._lbl_LayersPerK = ttk.Label(self.lf_PatternConfig)
         self._lbl_LayersPerK.place(relx=0.014, rely=0.298, height=22, width=305
@@ -387,7 +449,7 @@ class Toplevel:
         self.TSeparator2.place(relx=-0.011, rely=0.753, relwidth=1.017
                 , bordermode='ignore')
 
-        self.lf_MachineConfig = tk.LabelFrame(top)
+        self.lf_MachineConfig = tk.LabelFrame(self.fr_Settings)
         self.lf_MachineConfig.place(relx=0.016, rely=0.6, relheight=0.313
                 , relwidth=0.581)
         self.lf_MachineConfig.configure(relief='groove')
@@ -554,7 +616,7 @@ class Toplevel:
         self.ent_BuildVolZ_var = tk.StringVar()
         self.ent_BuildVolZ.configure(textvariable = self.ent_BuildVolZ_var)
 
-        self.lf_PrintConfig = tk.LabelFrame(top)
+        self.lf_PrintConfig = tk.LabelFrame(self.fr_Settings)
         self.lf_PrintConfig.place(relx=0.613, rely=0.001, relheight=0.847
                 , relwidth=0.371)
         self.lf_PrintConfig.configure(relief='groove')
@@ -947,17 +1009,17 @@ class Toplevel:
         self.ent_Zoffset_var = tk.StringVar()
         self.ent_Zoffset.configure(textvariable = self.ent_Zoffset_var)
 
-        self.btn_SaveConfig = ttk.Button(top)
+        self.btn_SaveConfig = ttk.Button(self.fr_Settings)
         self.btn_SaveConfig.place(relx=0.605, rely=0.852, height=25, width=116)
         self.btn_SaveConfig.configure(takefocus="")
         self.btn_SaveConfig.configure(text='''Save configuration''')
 
-        self.btn_Generate = ttk.Button(top)
+        self.btn_Generate = ttk.Button(self.fr_Settings)
         self.btn_Generate.place(relx=0.798, rely=0.852, height=25, width=116)
         self.btn_Generate.configure(takefocus="")
         self.btn_Generate.configure(text='''Generate G-code''')
 
-        self._lbl_Kcalc1 = ttk.Label(top)
+        self._lbl_Kcalc1 = ttk.Label(self.fr_Settings)
         self._lbl_Kcalc1.place(relx=0.016, rely=0.925, height=22
                 , width=250, bordermode='ignore')
         self._lbl_Kcalc1.configure(background="#d9d9d9")
@@ -969,7 +1031,7 @@ class Toplevel:
         self._lbl_Kcalc1.configure(takefocus="0")
         self._lbl_Kcalc1.configure(text='''Height with the best quality:              mm''')
 
-        self.ent_Hmeasured = ttk.Entry(top)
+        self.ent_Hmeasured = ttk.Entry(self.fr_Settings)
         self.ent_Hmeasured.place(relx=0.283, rely=0.925, height=22
                 , width=50, bordermode='ignore')
         self.ent_Hmeasured.configure(takefocus="")
@@ -978,7 +1040,15 @@ class Toplevel:
         self.ent_Hmeasured.configure(textvariable = self.ent_Hmeasured_var)
         self.ent_Hmeasured.configure(validate = "key", validatecommand = (self.ent_Hmeasured.register(validate), "%P"))
 
-        self.lbl_K = ttk.Label(top)
+        self.cmb_Segment = ttk.Combobox(self.fr_Settings, state = ("readonly",))
+        self.cmb_Segment.place(relx=0.43, rely=0.925, height=22, width=100
+                , bordermode='ignore')
+        self.cmb_Segment.configure(font="-family {Segoe UI} -size 10 -weight normal -slant roman -underline 0 -overstrike 0")
+        self.cmb_Segment.configure(takefocus="")
+        self.cmb_Segment_var = tk.StringVar()
+        self.cmb_Segment.configure(textvariable = self.cmb_Segment_var)
+
+        self.lbl_K = ttk.Label(self.fr_Settings)
         self.lbl_K.place(relx=0.605, rely=0.925, height=22
                 , width=250, bordermode='ignore')
         self.lbl_K.configure(background="#d9d9d9")
@@ -990,11 +1060,55 @@ class Toplevel:
         self.lbl_K.configure(takefocus="0")
         self.lbl_K.configure(text=''' ''')
 
-        # self.btn_Calc = ttk.Button(top)
+        self.btn_Refine = ttk.Button(self.fr_Settings)
+        self.btn_Refine.place(relx=0.89, rely=0.92, height=25, width=62)
+        self.btn_Refine.configure(takefocus="")
+        self.btn_Refine.configure(text='''Refine''')
+
+        # self.btn_Calc = ttk.Button(self.fr_Settings)
         # self.btn_Calc.place(relx=0.385, rely=0.92, height=25, width=110)
         # self.btn_Calc.configure(takefocus="")
         # self.btn_Calc.configure(text='''Calculate K-factor''')
 
+        self.lf_Preview = tk.LabelFrame(top)
+        self.lf_Preview.place(relx=0.666, rely=0.001, relheight=0.985
+                , relwidth=0.323)
+        self.lf_Preview.configure(relief='groove')
+        self.lf_Preview.configure(font="-family {Segoe UI} -size 10 -weight bold -slant roman -underline 0 -overstrike 0")
+        self.lf_Preview.configure(foreground="black")
+        self.lf_Preview.configure(text='''Preview''')
+        self.lf_Preview.configure(background="#d9d9d9")
+        self.lf_Preview.configure(highlightbackground="#d9d9d9")
+        self.lf_Preview.configure(highlightcolor="black")
+
+        self.cnv_Top = tk.Canvas(self.lf_Preview)
+        self.cnv_Top.place(relx=0.02, rely=0.06, relheight=0.56, relwidth=0.96
+                , bordermode='ignore')
+        self.cnv_Top.configure(background="#ffffff")
+        self.cnv_Top.configure(highlightthickness=0)
+
+        self.cnv_Side = tk.Canvas(self.lf_Preview)
+        self.cnv_Side.place(relx=0.02, rely=0.64, relheight=0.27, relwidth=0.96
+                , bordermode='ignore')
+        self.cnv_Side.configure(background="#ffffff")
+        self.cnv_Side.configure(highlightthickness=0)
+
+        self.lbl_Cost = tk.Label(self.lf_Preview)
+        self.lbl_Cost.place(relx=0.02, rely=0.92, relheight=0.07, relwidth=0.96
+                , bordermode='ignore')
+        self.lbl_Cost.configure(anchor='w')
+        self.lbl_Cost.configure(background="#d9d9d9")
+        self.lbl_Cost.configure(foreground="#000000")
+        self.lbl_Cost.configure(font="-family {Segoe UI} -size 8")
+        self.lbl_Cost.configure(text='')
+
+        self.base_config = None # configuration loaded into the UI, preview applies the entries to its copy
+        self.preview_data = None # geometry of the last computed preview, redrawn on resize without recomputing
+        self.preview_key = None # settings the preview (or the running computation) was made for
+        self.preview_queue = queue.Queue() # results of the background computation
+        self.preview_thread = None
+        self.preview_after = None
+
     # Attaching traces and handlers
     def attach(self):
         self.ent_PatternXsize_var.trace_add('write', lambda name, index, mode: self.validate_pattern_X())
@@ -1005,6 +1119,7 @@ class Toplevel:
         self.ent_StartK_var.trace_add('write', lambda name, index, mode: self.validate_pattern_Z())
         self.ent_StartK_var.trace_add('write', lambda name, index, mode: self.calculate_K())
         self.ent_StopK_var.trace_add('write', lambda name, index, mode: self.validate_pattern_Z())
+        self.ent_StopK_var.trace_add('write', lambda name, index, mode: self.calculate_K())
         self.ent_StepK_var.trace_add('write', lambda name, index, mode: self.validate_pattern_Z())
         self.ent_StepK_var.trace_add('write', lambda name, index, mode: self.calculate_K())
         self.ent_LayersPerK_var.trace_add('write', lambda name, index, mode: self.validate_pattern_Z())
@@ -1012,10 +1127,20 @@ class Toplevel:
         self.ent_LayerHeight_var.trace_add('write', lambda name, index, mode: self.validate_pattern_Z())
         self.ent_LayerHeight_var.trace_add('write', lambda name, index, mode: self.calculate_K())
         self.ent_Hmeasured_var.trace_add('write', lambda name, index, mode: self.calculate_K())
+        self.cmb_Segment_var.trace_add('write', lambda name, index, mode: self.calculate_K())
+        self.cmb_KMode_var.trace_add('write', lambda name, index, mode: self.handle_KMode_cmb())
+        self.cmb_PatternType_var.trace_add('write', lambda name, index, mode: self.handle_PatternType_cmb())
         self.chk_UseAutoleveling.configure(command = self.handle_ABL_chk)
         # self.scl_CoolingPerc.configure(command = self.handle_Cooling_scl)
         self.scl_CoolingPerc_var.trace_add('write', lambda name, index, mode: self.handle_Cooling_scl())
         self.cmb_Kinematics_var.trace_add('write', lambda name, index, mode: self.handle_Kinematics_cmb())
+        for var in (self.ent_FastSpeed_var, self.ent_SlowSpeed_var, self.ent_FirstLayerSpeed_var, self.ent_LineWidth_var, self.ent_LayerHeight_var, self.ent_MaxFlow_var, self.chk_CapFlow_var):
+            var.trace_add('write', lambda name, index, mode: self.validate_flow())
+        for member in vars(self):
+            if member.endswith("_var") and isinstance(getattr(self, member), tk.Variable):
+                getattr(self, member).trace_add('write', lambda name, index, mode: self.schedule_preview())
+        self.cnv_Top.bind('<Configure>', lambda event: self.draw_preview())
+        self.cnv_Side.bind('<Configure>', lambda event: self.draw_preview())
 
     def register_validator(self):
         for member in vars(self):
@@ -1024,12 +1149,20 @@ class Toplevel:
                 entry.configure(validate = "key", validatecommand = (entry.register(validate), "%P"))
 
     def updateUI(self, config):
+        self.base_config = config
         self.ent_SlowSpeed_var.set(str(config.speed_slow))
         self.ent_FastSpeed_var.set(str(config.speed_fast))
-        self.ent_StartK_var.set(str(config.k_start))
-        self.ent_StopK_var.set(str(config.k_end))
-        self.ent_StepK_var.set(str(config.k_step))
+        self.ranges = {'K-factor': (str(config.k_start), str(config.k_end), str(config.k_step)), 'Max flow': (str(config.flow_start), str(config.flow_end), str(config.flow_step))}
+        self.range_type = None
+        self.cmb_PatternType.configure(values=config.pattern_type_list)
+        self.cmb_PatternType.set(config.pattern_type)
         self.ent_LayersPerK_var.set(str(config.layers_per_k))
+        self.ent_MaxFlow_var.set(str(config.max_volumetric_flow))
+        self.chk_CapFlow_var.set(config.cap_to_flow)
+        self.cmb_KMode.configure(values=config.k_mode_list)
+        self.cmb_KMode.set(config.k_mode)
+        self.cmb_Segment.configure(values=generator.segment_names[config.k_segments])
+        self.cmb_Segment.current(0)
         self.ent_Zoffset_var.set(str(config.z_offset))
 
         self.ent_PatternXsize_var.set(str(config.size[0]))
@@ -1066,17 +1199,24 @@ class Toplevel:
         self.lbl_CoolingPerc['text'] = '%s%%' % config.def_cooling
         self.scl_CoolingPerc.set(config.def_cooling/5)
 
+    def flow_mode(self):
+        return self.cmb_PatternType.get() == 'Max flow'
+
+    def range_values(self): # (start, stop, step) of both pattern types
+        ranges = dict(self.ranges)
+        ranges[self.cmb_PatternType.get()] = (self.ent_StartK.get(), self.ent_StopK.get(), self.ent_StepK.get())
+        return ranges
+
+    def k_mode(self):
+        if self.flow_mode(): return 'Bands', 1
+        segments = len(self.cmb_Segment.cget("values")) if self.cmb_KMode.get() == 'Segmented' else 1
+        return self.cmb_KMode.get(), segments
+
     def pattern_height(self):
         try:
-             # stopk = float(self.ent_StopK.get()) if self.ent_StopK.get() else 0.0
-             # startk = float(self.ent_StartK.get()) if self.ent_StartK.get() else 0.0
-             # stepk = float(self.ent_StepK.get()) if self.ent_StepK.get() else 0.0
-             # k_values = abs(stopk - startk)/stepk
-             # layerk = int(self.ent_LayersPerK.get()) if self.ent_LayersPerK.get() else 0
-             # layerh = float(self.ent_LayerHeight.get()) if self.ent_LayerHeight.get() else 0
-             # height = k_values * layerh * layerk
-             k_values = abs(float(self.ent_StopK.get())-float(self.ent_StartK.get()))/float(self.ent_StepK.get())
-             height = k_values * int(self.ent_LayersPerK.get()) * float(self.ent_LayerHeight.get())
+            mode, segments = self.k_mode()
+            height = generator.pattern_height(float(self.ent_StartK.get()), float(self.ent_StopK.get()), float(self.ent_StepK.get()),
+                                              float(self.ent_LayerHeight.get()), int(self.ent_LayersPerK.get()), mode, segments)
         except:
             height = 0
         return height
@@ -1085,16 +1225,26 @@ class Toplevel:
         try:
             H = float(self.ent_Hmeasured_var.get())
             Kn = float(self.ent_StartK_var.get())
+            Kk = float(self.ent_StopK_var.get())
             L = float(self.ent_LayerHeight_var.get())
             dK = float(self.ent_StepK_var.get())
-            Nsk = float(self.ent_LayersPerK_var.get())
-            result = Kn + int(H/(L*Nsk))*dK
+            Nsk = int(self.ent_LayersPerK_var.get())
+            if self.flow_mode():
+                result = generator.flow_at_height(H, Kn, Kk, dK, L, Nsk)
+                self.lbl_K['text'] = "Max flow = %s mm³/s" % round(result, 2)
+                self.lbl_K.configure(foreground="#007c00")
+                self.btn_Refine.configure(state = "disabled")
+                return result
+            mode, segments = self.k_mode()
+            result = generator.k_at_height(H, Kn, Kk, dK, L, Nsk, mode, segments, max(self.cmb_Segment.current(), 0))
             self.lbl_K['text'] = "Calculated K-factor = %s" % round(result, 3)
             self.lbl_K.configure(foreground="#007c00")
+            self.btn_Refine.configure(state = "!disabled")
             return result
         except:
             self.lbl_K['text'] = "Error calculating K-factor"
             self.lbl_K.configure(foreground="#ff0000")
+            self.btn_Refine.configure(state = "disabled")
 
     def validate_pattern_X(self):
         # size = float(self.ent_PatternXsize.get()) if self.ent_PatternXsize.get() else 0.0
@@ -1139,6 +1289,27 @@ class Toplevel:
         self.lbl_PatternZsize.configure(foreground="#000000" if result else "#ff0000")
         return result
 
+    def validate_flow(self):
+        """
+        Shows volumetric flow of fast and slow segments, marks speeds exceeding maximum flow (or reduced by capping)
+        """
+        try:
+            area = float(self.ent_LineWidth.get())*float(self.ent_LayerHeight.get())
+            limit = float(self.ent_MaxFlow.get()) if self.ent_MaxFlow.get() else 0.0
+            cap = self.chk_CapFlow_var.get() and limit > 0
+            flows = []
+            for entry in (self.ent_FastSpeed, self.ent_SlowSpeed, self.ent_FirstLayerSpeed):
+                flow = float(entry.get())*area
+                entry.configure(foreground = "#ff0000" if limit > 0 and flow > limit and not cap else "#c07000" if cap and flow > limit else "#000000")
+                flows.append(min(flow, limit) if cap else flow)
+            result = not (limit > 0 and max(flows) > limit)
+            self.lbl_Flow['text'] = "Flow %.1f/%.1f mm³/s; max" % (flows[0], flows[1])
+        except:
+            result = False
+            self.lbl_Flow['text'] = "Flow ?; max"
+        self.lbl_Flow.configure(foreground="#000000" if result else "#ff0000")
+        return result
+
     def handle_ABL_chk(self):
         self.cmb_AutolevelingType.configure(state = ("readonly",) if self.chk_UseAutoleveling_var.get() else ("disabled",))
 
@@ -1154,12 +1325,125 @@ class Toplevel:
             self.ent_BuildVolY.configure(state = "!disabled")
         self.revalidate_all()
 
+    def handle_PatternType_cmb(self):
+        """
+        Swaps the range shown in start/stop/step entries between K-factor and max flow patterns
+        """
+        new = self.cmb_PatternType.get()
+        if self.range_type is not None and self.range_type != new:
+            self.ranges[self.range_type] = (self.ent_StartK_var.get(), self.ent_StopK_var.get(), self.ent_StepK_var.get())
+        if new in self.ranges and new != self.range_type:
+            start, stop, step = self.ranges[new]
+            self.range_type = new
+            self.ent_StartK_var.set(start)
+            self.ent_StopK_var.set(stop)
+            self.ent_StepK_var.set(step)
+        self.range_type = new
+        flow = self.flow_mode()
+        self._lbl_KFrom['text'] = "From Q =" if flow else "From K ="
+        self._lbl_KTo['text'] = "to Q =" if flow else "to K ="
+        self._lbl_LayersPerK['text'] = "Number of layers printed with any specific flow" if flow else "Number of layers printed with any specific K-factor"
+        self.cmb_KMode.configure(state = ("disabled",) if flow else ("readonly",))
+        self.handle_KMode_cmb()
+
+    def handle_KMode_cmb(self):
+        self.cmb_Segment.configure(state = ("readonly",) if self.cmb_KMode.get() == 'Segmented' and not self.flow_mode() else ("disabled",))
+        self.validate_pattern_Z()
+        self.calculate_K()
+
+    def preview_config(self): # copy of the loaded configuration with values of the entries, None if some entry is invalid
+        try:
+            config = copy.deepcopy(self.base_config) if self.base_config is not None else settings.SettingClass()
+            config.updatesettings(self)
+        except:
+            return None
+        return config
+
+    def schedule_preview(self):
+        """
+        Updates the preview shortly after the last change, so typing into an entry does not start computation on every key
+        """
+        if self.preview_after: self.lf_Preview.after_cancel(self.preview_after)
+        self.preview_after = self.lf_Preview.after(300, self.start_preview)
+
+    def start_preview(self):
+        """
+        Starts computation of the preview in background thread if the settings have changed since the last one
+        """
+        self.preview_after = None
+        if self.preview_thread is not None: return # started again when the running computation finishes
+        config = self.preview_config()
+        if config is None: return
+        key = repr(sorted(vars(config).items()))
+        if key == self.preview_key: return # e.g. only measured height was changed
+        self.preview_key = key
+        self.preview_thread = threading.Thread(target=self.compute_preview, args=(config,), daemon=True)
+        self.preview_thread.start()
+        self.lf_Preview.after(50, self.poll_preview)
+
+    def compute_preview(self, config): # runs in background thread, so it must not touch widgets
+        try: data = preview.Preview(config)
+        except: data = None
+        try:
+            generator.plate_layout(config)
+            job = cost.estimate(config)
+            estimate = (job.text(), bool(cost.exceeded(job, config)))
+        except ValueError as e: estimate = (str(e), True) # e.g. pattern does not fit on the bed
+        except: estimate = ("", False)
+        self.preview_queue.put((data, estimate))
+
+    def poll_preview(self):
+        try: data = self.preview_queue.get_nowait()
+        except queue.Empty:
+            self.lf_Preview.after(50, self.poll_preview)
+            return
+        self.preview_thread = None
+        self.preview_data, (text, over) = data
+        self.lbl_Cost.configure(text=text, foreground="#ff0000" if over else "#000000")
+        self.draw_preview()
+        self.start_preview() # settings may have changed during computation
+
+    def draw_preview(self):
+        """
+        Draws top view of the plate and side view of the bands with their K-factors from the last computed preview
+        """
+        self.cnv_Top.delete("all")
+        self.cnv_Side.delete("all")
+        data = self.preview_data
+        if data is None or self.cnv_Top.winfo_width() < 20: return # not mapped yet
+        bounds = data.top_bounds()
+        to_screen = preview.transform(bounds, self.cnv_Top.winfo_width(), self.cnv_Top.winfo_height())
+        bed = to_screen(bounds[:2]) + to_screen(bounds[2:])
+        if data.delta: self.cnv_Top.create_oval(*bed, outline="#808080")
+        else: self.cnv_Top.create_rectangle(*bed, outline="#808080")
+        for lines, color in ((data.brim, "#a0a0a0"), (data.pattern, "#0050c8")):
+            for line in lines:
+                points = preview.decimate(line, to_screen)
+                if len(points) > 1: self.cnv_Top.create_line(*[c for point in points for c in point], fill=color)
+
+        if not data.bands: return
+        x_min, z_min, x_max, z_max = data.side_bounds()
+        to_screen = preview.transform((x_min, z_min, x_max, z_max), self.cnv_Side.winfo_width(), self.cnv_Side.winfo_height(), equal = False)
+        band_height = abs(to_screen((0, data.bands[0][1]))[1]-to_screen((0, data.bands[0][0]))[1])
+        every = max(1, math.ceil(14/max(band_height, 1e-9))) # labels of thin bands would overlap
+        x0, z0 = to_screen((x_min, z_min))
+        x1, z1 = to_screen((x_max, data.bands[0][0]))
+        self.cnv_Side.create_rectangle(x0, z0, x1, z1, fill="#a0a0a0", outline="") # brim
+        for i, (bottom, top, label) in enumerate(data.bands):
+            x0, z0 = to_screen((x_min, bottom))
+            x1, z1 = to_screen((x_max, top))
+            self.cnv_Side.create_rectangle(x0, z1, x1, z0, fill="#c8d8f0" if i % 2 else "#e8eef8", outline="")
+            if i % every == 0: self.cnv_Side.create_text((x0+x1)/2, (z0+z1)/2, text=label, font="-family {Segoe UI} -size 8")
+
     def revalidate_all(self):
         self.validate_pattern_X()
         self.validate_pattern_Y()
         self.validate_pattern_Z()
+        self.validate_flow()
         self.handle_ABL_chk()
         self.handle_Cooling_scl()
+        self.handle_KMode_cmb()
+        self.schedule_preview()
 
 # root = tk.Tk()
 # top = Toplevel(root)
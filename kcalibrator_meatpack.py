@@ -0,0 +1,148 @@
+#! /usr/bin/env python
+#  -*- coding: utf-8 -*-
+# author: Victor Shapovalov (@ArtificalSUN, https://github.com/ArtificalSUN), 2022
+
+"""
+MeatPack compression of G-code for serial streaming (supported by Marlin and Prusa firmware)
+15 most common G-code characters are packed into 4 bits, so two of them fit into one byte
+Characters which can not be packed are sent in full after the byte with their 0b1111 nibble
+With "no spaces" mode spaces are removed from commands and 'E' takes their place in the table
+"""
+
+from kcalibrator_generator import commands
+
+lookup = "0123456789. \nGX" # characters with 4-bit codes 0..14, code 15 marks a full character
+literal = 0b1111
+signal = 0xFF # two signal bytes are followed by a command
+enable_packing, disable_packing, reset_all, query_config, enable_no_spaces, disable_no_spaces = 0xFB, 0xFA, 0xF9, 0xF8, 0xF7, 0xF6
+
+def command(cmd):
+    return bytes((signal, signal, cmd))
+
+def supports_meatpack(m115):
+    """
+    Checks if M115 response of the firmware (list of lines) reports MeatPack capability (not disabled with Cap:MEATPACK:0)
+    """
+    lines = [(line.decode(errors="replace") if isinstance(line, bytes) else line).upper().replace(" ", "") for line in m115]
+    return any("MEATPACK" in line and "MEATPACK:0" not in line for line in lines)
+
+class Encoder:
+    """
+    Class to pack G-code lines
+    """
+    def __init__(self, no_spaces = True):
+        self.no_spaces = no_spaces
+        table = lookup.replace(" ", "E") if no_spaces else lookup
+        self.codes = {c: i for i, c in enumerate(table)}
+
+    def start(self): # commands enabling packing in the firmware
+        return command(enable_packing)+(command(enable_no_spaces) if self.no_spaces else command(disable_no_spaces))
+
+    def stop(self): # command disabling packing
+        return command(disable_packing)
+
+    def prepare(self, line):
+        """
+        Returns line as the firmware will see it (spaces are removed in no spaces mode except for messages of M117)
+        Checksums should be calculated from the prepared line
+        """
+        if not self.no_spaces or "M117" in line: return line
+        return line.replace(" ", "")
+
+    def encode(self, line):
+        """
+        Packs prepared line ending with newline
+        """
+        out = bytearray()
+        for i in range(0, len(line), 2):
+            first, second = line[i], line[i+1] if i+1 < len(line) else "\n" # after newline the second character is ignored by the firmware
+            c1, c2 = self.codes.get(first, literal), self.codes.get(second, literal)
+            out.append(c1 | c2 << 4)
+            if c1 == literal: out.append(ord(first))
+            if c2 == literal: out.append(ord(second))
+        return bytes(out)
+
+    def pack(self, chunks):
+        """
+        Generator yielding packed stream of G-code pieces (without comments and empty lines) enclosed in enabling and disabling commands
+        """
+        yield self.start()
+        for line in commands(chunks): yield self.encode(self.prepare(line)+"\n")
+        yield self.stop()
+
+class Decoder:
+    """
+    Class unpacking MeatPack stream the same way the firmware does
+    """
+    def __init__(self):
+        self.active = False
+        self.no_spaces = False
+        self.signals = 0
+        self.command_next = False
+        self.full_chars = 0
+        self.second = None
+
+    def char(self, code):
+        if code == lookup.index(" ") and self.no_spaces: return "E"
+        return lookup[code]
+
+    def inner(self, c, out):
+        if not self.active:
+            out.append(chr(c))
+        elif not self.full_chars:
+            c1, c2 = c & 0xF, c >> 4
+            if c1 == literal:
+                self.full_chars += 1
+                if c2 == literal: self.full_chars += 1
+                else: self.second = self.char(c2)
+            else:
+                out.append(self.char(c1))
+                if out[-1] != "\n":
+                    if c2 == literal: self.full_chars += 1
+                    else: out.append(self.char(c2))
+        else:
+            out.append(chr(c))
+            if self.second is not None:
+                out.append(self.second)
+                self.second = None
+            self.full_chars -= 1
+
+    def handle_command(self, cmd):
+        if cmd == enable_packing: self.active = True
+        elif cmd == disable_packing: self.active = False
+        elif cmd == enable_no_spaces: self.no_spaces = True
+        elif cmd == disable_no_spaces: self.no_spaces = False
+        elif cmd == reset_all: self.__init__()
+
+    def feed(self, data):
+        """
+        Returns text decoded from the next part of the stream
+        """
+        out = []
+        for c in data:
+            if c == signal:
+                if self.signals:
+                    self.command_next = True
+                    self.signals = 0
+                else: self.signals += 1
+                continue
+            if self.command_next:
+                self.handle_command(c)
+                self.command_next = False
+                continue
+            if self.signals:
+                self.inner(signal, out)
+                self.signals = 0
+            self.inner(c, out)
+        return "".join(out)
+
+def savings(chunks, no_spaces = True):
+    """
+    Returns (size of plain G-code, size of packed stream) in bytes for G-code pieces
+    """
+    encoder = Encoder(no_spaces)
+    plain, packed = 0, len(encoder.start())+len(encoder.stop())
+    for line in commands(chunks):
+        plain += len(line)+1
+        packed += len(encoder.encode(encoder.prepare(line)+"\n"))
+    return plain, packed
@@ -0,0 +1,156 @@
+#! /usr/bin/env python
+#  -*- coding: utf-8 -*-
+# author: Victor Shapovalov (@ArtificalSUN, https://github.com/ArtificalSUN), 2022
+
+"""
+Photo analysis of the printed pattern
+Photo of the front side of the wall is cropped from the bed (bottom edge) to the top of the pattern,
+image rows are mapped to the bands of the pattern from the configuration and every band gets a score:
+- surface uniformity: variation of brightness along the band after removing smooth lighting gradient
+  (speed changes without proper K-factor leave bright and dark stripes where the flow changes)
+- corner bulge: difference of brightness of the corners from the middle of the wall
+The band with the lowest score is the best one, its middle height is used to calculate K-factor
+Requires NumPy, images are read with Pillow if installed, otherwise only binary PGM/PPM files are supported
+"""
+
+import os, re, sys, argparse
+
+import kcalibrator_settings as settings
+import kcalibrator_generator as generator
+import kcalibrator_preview as preview
+
+try:
+    import numpy as np # optional, required only for photo analysis
+except ImportError:
+    np = None
+
+try:
+    from PIL import Image # optional, reads any image format
+except ImportError:
+    Image = None
+
+image_suffix_list = ['.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff', '.pgm', '.ppm']
+band_margin = 0.2 # part of every band near its borders excluded from the score (layers of neighbouring bands)
+corner_width = 0.05 # part of the wall width on each side taken as corner
+bulge_weight = 1.0
+
+def read_pnm(path):
+    """
+    Returns grayscale image from binary PGM (P5) or PPM (P6) file as 2D array
+    """
+    with open(path, "rb") as f: data = f.read()
+    header = re.match(rb"(P[56])(?:\s+|#[^\n]*\n)+(\d+)(?:\s+|#[^\n]*\n)+(\d+)(?:\s+|#[^\n]*\n)+(\d+)\s", data)
+    if header is None: raise ValueError("{} is not a binary PGM/PPM image, Pillow package is required for other formats".format(path))
+    kind, width, height, maxval = header.group(1), int(header.group(2)), int(header.group(3)), int(header.group(4))
+    channels = 3 if kind == b"P6" else 1
+    pixels = np.frombuffer(data, dtype=">u2" if maxval > 255 else np.uint8, count=width*height*channels, offset=header.end())
+    pixels = pixels.reshape(height, width, channels).astype(float)
+    return pixels.mean(axis=2) if channels == 3 else pixels[:, :, 0]
+
+def load_image(path):
+    """
+    Returns grayscale image as 2D array of brightness (first row is the top of the image)
+    """
+    if np is None: raise ValueError("numpy package is required for photo analysis")
+    if Image is not None: return np.asarray(Image.open(path).convert("L"), dtype=float)
+    return read_pnm(path)
+
+def band_rows(bands, rows):
+    """
+    Returns (first row, last row + 1) of image rows inside every band, image spans from the bed to the top of the last band
+    """
+    top = bands[-1][1]
+    result = []
+    for bottom, upper, label in bands:
+        margin = (upper-bottom)*band_margin
+        first = int(round((1-(upper-margin)/top)*rows))
+        last = int(round((1-(bottom+margin)/top)*rows))
+        result.append((min(first, rows-1), max(last, min(first, rows-1)+1)))
+    return result
+
+def smooth(profiles, window):
+    """
+    Returns moving average of every row of profiles over window columns (edges are extended)
+    """
+    half = window//2
+    padded = np.pad(profiles, ((0, 0), (half+1, half)), mode='edge')
+    sums = np.cumsum(padded, axis=1)
+    return (sums[:, window:]-sums[:, :-window])/window
+
+def band_scores(image, currentConfig):
+    """
+    Returns arrays (score, uniformity, bulge) with values for every band of the pattern, lower score is better
+    All bands are processed at once: sums over the rows of every band are taken with one reduceat
+    """
+    if np is None: raise ValueError("numpy package is required for photo analysis")
+    image = np.asarray(image, dtype=float)
+    bands = preview.bands(currentConfig)
+    rows = np.array(band_rows(bands, image.shape[0]))[::-1] # top band first, so the rows are increasing
+    count = (rows[:, 1]-rows[:, 0])[:, None]
+    boundaries = rows.ravel()
+    padded = np.vstack([image, np.zeros((1, image.shape[1]))]) # reduceat indices must be inside the array
+    sums = np.add.reduceat(padded, boundaries, axis=0)[::2][::-1] # every second sum is the gap between bands
+    squares = np.add.reduceat(padded*padded, boundaries, axis=0)[::2][::-1]
+    count = count[::-1]
+    profiles = sums/count # mean brightness of every column of every band
+    trend = smooth(profiles, max(3, image.shape[1]//10) | 1) # lighting gradient across the wall
+    residual = (squares-2*trend*sums)/count+trend*trend # mean squared deviation from the trend in every column
+    scale = image.std() or 1.0 # scores do not depend on exposure of the photo
+    uniformity = np.sqrt(np.maximum(residual.mean(axis=1), 0))/scale
+    edge = max(1, int(image.shape[1]*corner_width))
+    x = np.arange(image.shape[1], dtype=float)
+    xm, middle = x[edge:-edge]-x[edge:-edge].mean(), profiles[:, edge:-edge]
+    slope = (middle*xm).sum(axis=1)/(xm*xm).sum() # linear lighting gradient of the middle of the wall extended to the corners
+    line = middle.mean(axis=1)[:, None]+slope[:, None]*(x-x[edge:-edge].mean())
+    deviation = profiles-line
+    bulge = (np.abs(deviation[:, :edge].mean(axis=1))+np.abs(deviation[:, -edge:].mean(axis=1)))/2/scale
+    return uniformity+bulge_weight*bulge, uniformity, bulge
+
+def analyze(image, currentConfig, crop = None):
+    """
+    Finds the best band on the photo (path or 2D array), returns dict with band, its label, height and K-factor (None in segmented mode)
+    crop is (left, top, right, bottom) of the wall in pixels if the photo is not cropped
+    """
+    if currentConfig.pattern_type == 'Max flow': raise ValueError("Photo analysis is available only for K-factor patterns")
+    if isinstance(image, str): image = load_image(image)
+    if crop: image = image[crop[1]:crop[3], crop[0]:crop[2]]
+    score, uniformity, bulge = band_scores(image, currentConfig)
+    band = int(np.argmin(score))
+    bottom, top, label = preview.bands(currentConfig)[band]
+    height = round((bottom+top)/2-currentConfig.def_layer, 3) # measured from the top of the brim like in the calculator
+    layers, per_layer = generator.layout(currentConfig)
+    k = None
+    if per_layer == 1:
+        c = currentConfig
+        k = generator.k_at_height(height, c.k_start, c.k_end, c.k_step, c.def_layer, c.layers_per_k, c.k_mode, per_layer)
+    return {'band': band, 'label': label, 'height': height, 'k': k, 'scores': score.tolist()}
+
+def image_files(paths): # image files of the paths, directories are searched for images
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for name in sorted(os.listdir(path)):
+            if os.path.splitext(name)[1].lower() in image_suffix_list: yield os.path.join(path, name)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Find the best band of the printed pattern on its photo")
+    parser.add_argument("photos", nargs="+", help="photos of the pattern or directories with photos")
+    parser.add_argument("-c", "--config", default="Kcalibrator.cfg", help="configuration the pattern was generated with (default: %(default)s)")
+    parser.add_argument("--crop", type=lambda text: tuple(int(v) for v in text.split(",")), metavar="LEFT,TOP,RIGHT,BOTTOM", help="wall area of the photos in pixels (default: whole photo)")
+    args = parser.parse_args(argv)
+    currentConfig = settings.SettingClass()
+    if os.path.exists(args.config): currentConfig.read_config(args.config)
+    failed = 0
+    for path in image_files(args.photos):
+        try: result = analyze(path, currentConfig, args.crop)
+        except (OSError, ValueError) as e:
+            print("{}: {}".format(path, e))
+            failed += 1
+            continue
+        k = " K-factor = {}".format(round(result['k'], 3)) if result['k'] is not None else ""
+        print("{path}: band {b} ({l}), height {h} mm{k}".format(path=path, b=result['band']+1, l=result['label'], h=result['height'], k=k))
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
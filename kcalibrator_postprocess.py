@@ -0,0 +1,132 @@
+#! /usr/bin/env python
+#  -*- coding: utf-8 -*-
+# author: Victor Shapovalov (@ArtificalSUN, https://github.com/ArtificalSUN), 2022
+
+"""
+Post-processor applying calibrated K-factor to existing sliced G-code
+Pressure advance commands (M900, SET_PRESSURE_ADVANCE, M572) setting a K-factor get the new value: commands of the chosen firmware
+keep their other arguments (tool, smooth time), commands of other firmware are replaced keeping their tool,
+commands without a K-factor are left alone; if the file has none before the first extrusion, the command is inserted there
+Files are memory-mapped and scanned with regular expressions, so even very large files are never loaded into memory
+When every new command fits into the line it replaces the file is edited in place, otherwise it is rewritten in chunks
+"""
+
+import os, re, sys, mmap, argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import kcalibrator_settings as settings
+import kcalibrator_generator as generator
+
+pa_command = re.compile(rb"^[ \t]*(?:M900|SET_PRESSURE_ADVANCE|M572)\b[^\r\n]*", re.MULTILINE | re.IGNORECASE)
+first_extrusion = re.compile(rb"^[ \t]*G1\b[^\n;]*E-?\.?\d", re.MULTILINE)
+chunk_size = 1 << 20 # bytes copied at once when the file is rewritten
+# command -> (firmware using it, K-factor value, tool argument)
+pa_flavors = {b"M900": ('Marlin/Lerdge', re.compile(rb"(?<=\sK)-?[\d.]+", re.I), re.compile(rb"\sT(\d+)", re.I)),
+              b"SET_PRESSURE_ADVANCE": ('Klipper', re.compile(rb"(?<=\sADVANCE=)-?[\d.]+", re.I), re.compile(rb"\sEXTRUDER=extruder(\d*)\b", re.I)),
+              b"M572": ('RepRapFirmware', re.compile(rb"(?<=\sS)-?[\d.]+", re.I), re.compile(rb"\sD(\d+)", re.I))}
+
+def pa_line(k, fw, tool = None): # pressure advance command alone, without the message of M900()
+    return generator.M900(k, fw, tool).splitlines()[0]
+
+def replacement(line, k, fw):
+    """
+    Returns new text of pressure advance command line or None if the command does not set K-factor
+    """
+    command = line.split(b";", 1)[0]
+    flavor, value, tool = pa_flavors[command.split()[0].upper()]
+    found = value.search(command)
+    if found is None: return None # e.g. SET_PRESSURE_ADVANCE SMOOTH_TIME=0.04 or M900 without K
+    number = tool.search(command)
+    custom = number is None and flavor == 'Klipper' and b"EXTRUDER=" in command.upper() # extruder with its own name in Klipper config
+    if flavor == fw or custom: return line[:found.start()]+"{:.3f}".format(k).encode()+line[found.end():] # other arguments are kept
+    return pa_line(k, fw, int(number.group(1) or 0) if number else None).encode()
+
+def scan(mm, k, fw):
+    """
+    Returns (list of (start, end, new text) of pressure advance commands setting K-factor, insertion position or None)
+    """
+    edits = []
+    for m in pa_command.finditer(mm):
+        new = replacement(m.group(), k, fw)
+        if new is not None: edits.append((m.start(), m.end(), new))
+    extrusion = first_extrusion.search(mm)
+    if extrusion is None: return edits, None
+    if edits and edits[0][0] < extrusion.start(): return edits, None
+    return edits, extrusion.start()
+
+def copy(mm, start, end, out):
+    for pos in range(start, end, chunk_size): out.write(mm[pos:min(pos+chunk_size, end)])
+
+def process_file(path, k, fw = 'Marlin/Lerdge', output = None):
+    """
+    Applies K-factor k to G-code file at path (or writes the result to output), returns statistics of the edit
+    """
+    stats = {'path': path, 'replaced': 0, 'inserted': 0, 'in_place': False}
+    if os.path.getsize(path) == 0: # empty file can not be mapped
+        if output: open(output, "wb").close()
+        return stats
+    with open(path, "r+b" if output is None else "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_WRITE if output is None else mmap.ACCESS_READ) as mm:
+            edits, insert = scan(mm, k, fw)
+            stats['replaced'], stats['inserted'] = len(edits), int(insert is not None)
+            if output is None and insert is None and all(end-start >= len(new) for start, end, new in edits):
+                for start, end, new in edits: mm[start:end] = new.ljust(end-start) # padding spaces are ignored by the firmware
+                mm.flush()
+                stats['in_place'] = True
+                return stats
+            target = output or os.path.join(os.path.dirname(path), "."+os.path.basename(path)+".tmp")
+            with open(target, "wb") as out:
+                pos = 0
+                if insert is not None: edits.append((insert, insert, generator.M900(k, fw).encode()))
+                for start, end, data in sorted(edits):
+                    copy(mm, pos, start, out)
+                    out.write(data)
+                    pos = end
+                copy(mm, pos, len(mm), out)
+    if output is None: os.replace(target, path)
+    return stats
+
+def _process(args):
+    return process_file(*args)
+
+def process_files(paths, k, fw = 'Marlin/Lerdge', workers = None):
+    """
+    Applies K-factor to many files in place using separate processes, returns statistics of every file
+    """
+    if len(paths) < 2: return [process_file(path, k, fw) for path in paths]
+    with ProcessPoolExecutor(workers) as pool:
+        return list(pool.map(_process, [(path, k, fw) for path in paths]))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply calibrated K-factor to sliced G-code files")
+    parser.add_argument("files", nargs="+", help="G-code files to edit in place")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("-k", type=float, help="K-factor to apply")
+    group.add_argument("--height", type=float, help="height of the best part of the printed pattern, K-factor is calculated from the configuration")
+    parser.add_argument("--segment", type=int, default=0, help="segment of the pattern measured with --height in Segmented mode (default: %(default)s)")
+    parser.add_argument("-c", "--config", default="Kcalibrator.cfg", help="configuration file with firmware and pattern settings (default: %(default)s)")
+    parser.add_argument("--firmware", choices=settings.SettingClass().firmware_list, help="firmware flavor of the commands (default: from configuration)")
+    parser.add_argument("-j", "--jobs", type=int, help="number of files processed in parallel (default: number of processors)")
+    args = parser.parse_args(argv)
+    currentConfig = settings.SettingClass()
+    if os.path.exists(args.config): currentConfig.read_config(args.config)
+    k = args.k
+    if k is None:
+        c = currentConfig
+        segments = c.k_segments if c.k_mode == 'Segmented' else 1
+        try: k = generator.k_at_height(args.height, c.k_start, c.k_end, c.k_step, c.def_layer, c.layers_per_k, c.k_mode, segments, args.segment)
+        except IndexError:
+            print("Height {} is above the pattern".format(args.height))
+            return 1
+    fw = args.firmware or currentConfig.firmware
+    try: results = process_files(args.files, k, fw, args.jobs)
+    except OSError as e:
+        print(e)
+        return 1
+    for stats in results:
+        print("{path}: {replaced} replaced, {inserted} inserted{mode}".format(mode=" (in place)" if stats['in_place'] else "", **stats))
+    print("K-factor {} applied to {} files".format(round(k, 3), len(results)))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,139 @@
+#! /usr/bin/env python
+#  -*- coding: utf-8 -*-
+# author: Victor Shapovalov (@ArtificalSUN, https://github.com/ArtificalSUN), 2022
+
+"""
+Prediction of K-factor range from calibration history
+Results of the history are points in the space of calibration conditions: hotend temperature, fast speed,
+and filament, nozzle and firmware (exact match of the names, firmwares use different K-factor units so they are far apart)
+Nearest results are found with KD-tree, the new sweep covers their K-factors with a fine step instead of the whole default range
+"""
+
+import os, sys, heapq, argparse
+from math import sqrt, ceil, floor
+
+import kcalibrator_settings as settings
+import kcalibrator_profiles as profiles
+
+temperature_scale = 10.0 # 10°C of temperature difference are as far as one unit of distance
+speed_scale = 50.0 # same for 50 mm/s of fast speed
+category_weights = {'firmware': 10.0, 'filament': 3.0, 'nozzle': 2.0} # distance between different names
+min_results = 3 # prediction needs at least this number of results in the history
+neighbour_count = 5 # number of nearest results the range is predicted from
+
+class KDTree:
+    """
+    KD-tree of points with payloads for nearest neighbour search
+    """
+    def __init__(self, points, payloads):
+        self.dimensions = len(points[0]) if points else 0
+        self.root = self.build(list(zip(points, payloads)), 0)
+
+    def build(self, items, depth):
+        if not items: return None
+        axis = depth % self.dimensions
+        items.sort(key=lambda item: item[0][axis])
+        middle = len(items)//2
+        return (items[middle], axis, self.build(items[:middle], depth+1), self.build(items[middle+1:], depth+1))
+
+    def nearest(self, point, k = 1):
+        """
+        Returns list of (distance, payload) of k points nearest to point, nearest first
+        """
+        heap = [] # (-distance, counter, payload) of the best points found so far
+        counter = 0
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node is None: continue
+            (location, payload), axis, left, right = node
+            distance = sqrt(sum((a-b)**2 for a, b in zip(point, location)))
+            if len(heap) < k: heapq.heappush(heap, (-distance, counter, payload))
+            elif distance < -heap[0][0]: heapq.heapreplace(heap, (-distance, counter, payload))
+            counter += 1
+            delta = point[axis]-location[axis]
+            near, far = (left, right) if delta < 0 else (right, left)
+            if len(heap) < k or abs(delta) < -heap[0][0]: stack.append(far) # other side may contain closer points
+            stack.append(near)
+        return [(-d, payload) for d, c, payload in sorted(heap, reverse=True)]
+
+class Predictor:
+    """
+    K-factor predictor built from the calibration history (list of dicts from ProfileStore.history)
+    Results of coarse sweeps (step larger than fine_step) are skipped if there are enough results of fine sweeps
+    """
+    def __init__(self, history, fine_step = None):
+        self.categories = {key: sorted({str(row[key]) for row in history}) for key in category_weights}
+        self.history = [row for row in history if row['k'] is not None]
+        fine = [row for row in self.history if fine_step is None or row['k_step'] is None or abs(row['k_step']) <= fine_step+1e-9]
+        if len(fine) >= min_results: self.history = fine
+        self.tree = KDTree([self.features(row) for row in self.history], self.history) if self.history else None
+
+    def features(self, conditions):
+        """
+        Returns point of calibration conditions (dict with temperature, speed_fast, firmware, filament and nozzle)
+        Names are one-hot encoded, unknown names get zero vector and are equally far from all known ones
+        """
+        point = [(conditions['temperature'] or 0)/temperature_scale, (conditions['speed_fast'] or 0)/speed_scale]
+        for key, weight in category_weights.items():
+            point.extend(weight/sqrt(2) if str(conditions[key]) == name else 0.0 for name in self.categories[key]) # different names are weight apart
+        return point
+
+    def neighbours(self, currentConfig, k = neighbour_count):
+        if self.tree is None: return []
+        return self.tree.nearest(self.features(conditions(currentConfig)), k)
+
+    def predict(self, currentConfig, k = neighbour_count):
+        """
+        Returns (k_start, k_end, k_step) of the narrow sweep for the configuration or None if the history is too short
+        Range covers weighted mean of K-factors of the nearest results plus-minus two standard deviations (at least two fine steps)
+        Results measured with a coarser step than the fine step are less precise, their weight is divided by the ratio of the steps
+        """
+        if len(self.history) < min_results: return None
+        found = self.neighbours(currentConfig, k)
+        step = currentConfig.fine_k_step
+        weights = [1/(distance+0.1)/max(abs(row['k_step'] or 0)/step, 1.0) for distance, row in found]
+        values = [row['k'] for distance, row in found]
+        mean = sum(w*v for w, v in zip(weights, values))/sum(weights)
+        deviation = sqrt(sum(w*(v-mean)**2 for w, v in zip(weights, values))/sum(weights))
+        span = max(2*deviation, 2*step)
+        if span/step > 10: step = round(span/5, 3) or step # keep about ten bands
+        start = max(floor(round((mean-span)/step, 6))*step, 0.0)
+        end = ceil(round((mean+span)/step, 6))*step
+        return round(start, 4), round(end, 4), step
+
+def conditions(currentConfig): # calibration conditions of the configuration as they are recorded in the history
+    return {'temperature': currentConfig.temperature[0], 'speed_fast': currentConfig.speed_fast, 'firmware': currentConfig.firmware,
+            'filament': currentConfig.filament_profile, 'nozzle': currentConfig.nozzle_profile or str(currentConfig.def_line_width)}
+
+def predict_range(currentConfig, path = profiles.db_path):
+    """
+    Returns predicted (k_start, k_end, k_step) from the history of the profile database or None
+    """
+    with profiles.ProfileStore(path) as store: history = store.history()
+    return Predictor(history, currentConfig.fine_k_step).predict(currentConfig)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Predict K-factor range from calibration history")
+    parser.add_argument("-c", "--config", default="Kcalibrator.cfg", help="configuration file (default: %(default)s)")
+    parser.add_argument("--db", default=profiles.db_path, help="profile database (default: %(default)s)")
+    parser.add_argument("--apply", action="store_true", help="save predicted range to the configuration file")
+    args = parser.parse_args(argv)
+    currentConfig = settings.SettingClass()
+    if os.path.exists(args.config): currentConfig.read_config(args.config)
+    with profiles.ProfileStore(args.db) as store: history = store.history()
+    predictor = Predictor(history, currentConfig.fine_k_step)
+    result = predictor.predict(currentConfig)
+    if result is None:
+        print("Not enough calibration results in the history ({} of {})".format(len(predictor.history), min_results))
+        return 1
+    for distance, row in predictor.neighbours(currentConfig):
+        print("{date} {filament} {temperature}C {speed_fast}mm/s {firmware}: K={k} (distance {d:.2f})".format(d=distance, **row))
+    print("Predicted range: K from {} to {} by {}".format(*result))
+    if args.apply:
+        currentConfig.k_start, currentConfig.k_end, currentConfig.k_step = result
+        currentConfig.save_config(args.config)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
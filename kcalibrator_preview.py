@@ -0,0 +1,134 @@
+#! /usr/bin/env python
+#  -*- coding: utf-8 -*-
+# author: Victor Shapovalov (@ArtificalSUN, https://github.com/ArtificalSUN), 2022
+
+"""
+Toolpath preview of the calibration plate
+Geometry is taken from the generated G-code, so the preview always shows what will be printed
+All pattern layers have the same toolpath, so only the brim and the first band are generated for the top view,
+side view shows bands of the pattern with their K-factors (or volumetric flows), bands of plates are labelled with the values of every pattern
+Polylines are reduced to the resolution of the screen before drawing, so thousands of brim points are drawn as a few hundred
+"""
+
+from math import isnan
+
+import kcalibrator_generator as generator
+import kcalibrator_validate as validator
+
+def extrusions(chunks):
+    """
+    Yields polylines [(X, Y, Z), ...] of consecutive extruding moves of G-code pieces
+    """
+    position = [0.0, 0.0, 0.0, 0.0]
+    relative = e_relative = False
+    line = []
+    for command in generator.commands(chunks):
+        kind, values = validator.parse_line(command)
+        if kind == validator.ABS: relative = e_relative = False
+        elif kind == validator.REL: relative = e_relative = True
+        elif kind == validator.E_ABS: e_relative = False
+        elif kind == validator.E_REL: e_relative = True
+        if values is None: continue
+        previous = position[:]
+        for i in range(4):
+            if isnan(values[i]): continue
+            position[i] = previous[i]+values[i] if (e_relative if i == 3 else relative) and kind == validator.MOVE else values[i]
+        if kind != validator.MOVE: continue
+        if position[3] > previous[3] and position[:2] != previous[:2]:
+            if not line: line.append(tuple(previous[:3]))
+            line.append(tuple(position[:3]))
+        elif line:
+            yield line
+            line = []
+    if line: yield line
+
+def toolpath(currentConfig):
+    """
+    Returns polylines of the first layer (brim) and of one pattern layer as lists of (X, Y) points
+    """
+    brim, pattern = [], []
+    layers = []
+    for line in extrusions(generator.generate(currentConfig, 0, 0)):
+        z = round(line[-1][2], 3)
+        if z not in layers:
+            if len(layers) == 2: break
+            layers.append(z)
+        (brim if z == layers[0] else pattern).append([point[:2] for point in line])
+    return brim, pattern
+
+def bands(currentConfig):
+    """
+    Returns list of (Z from, Z to, label) of every band of the pattern
+    """
+    layers, per_layer = generator.layout(currentConfig)
+    values = list(generator.sweep(currentConfig))
+    height = layers*currentConfig.def_layer
+    flow = currentConfig.pattern_type == 'Max flow'
+    result = []
+    for band, j in enumerate(range(0, len(values), per_layer)):
+        label = "/".join(str(value) for value in values[j:j+per_layer])
+        bottom = currentConfig.def_layer+band*height
+        result.append((bottom, bottom+height, ("Q=" if flow else "K=")+label))
+    return result
+
+def plate_bands(currentConfig):
+    """
+    Returns list of (Z from, Z to, label) of every band of the plate
+    Patterns with their own K-factor (or flow) ranges are labelled separately in the order of the plate, "-" where the pattern is already finished
+    """
+    patterns = [bands(pattern) for pattern in generator.plate_configs(currentConfig)]
+    result = []
+    for i, (bottom, top, label) in enumerate(max(patterns, key=len)):
+        labels = [pattern[i][2] if i < len(pattern) else "-" for pattern in patterns]
+        result.append((bottom, top, labels[0] if len(set(labels)) == 1 else " | ".join(labels)))
+    return result
+
+class Preview:
+    """
+    Geometry of the preview computed once for the configuration and drawn at any scale
+    """
+    def __init__(self, currentConfig):
+        self.brim, self.pattern = toolpath(currentConfig)
+        self.bands = plate_bands(currentConfig)
+        self.bed = currentConfig.bed_size
+        self.delta = currentConfig.kinematics == 'Delta'
+
+    def top_bounds(self): # (X min, Y min, X max, Y max) of the top view
+        if self.delta: return (-self.bed[0]/2, -self.bed[1]/2, self.bed[0]/2, self.bed[1]/2)
+        return (0, 0, self.bed[0], self.bed[1])
+
+    def side_bounds(self): # (X min, Z min, X max, Z max) of the side view
+        points = [point for line in self.pattern for point in line] or [(0, 0)]
+        x_min, x_max = min(p[0] for p in points), max(p[0] for p in points)
+        return (x_min, 0, x_max, self.bands[-1][1] if self.bands else 1)
+
+def transform(bounds, width, height, margin = 5, equal = True):
+    """
+    Returns function converting (X, Y) in mm to canvas pixels fitting bounds into width x height
+    Both axes have the same scale if equal, otherwise the bounds are stretched over the whole canvas (side view of a low pattern)
+    """
+    x_min, y_min, x_max, y_max = bounds
+    x_scale = (width-2*margin)/max(x_max-x_min, 1e-9)
+    y_scale = (height-2*margin)/max(y_max-y_min, 1e-9)
+    if equal: x_scale = y_scale = min(x_scale, y_scale)
+    x_offset = (width-(x_max-x_min)*x_scale)/2
+    y_offset = (height-(y_max-y_min)*y_scale)/2
+    return lambda point: (x_offset+(point[0]-x_min)*x_scale, height-y_offset-(point[1]-y_min)*y_scale) # Y axis of the canvas goes down
+
+def decimate(points, to_screen):
+    """
+    Returns screen coordinates of the polyline with consecutive points falling into the same pixel merged (level of detail)
+    The first and the last points are always kept
+    """
+    result = []
+    last = None
+    for point in points:
+        x, y = to_screen(point)
+        pixel = (int(x), int(y))
+        if pixel == last: continue
+        last = pixel
+        result.append((x, y))
+    if points:
+        end = to_screen(points[-1])
+        if result[-1] != end: result.append(end)
+    return result
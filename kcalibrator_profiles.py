@@ -0,0 +1,176 @@
+#! /usr/bin/env python
+#  -*- coding: utf-8 -*-
+# author: Victor Shapovalov (@ArtificalSUN, https://github.com/ArtificalSUN), 2022
+
+"""
+Profile store: printer, firmware, nozzle and filament profiles and calibration history in local SQLite database
+Every profile keeps its own part of the settings as text (the same way as Kcalibrator.cfg and fleet files),
+so the configuration is assembled from several profiles with one indexed query
+"""
+
+import os, sys, sqlite3, argparse, datetime
+
+import kcalibrator_settings as settings
+
+db_path = "Kcalibrator.db"
+
+# settings stored in every kind of profile, profiles are applied in this order
+profile_keys = {
+    'printer': ['bed_size', 'kinematics', 'z_offset', 'use_ABL', 'def_speed_travel', 'retract'],
+    'firmware': ['firmware', 'ABL_type'],
+    'nozzle': ['def_line_width', 'def_layer', 'max_volumetric_flow', 'cap_to_flow'],
+    'filament': ['temperature', 'def_fil_dia', 'def_cooling', 'retract_at_layer_change', 'k_start', 'k_end', 'k_step'],
+}
+kind_list = list(profile_keys)
+
+schema = """
+CREATE TABLE IF NOT EXISTS profiles (
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (kind, name, key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY,
+    date TEXT NOT NULL,
+    printer TEXT NOT NULL,
+    firmware TEXT NOT NULL,
+    nozzle TEXT NOT NULL,
+    filament TEXT NOT NULL,
+    temperature INTEGER,
+    speed_fast REAL,
+    k_start REAL,
+    k_end REAL,
+    k_step REAL,
+    k_mode TEXT,
+    height REAL,
+    k REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS history_printer ON history (printer, filament, date);
+CREATE INDEX IF NOT EXISTS history_filament ON history (filament, date);
+"""
+
+history_columns = ['id', 'date', 'printer', 'firmware', 'nozzle', 'filament', 'temperature', 'speed_fast', 'k_start', 'k_end', 'k_step', 'k_mode', 'height', 'k']
+
+class ProfileStore:
+    """
+    SQLite database with profiles and calibration history
+    """
+    def __init__(self, path = db_path):
+        self.db = sqlite3.connect(path)
+        self.db.executescript(schema)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def save_profile(self, kind, name, currentConfig):
+        """
+        Saves settings of the kind from configuration as profile name (replaces existing profile)
+        """
+        if kind not in profile_keys: raise ValueError("Unknown profile kind {}".format(kind))
+        with self.db:
+            self.db.execute("DELETE FROM profiles WHERE kind = ? AND name = ?", (kind, name))
+            self.db.executemany("INSERT INTO profiles (kind, name, key, value) VALUES (?, ?, ?, ?)",
+                                [(kind, name, key, str(getattr(currentConfig, key))) for key in profile_keys[kind]])
+        setattr(currentConfig, kind+"_profile", name)
+
+    def delete_profile(self, kind, name):
+        with self.db:
+            return self.db.execute("DELETE FROM profiles WHERE kind = ? AND name = ?", (kind, name)).rowcount > 0
+
+    def profile_names(self, kind):
+        return [row[0] for row in self.db.execute("SELECT DISTINCT name FROM profiles WHERE kind = ? ORDER BY name", (kind,))]
+
+    def load(self, currentConfig, **names):
+        """
+        Applies profiles given as kind=name (e.g. printer="Ender-3", filament="PLA") to configuration with one query
+        Raises KeyError if some profile is missing
+        """
+        names = {kind: name for kind, name in names.items() if name}
+        for kind in names:
+            if kind not in profile_keys: raise ValueError("Unknown profile kind {}".format(kind))
+        if not names: return
+        condition = " OR ".join(["(kind = ? AND name = ?)"]*len(names))
+        rows = self.db.execute("SELECT kind, key, value FROM profiles WHERE "+condition, [v for item in names.items() for v in item]).fetchall()
+        found = {kind for kind, key, value in rows}
+        for kind in names:
+            if kind not in found: raise KeyError("{} profile {} not found".format(kind.capitalize(), names[kind]))
+        for kind in kind_list: # later profiles override earlier ones
+            currentConfig.apply_overrides({key: value for k, key, value in rows if k == kind})
+        for kind, name in names.items(): setattr(currentConfig, kind+"_profile", name)
+
+    def record(self, currentConfig, k, height = None):
+        """
+        Adds calibration result to the history with the profiles and main settings it was printed with
+        Firmware is recorded by its type (K-factor units depend on it), nozzle without profile by line width
+        """
+        c = currentConfig
+        with self.db:
+            self.db.execute("INSERT INTO history (date, printer, firmware, nozzle, filament, temperature, speed_fast, k_start, k_end, k_step, k_mode, height, k)"
+                            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                            (datetime.datetime.now().isoformat(timespec='seconds'), c.printer_profile, c.firmware, c.nozzle_profile or str(c.def_line_width), c.filament_profile,
+                             c.temperature[0], c.speed_fast, c.k_start, c.k_end, c.k_step, c.k_mode, height, k))
+
+    def history(self, printer = None, filament = None, limit = None):
+        """
+        Returns calibration results (newest first) as list of dicts, optionally only for printer and/or filament
+        """
+        conditions, values = [], []
+        if printer is not None:
+            conditions.append("printer = ?")
+            values.append(printer)
+        if filament is not None:
+            conditions.append("filament = ?")
+            values.append(filament)
+        query = "SELECT "+", ".join(history_columns)+" FROM history"
+        if conditions: query += " WHERE "+" AND ".join(conditions)
+        query += " ORDER BY date DESC, id DESC"
+        if limit: query += " LIMIT {:d}".format(limit)
+        return [dict(zip(history_columns, row)) for row in self.db.execute(query, values)]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage printer, firmware, nozzle and filament profiles and calibration history")
+    parser.add_argument("--db", default=db_path, help="profile database (default: %(default)s)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    command = commands.add_parser("list", help="list profiles")
+    command.add_argument("kind", nargs="?", choices=kind_list)
+    command = commands.add_parser("save", help="save settings of the configuration file as profile")
+    command.add_argument("kind", choices=kind_list)
+    command.add_argument("name")
+    command.add_argument("-c", "--config", default="Kcalibrator.cfg", help="configuration file (default: %(default)s)")
+    command = commands.add_parser("delete", help="delete profile")
+    command.add_argument("kind", choices=kind_list)
+    command.add_argument("name")
+    command = commands.add_parser("history", help="show calibration history")
+    command.add_argument("--printer")
+    command.add_argument("--filament")
+    command.add_argument("-n", type=int, default=20, help="number of results (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    with ProfileStore(args.db) as store:
+        if args.command == "list":
+            for kind in [args.kind] if args.kind else kind_list:
+                print("{}: {}".format(kind, ", ".join(store.profile_names(kind)) or "-"))
+        elif args.command == "save":
+            currentConfig = settings.SettingClass()
+            if os.path.exists(args.config): currentConfig.read_config(args.config)
+            store.save_profile(args.kind, args.name, currentConfig)
+            print("{} profile {} saved".format(args.kind.capitalize(), args.name))
+        elif args.command == "delete":
+            if not store.delete_profile(args.kind, args.name):
+                print("{} profile {} not found".format(args.kind.capitalize(), args.name))
+                return 1
+        elif args.command == "history":
+            for row in store.history(args.printer, args.filament, args.n):
+                print("{date} {printer}/{nozzle}/{filament} {temperature}C {speed_fast}mm/s: K {k_start}-{k_end}/{k_step} height {height} -> K={k}".format(**row))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
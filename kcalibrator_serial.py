@@ -0,0 +1,192 @@
+#! /usr/bin/env python
+#  -*- coding: utf-8 -*-
+# author: Victor Shapovalov (@ArtificalSUN, https://github.com/ArtificalSUN), 2022
+
+"""
+Streaming of generated G-code to the printer over USB serial
+Lines are sent with line numbers and checksums, several lines are kept in flight so the planner is never starved:
+character counting keeps the firmware receive buffer full, ping-pong sends next line only after "ok" for the previous one
+Resend requests of the firmware are handled by rewinding to the requested line
+"""
+
+import os, time, select
+
+from kcalibrator_generator import commands
+import kcalibrator_meatpack as meatpack
+
+try:
+    import serial # pyserial, required on Windows
+except ImportError:
+    serial = None
+
+flow_list = ['count', 'ping-pong',]
+# commands the firmware answers only after they are finished (heating, homing, probing, dwell), possibly minutes later
+blocking_commands = ('M109', 'M190', 'M191', 'M116', 'M303', 'M400', 'G4', 'G28', 'G29', 'G32', 'BED_MESH_CALIBRATE', 'TEMPERATURE_WAIT', 'QUAD_GANTRY_LEVEL', 'Z_TILT_ADJUST')
+
+class PosixPort:
+    """
+    Minimal serial port for POSIX systems (also works with pseudo-terminals), used when pyserial is not installed
+    """
+    def __init__(self, path, baud = 115200):
+        import termios, tty
+        self.fd = os.open(path, os.O_RDWR | os.O_NOCTTY)
+        tty.setraw(self.fd)
+        attrs = termios.tcgetattr(self.fd)
+        speed = getattr(termios, "B{}".format(baud), termios.B115200)
+        attrs[4] = attrs[5] = speed
+        termios.tcsetattr(self.fd, termios.TCSANOW, attrs)
+        self.buffer = b""
+
+    def write(self, data):
+        while data: data = data[os.write(self.fd, data):]
+
+    def readline(self, timeout):
+        deadline = time.monotonic()+timeout
+        while b"\n" not in self.buffer:
+            if not select.select([self.fd], [], [], max(deadline-time.monotonic(), 0))[0]: return b""
+            data = os.read(self.fd, 4096)
+            if not data: return b""
+            self.buffer += data
+        line, _, self.buffer = self.buffer.partition(b"\n")
+        return line+b"\n"
+
+    def close(self):
+        os.close(self.fd)
+
+class PyserialPort:
+    """
+    Serial port of pyserial with the same interface as PosixPort
+    """
+    def __init__(self, path, baud = 115200):
+        self.port = serial.Serial(path, baud, timeout=0)
+        self.buffer = b""
+
+    def write(self, data):
+        self.port.write(data)
+
+    def readline(self, timeout):
+        deadline = time.monotonic()+timeout
+        while b"\n" not in self.buffer:
+            data = self.port.read(max(self.port.in_waiting, 1))
+            if data: self.buffer += data
+            elif time.monotonic() > deadline: return b""
+            else: time.sleep(0.001)
+        line, _, self.buffer = self.buffer.partition(b"\n")
+        return line+b"\n"
+
+    def close(self):
+        self.port.close()
+
+def open_port(path, baud = 115200):
+    return PyserialPort(path, baud) if serial is not None else PosixPort(path, baud)
+
+def checksum(line):
+    cs = 0
+    for c in line.encode(): cs ^= c
+    return cs
+
+def numbered(n, command, prepare = None): # command with line number and checksum, prepare converts the line before checksum is calculated
+    line = "N{n} {c}".format(n=n, c=command)
+    if prepare: line = prepare(line)
+    return "{l}*{cs}\n".format(l=line, cs=checksum(line))
+
+class Sender:
+    """
+    Class streaming G-code to the firmware with windowed flow control
+    flow is 'count' (keep up to rx_buffer characters and max_lines lines in flight) or 'ping-pong' (one line at a time)
+    With use_meatpack lines are packed with MeatPack if the firmware reports this capability in response to M115
+    """
+    def __init__(self, port, flow = 'count', rx_buffer = 127, max_lines = 4, timeout = 10.0, history = 1024, use_meatpack = False):
+        self.port = port
+        self.use_meatpack = use_meatpack
+        self.encoder = None
+        self.flow = flow
+        self.rx_buffer = rx_buffer
+        self.max_lines = 1 if flow == 'ping-pong' else max_lines
+        self.timeout = timeout
+        self.history = history
+        self.stats = {}
+
+    def wait_start(self, timeout = 3.0):
+        """
+        Waits for the firmware to boot after opening the port (most boards reset) and resets line numbers
+        """
+        deadline = time.monotonic()+timeout
+        while time.monotonic() < deadline:
+            if self.port.readline(deadline-time.monotonic()).strip().startswith(b"start"): break
+        self.port.write(b"M110 N0\n")
+        self.response()
+        if self.use_meatpack:
+            self.port.write(b"M115\n")
+            if meatpack.supports_meatpack(self.response()):
+                self.encoder = meatpack.Encoder()
+                self.port.write(self.encoder.start())
+            else: print("Firmware does not support MeatPack, G-code is sent without packing")
+
+    def response(self): # returns lines received before "ok"
+        lines = []
+        deadline = time.monotonic()+self.timeout
+        while time.monotonic() < deadline:
+            line = self.port.readline(deadline-time.monotonic()).strip()
+            if line.startswith(b"ok"): return lines
+            if line: lines.append(line)
+        raise IOError("Printer does not respond")
+
+    def send(self, chunks):
+        """
+        Streams G-code pieces to the firmware and returns statistics of the transfer
+        """
+        source = commands(chunks)
+        sent = {} # line number -> numbered line, kept for resends
+        blocking = set() # numbers of the lines with blocking commands
+        in_flight = [] # (line number, length, epoch) of lines waiting for "ok"
+        n, last, epoch = 1, None, 0 # next line number to send, number of the last line of the file, current resend epoch
+        stats = {'lines': 0, 'bytes': 0, 'resends': 0, 'timeouts': 0, 'max_in_flight': 0}
+        started = last_response = time.monotonic()
+        while last is None or n <= last or in_flight:
+            if n not in sent and last is None:
+                command = next(source, None)
+                if command is None: last = n-1
+                else:
+                    line = numbered(n, command, self.encoder.prepare if self.encoder else None)
+                    sent[n] = self.encoder.encode(line) if self.encoder else line.encode()
+                    if command.split()[0].upper() in blocking_commands: blocking.add(n)
+                    sent.pop(n-self.history, None); blocking.discard(n-self.history)
+            pending = sum(length for _, length, _ in in_flight)
+            if n in sent and len(in_flight) < self.max_lines and (not in_flight or pending+len(sent[n]) <= self.rx_buffer):
+                self.port.write(sent[n])
+                in_flight.append((n, len(sent[n]), epoch))
+                stats['lines'] += 1; stats['bytes'] += len(sent[n])
+                stats['max_in_flight'] = max(stats['max_in_flight'], len(in_flight))
+                n += 1
+                timeout = 0 # send as much as the window allows before waiting for responses
+            else: timeout = 0.1
+            response = self.port.readline(timeout).strip().lower()
+            if not response:
+                # "ok" was lost and firmware is waiting for the next line, unless it is still busy with a blocking command without keepalive messages
+                # (freeing the window then would overflow the receive buffer of the firmware)
+                if in_flight and time.monotonic()-last_response > self.timeout and not any(line in blocking for line, _, _ in in_flight):
+                    in_flight.pop(0)
+                    stats['timeouts'] += 1
+                    last_response = time.monotonic()
+                continue
+            last_response = time.monotonic()
+            if response.startswith(b"resend") or response.startswith(b"rs"):
+                line = int(response.replace(b":", b" ").split()[-1].lstrip(b"n"))
+                if in_flight and in_flight[0][2] < epoch: continue # line sent before the last rewind is rejected again
+                if line not in sent: raise IOError("Firmware requested line {} which is not available anymore".format(line))
+                epoch += 1; n = line
+                stats['resends'] += 1
+            elif response.startswith(b"ok"):
+                if in_flight: in_flight.pop(0)
+            elif response.startswith(b"error") and b"resend" not in response and b"checksum" not in response and b"line" not in response:
+                print(response.decode(errors="replace"))
+        if self.encoder: self.port.write(self.encoder.stop())
+        stats['seconds'] = time.monotonic()-started
+        stats['lines_per_second'] = stats['lines']/stats['seconds'] if stats['seconds'] else 0.0
+        stats['bytes_per_second'] = stats['bytes']/stats['seconds'] if stats['seconds'] else 0.0
+        self.stats = stats
+        return stats
+
+def report(stats):
+    return "{lines} lines ({bytes} bytes) sent in {seconds:.1f} s: {lines_per_second:.0f} lines/s, {bytes_per_second:.0f} bytes/s, {resends} resends, {timeouts} timeouts".format(**stats)
@@ -0,0 +1,358 @@
+#! /usr/bin/env python
+#  -*- coding: utf-8 -*-
+# author: Victor Shapovalov (@ArtificalSUN, https://github.com/ArtificalSUN), 2022
+
+"""
+HTTP service generating calibration patterns (standard library only)
+POST /generate with JSON object of settings (names as in Kcalibrator.cfg, e.g. {"k_start": 0, "k_end": 0.1, "temperature": [240, 80]})
+returns G-code of the pattern, settings which are not given are taken from the base configuration
+Generation runs in a pool of worker processes of limited size, workers send the G-code in blocks as it is generated
+and clients receive every block as soon as it arrives (the response ends with closing of the connection)
+Identical requests share one generation: requests arriving while it runs follow the same blocks, the finished result is cached
+GET /metrics returns counters and latencies in Prometheus text format
+"""
+
+import os, sys, copy, json, time, asyncio, argparse, hashlib, threading, collections, multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import kcalibrator_settings as settings
+import kcalibrator_generator as generator
+import kcalibrator_cost as cost
+
+max_body = 1 << 20 # bytes of JSON accepted in one request
+block_size = 65536 # bytes written to the client at once
+latency_window = 1000 # number of latest requests the latency quantiles are computed from
+# workers are started lazily while the server runs, forked ones would inherit its sockets (clients wait for EOF forever, shutdown hangs)
+start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+class RequestError(Exception):
+    """
+    Error returned to the client with HTTP status
+    """
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+blocks_out = None # queue of (stream, block) the worker sends G-code to the server through
+
+def start_worker(queue): # runs in worker process when it starts
+    global blocks_out
+    blocks_out = queue
+
+def render(stream, currentConfig):
+    """
+    Runs in worker process: sends G-code to the server in blocks of about block_size bytes as it is generated, None ends the stream
+    """
+    cost.check_limits(currentConfig) # jobs over the limits are refused, nobody can confirm them
+    pieces, size = [], 0
+    for chunk in generator.generate(currentConfig):
+        pieces.append(chunk.encode())
+        size += len(pieces[-1])
+        if size >= block_size:
+            blocks_out.put((stream, b"".join(pieces)))
+            pieces, size = [], 0
+    if pieces: blocks_out.put((stream, b"".join(pieces)))
+    blocks_out.put((stream, None))
+
+def request_config(base, body):
+    """
+    Returns configuration for JSON request body applied on top of the base configuration
+    """
+    try: overrides = json.loads(body or b"{}")
+    except ValueError as e: raise RequestError(400, "Invalid JSON: {}".format(e))
+    if not isinstance(overrides, dict): raise RequestError(400, "JSON object of settings expected")
+    if any(key.startswith("limit_") for key in overrides): raise RequestError(400, "Limits of the job are set by the server")
+    currentConfig = copy.deepcopy(base)
+    try: currentConfig.apply_overrides({key: str(value) for key, value in overrides.items()})
+    except (KeyError, ValueError) as e: raise RequestError(400, e.args[0])
+    try: generator.plate_layout(currentConfig)
+    except ValueError as e: raise RequestError(400, str(e))
+    return currentConfig
+
+def config_key(currentConfig): # identical settings give identical G-code
+    return hashlib.sha256(repr(sorted(vars(currentConfig).items())).encode()).hexdigest()
+
+class Metrics:
+    """
+    Counters and latencies of the service
+    """
+    def __init__(self):
+        self.started = time.time()
+        self.counters = collections.Counter()
+        self.latencies = collections.deque(maxlen=latency_window)
+        self.generation_seconds = 0.0
+
+    def text(self, in_flight, cache):
+        lines = []
+        for name in ('requests', 'errors', 'cache_hits', 'coalesced', 'generations', 'bytes_sent'):
+            lines.append("# TYPE kcalibrator_{}_total counter".format(name))
+            lines.append("kcalibrator_{}_total {}".format(name, self.counters[name]))
+        lines.append("# TYPE kcalibrator_generation_seconds_total counter")
+        lines.append("kcalibrator_generation_seconds_total {:.6f}".format(self.generation_seconds))
+        lines.append("# TYPE kcalibrator_in_flight gauge")
+        lines.append("kcalibrator_in_flight {}".format(in_flight))
+        lines.append("# TYPE kcalibrator_cache_bytes gauge")
+        lines.append("kcalibrator_cache_bytes {}".format(cache.size))
+        lines.append("# TYPE kcalibrator_cache_entries gauge")
+        lines.append("kcalibrator_cache_entries {}".format(len(cache.entries)))
+        latencies = sorted(self.latencies)
+        lines.append("# TYPE kcalibrator_request_seconds summary")
+        for q in (0.5, 0.9, 0.99):
+            value = latencies[min(int(q*len(latencies)), len(latencies)-1)] if latencies else 0.0
+            lines.append('kcalibrator_request_seconds{{quantile="{}"}} {:.6f}'.format(q, value))
+        lines.append("kcalibrator_request_seconds_sum {:.6f}".format(sum(latencies)))
+        lines.append("kcalibrator_request_seconds_count {}".format(len(latencies)))
+        uptime = time.time()-self.started
+        lines.append("# TYPE kcalibrator_uptime_seconds gauge")
+        lines.append("kcalibrator_uptime_seconds {:.3f}".format(uptime))
+        lines.append("# TYPE kcalibrator_throughput_bytes_per_second gauge")
+        lines.append("kcalibrator_throughput_bytes_per_second {:.1f}".format(self.counters['bytes_sent']/uptime if uptime else 0.0))
+        return "\n".join(lines)+"\n"
+
+class Generation:
+    """
+    G-code of one generation as list of blocks growing while it is generated, any number of clients follow it
+    """
+    def __init__(self, blocks = None):
+        self.blocks = list(blocks or [])
+        self.size = sum(len(block) for block in self.blocks)
+        self.done = blocks is not None
+        self.error = None
+        self.changed = asyncio.Event() # replaced after every change, so every follower wakes up
+        self.received = asyncio.Event() # the worker has sent the whole stream
+
+    def notify(self):
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    def add(self, block):
+        self.blocks.append(block)
+        self.size += len(block)
+        self.notify()
+
+    def finish(self, error = None):
+        self.done, self.error = True, error
+        self.notify()
+
+    async def started(self):
+        """
+        Waits for the first block, raises the error of the generation if it failed before
+        """
+        while not self.blocks and not self.done: await self.changed.wait()
+        if self.error is not None and not self.blocks: raise self.error
+
+    async def follow(self):
+        """
+        Yields all blocks from the first one, also the ones generated later, raises the error of the generation if it fails
+        """
+        i = 0
+        while True:
+            changed = self.changed
+            while i < len(self.blocks):
+                yield self.blocks[i]
+                i += 1
+            if self.error is not None: raise self.error
+            if self.done: return
+            await changed.wait()
+
+class Cache:
+    """
+    Generated G-code of the latest requests (lists of blocks), least recently used entries are dropped above the size limit
+    """
+    def __init__(self, limit):
+        self.limit = limit
+        self.entries = collections.OrderedDict()
+        self.size = 0
+
+    def get(self, key):
+        data = self.entries.get(key)
+        if data is not None: self.entries.move_to_end(key)
+        return data
+
+    def put(self, key, data):
+        size = sum(len(block) for block in data)
+        if size > self.limit: return
+        self.entries[key] = data
+        self.size += size
+        while self.size > self.limit:
+            old_key, old = self.entries.popitem(last=False)
+            self.size -= sum(len(block) for block in old)
+
+class Service:
+    """
+    Generation service: cache, coalescing of identical requests and bounded pool of workers streaming G-code back
+    """
+    def __init__(self, base, workers = None, cache_size = 64 << 20):
+        self.base = base
+        context = multiprocessing.get_context(start_method)
+        self.blocks_in = context.Queue()
+        self.pool = ProcessPoolExecutor(workers, mp_context=context, initializer=start_worker, initargs=(self.blocks_in,))
+        self.cache = Cache(cache_size)
+        self.pending = {} # key -> generation in progress
+        self.streams = {} # stream number -> generation receiving its blocks
+        self.stream_count = 0
+        self.receiver = None
+        self.metrics = Metrics()
+        self.in_flight = 0
+
+    def receive(self, loop): # thread passing blocks from the workers to the event loop
+        while True:
+            item = self.blocks_in.get()
+            if item is None: return
+            loop.call_soon_threadsafe(self.deliver, *item)
+
+    def deliver(self, stream, block):
+        generation = self.streams.get(stream)
+        if generation is None: return # stream of a failed generation
+        if block is None: generation.received.set()
+        else: generation.add(block)
+
+    async def gcode(self, currentConfig):
+        """
+        Returns generation of G-code for the configuration: from the cache, the one in progress or a new one
+        """
+        key = config_key(currentConfig)
+        data = self.cache.get(key)
+        if data is not None:
+            self.metrics.counters['cache_hits'] += 1
+            return Generation(data)
+        if key in self.pending:
+            self.metrics.counters['coalesced'] += 1
+            return self.pending[key]
+        if self.receiver is None:
+            self.receiver = threading.Thread(target=self.receive, args=(asyncio.get_running_loop(),), daemon=True)
+            self.receiver.start()
+        generation = self.pending[key] = Generation()
+        generation.task = asyncio.ensure_future(self.produce(key, generation, currentConfig)) # runs on if all its clients are gone
+        return generation
+
+    async def produce(self, key, generation, currentConfig):
+        started = time.perf_counter()
+        self.stream_count += 1
+        stream = self.stream_count
+        self.streams[stream] = generation
+        try:
+            await asyncio.get_running_loop().run_in_executor(self.pool, render, stream, currentConfig)
+            await generation.received.wait() # blocks and the result come through different queues
+            generation.finish()
+            self.cache.put(key, generation.blocks)
+        except BaseException as e: # also cancellation, clients must not wait forever
+            generation.finish(e if isinstance(e, Exception) else RuntimeError("Generation was cancelled"))
+            if not isinstance(e, Exception): raise
+        finally:
+            del self.streams[stream]
+            del self.pending[key]
+            self.metrics.counters['generations'] += 1
+            self.metrics.generation_seconds += time.perf_counter()-started
+
+    async def handle(self, reader, writer):
+        started = time.perf_counter()
+        self.in_flight += 1
+        self.metrics.counters['requests'] += 1
+        try:
+            try:
+                method, path, headers, body = await read_request(reader)
+                if path == "/metrics" and method == "GET":
+                    await respond(writer, 200, self.metrics.text(self.in_flight, self.cache).encode(), "text/plain; version=0.0.4")
+                elif path == "/generate" and method == "POST":
+                    currentConfig = request_config(self.base, body)
+                    generation = await self.gcode(currentConfig)
+                    await generation.started() # errors before the first block are still reported with their status
+                    try: await respond_stream(writer, generation, "text/x-gcode", {"Content-Disposition": 'attachment; filename="{}"'.format(generator.default_filename(currentConfig))}, self.metrics)
+                    except Exception: # the response has started, the client sees the connection closed before the end
+                        self.metrics.counters['errors'] += 1
+                elif path in ("/metrics", "/generate"): raise RequestError(405, "Method not allowed")
+                else: raise RequestError(404, "Not found")
+            except RequestError as e:
+                self.metrics.counters['errors'] += 1
+                await respond(writer, e.status, json.dumps({'error': str(e)}).encode(), "application/json")
+            except cost.LimitError as e:
+                self.metrics.counters['errors'] += 1
+                await respond(writer, 422, json.dumps({'error': str(e)}).encode(), "application/json")
+            except (ConnectionError, asyncio.IncompleteReadError):
+                self.metrics.counters['errors'] += 1
+            except Exception as e:
+                self.metrics.counters['errors'] += 1
+                await respond(writer, 500, json.dumps({'error': str(e)}).encode(), "application/json")
+        finally:
+            self.in_flight -= 1
+            self.metrics.latencies.append(time.perf_counter()-started)
+            writer.close()
+
+    def close(self):
+        self.pool.shutdown()
+        self.blocks_in.put(None)
+        if self.receiver is not None: self.receiver.join()
+
+async def read_request(reader):
+    """
+    Returns (method, path, headers, body) of HTTP request
+    """
+    line = await reader.readline()
+    try: method, target, version = line.decode("latin-1").split()
+    except ValueError: raise RequestError(400, "Invalid request line")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""): break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0) or 0)
+    if length > max_body: raise RequestError(413, "Request body is too large")
+    body = await reader.readexactly(length) if length else b""
+    return method, target.split("?", 1)[0], headers, body
+
+reasons = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large", 422: "Unprocessable Entity", 500: "Internal Server Error"}
+
+async def respond(writer, status, data, content_type, headers = None):
+    """
+    Writes HTTP response in blocks waiting for the client to read them, returns number of bytes of the body
+    """
+    head = ["HTTP/1.1 {} {}".format(status, reasons.get(status, "")), "Content-Type: "+content_type,
+            "Content-Length: {}".format(len(data)), "Connection: close"]
+    head += ["{}: {}".format(name, value) for name, value in (headers or {}).items()]
+    writer.write(("\r\n".join(head)+"\r\n\r\n").encode("latin-1"))
+    view = memoryview(data)
+    for start in range(0, len(data), block_size):
+        writer.write(view[start:start+block_size])
+        await writer.drain()
+    await writer.drain()
+    return len(data)
+
+async def respond_stream(writer, generation, content_type, headers, metrics):
+    """
+    Writes HTTP response with blocks of the generation as they arrive, waiting for the client to read them
+    Length is known only for finished generations, otherwise the body ends with closing of the connection
+    """
+    head = ["HTTP/1.1 200 OK", "Content-Type: "+content_type, "Connection: close"]
+    if generation.done: head.append("Content-Length: {}".format(generation.size))
+    head += ["{}: {}".format(name, value) for name, value in headers.items()]
+    writer.write(("\r\n".join(head)+"\r\n\r\n").encode("latin-1"))
+    async for block in generation.follow():
+        writer.write(block)
+        await writer.drain()
+        metrics.counters['bytes_sent'] += len(block)
+
+async def serve(service, host, port):
+    server = await asyncio.start_server(service.handle, host, port)
+    print("Serving on http://{}:{}".format(host, port))
+    async with server: await server.serve_forever()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP service generating K-factor calibration patterns")
+    parser.add_argument("-c", "--config", default="Kcalibrator.cfg", help="base configuration file (default: %(default)s)")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on (default: %(default)s)")
+    parser.add_argument("--port", type=int, default=8080, help="port to listen on (default: %(default)s)")
+    parser.add_argument("-j", "--workers", type=int, help="number of generation processes (default: number of processors)")
+    parser.add_argument("--cache", type=int, default=64, help="size of the cache of generated G-code in MB (default: %(default)s)")
+    args = parser.parse_args(argv)
+    base = settings.SettingClass()
+    if os.path.exists(args.config): base.read_config(args.config)
+    service = Service(base, args.workers, args.cache << 20)
+    try: asyncio.run(serve(service, args.host, args.port))
+    except KeyboardInterrupt: pass
+    finally: service.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -14,10 +14,24 @@ class SettingClass():
     def __init__(self):
         self.speed_slow = 20.0 # slow speed for calibration pattern
         self.speed_fast = 100.0 # fast speed for calibrtion pattern
+        self.max_volumetric_flow = 0.0 # maximum volumetric flow of the hotend in mm3/s (0 - no limit)
+        self.cap_to_flow = False # reduce speeds exceeding maximum volumetric flow
+        self.pattern_type = 'K-factor' # K-factor pattern or maximum volumetric flow pattern
+        self.pattern_type_list = ['K-factor','Max flow',]
         self.k_start = 0.0 # \
         self.k_end = 0.2   # | start, stop and step values for K-factor calibration
         self.k_step = 0.01 # /
         self.layers_per_k = 5 # number of layers printed with any specific K-factor
+        self.k_mode = 'Bands' # K-factor mode: full layers with one K-factor, several K-factors along each layer or K-factor changing on every layer
+        self.k_mode_list = ['Bands','Segmented','Ramp',]
+        self.k_segments = 4 # number of K-factors printed along one layer in segmented mode
+        self.k_segments_list = [2, 4]
+        self.fine_k_step = 0.002 # step of the fine sweep generated around the result of the coarse sweep
+        self.fine_span = 1.0 # half-width of the fine sweep in steps of the coarse sweep
+        self.coarse_k = None # (start, stop, step, result) of the coarse sweep the current range was refined from
+        self.flow_start = 5.0 # \
+        self.flow_end = 20.0  # | start, stop and step values of volumetric flow (mm3/s) for max flow pattern
+        self.flow_step = 1.0  # /
         self.z_offset=0.0 # Z-offset
         self.size = (140.0, 70.0) # (X, Y) size of the pattern
         self.retract = (4.0, 30.0) # (length, speed) for retractions
@@ -42,6 +56,23 @@ class SettingClass():
         self.def_speed_travel = 160.0 # defauld traver speed
         self.def_cooling = 50 # part cooling fan speed (0-100)
 
+        self.plate_patterns = [] # overrides for every pattern printed on one plate (empty for single pattern)
+        self.plate_keys = ['temperature', 'k_start', 'k_end', 'k_step', 'speed_slow', 'speed_fast', 'flow_start', 'flow_end', 'flow_step', 'tool'] # settings which can be overridden per pattern
+        self.plate_spacing = 10.0 # distance between brims of neighbouring patterns
+        self.tool = 0 # tool (extruder) printing the pattern
+        self.tool_count = 1 # number of tools calibrated in one job, every tool prints its own pattern (if there are no [Pattern] sections)
+
+        self.limit_bands = 500    # \
+        self.limit_size = 100.0   # | hard limits of the job checked before generation (0 - no limit): bands, MB of G-code, minutes of printing
+        self.limit_time = 600.0   # /
+        self.limit_action = 'Confirm' # jobs over the limits are generated after confirmation or refused
+        self.limit_action_list = ['Confirm','Refuse',]
+
+        self.printer_profile = ''  # \
+        self.firmware_profile = '' # | names of the profiles loaded from the profile database (empty - not used)
+        self.nozzle_profile = ''   # |
+        self.filament_profile = '' # /
+
     def updatesettings(self, root):
         """
         Method for updating settings from GUI
@@ -50,14 +81,18 @@ class SettingClass():
         self.speed_slow = float(s)
         s = root.ent_FastSpeed.get()
         self.speed_fast = float(s) if s else 0.0
-        s = root.ent_StartK.get()
-        self.k_start = float(s) if s else 0.0
-        s = root.ent_StopK.get()
-        self.k_end = float(s) if s else 0.0
-        s = root.ent_StepK.get()
-        self.k_step = float(s) if s else 0.0
+        self.pattern_type = root.cmb_PatternType.get() # K-factor or max flow pattern
+        ranges = root.range_values() # (start, stop, step) of both patterns, the entries show the range of the current one
+        s1, s2, s3 = ranges['K-factor']
+        self.k_start, self.k_end, self.k_step = (float(s1) if s1 else 0.0, float(s2) if s2 else 0.0, float(s3) if s3 else 0.0)
+        s1, s2, s3 = ranges['Max flow']
+        self.flow_start, self.flow_end, self.flow_step = (float(s1) if s1 else 0.0, float(s2) if s2 else 0.0, float(s3) if s3 else 0.0)
         s = root.ent_LayersPerK.get()
         self.layers_per_k = int(s) if s else 0
+        self.k_mode = root.cmb_KMode.get() # K-factor mode
+        s = root.ent_MaxFlow.get()
+        self.max_volumetric_flow = float(s) if s else 0.0
+        self.cap_to_flow = root.chk_CapFlow_var.get()
         s = root.ent_Zoffset.get()
         self.z_offset = float(s) if s else 0.0
         s1 = root.ent_PatternXsize.get(); s2 = root.ent_PatternYsize.get()
@@ -94,6 +129,38 @@ class SettingClass():
         s = root.scl_CoolingPerc.get()
         self.def_cooling = int(s)*5 if s else 0
 
+    def refine(self, k_result):
+        """
+        Method for switching from the coarse sweep to the fine sweep around the K-factor found with it
+        Parameters of the coarse sweep are kept to be saved with the configuration (the first one when a fine sweep is refined again)
+        Raises ValueError if the fine step is not smaller than the step of the current sweep
+        """
+        if not 0 < self.fine_k_step < abs(self.k_step): raise ValueError("Fine K-factor step {f} must be positive and smaller than the current step {s}".format(f=self.fine_k_step, s=self.k_step))
+        if not (self.coarse_k and abs(self.k_step) < self.coarse_k[2]): # current sweep is not a refinement of the saved coarse sweep
+            self.coarse_k = (self.k_start, self.k_end, self.k_step, round(k_result, 4))
+        span = self.k_step*self.fine_span
+        self.k_start = round(max(k_result-span, 0.0), 4)
+        self.k_end = round(k_result+span, 4)
+        self.k_step = self.fine_k_step
+
+    def apply_overrides(self, overrides):
+        """
+        Method for overriding settings with values given as text (e.g. printer profile of the fleet file)
+        """
+        for key, text in overrides.items():
+            if not hasattr(self, key) or key.endswith("_list") or key in ('plate_patterns', 'plate_keys', 'coarse_k'): raise KeyError("Unknown setting {}".format(key))
+            value = getattr(self, key)
+            if isinstance(value, bool): value = True if "true" in text.lower() else False
+            elif isinstance(value, tuple):
+                values = re.findall(r"(\d+(?:\.\d+)?)", text)
+                if len(values) != len(value): raise ValueError("Setting {k} needs {n} values, not {v}".format(k=key, n=len(value), v=text))
+                value = tuple(type(value[0])(float(v)) for v in values)
+            elif isinstance(value, int): value = int(float(text))
+            elif isinstance(value, float): value = float(text)
+            else: value = str(text)
+            if hasattr(self, key+"_list") and value not in getattr(self, key+"_list"): raise ValueError("Invalid value {v} for {k}".format(v=text, k=key))
+            setattr(self, key, value)
+
     # def update_and_create(self):
     #     self.updatesettings()
     #     creategcode()
@@ -110,6 +177,15 @@ class SettingClass():
         config.set("Config", "# fast speed for calibrtion pattern")
         config.set("Config", "speed_fast", str(self.speed_fast))
 
+        config.set("Config", "# maximum volumetric flow of the hotend in mm3/s (0 - no limit)")
+        config.set("Config", "max_volumetric_flow", str(self.max_volumetric_flow))
+
+        config.set("Config", "# reduce speeds exceeding maximum volumetric flow")
+        config.set("Config", "cap_to_flow", str(self.cap_to_flow))
+
+        config.set("Config", "# pattern type (K-factor or Max flow)")
+        config.set("Config", "pattern_type", str(self.pattern_type))
+
         config.set("Config", "# start values for K-factor calibration")
         config.set("Config", "k_start", str(self.k_start))
 
@@ -122,6 +198,27 @@ class SettingClass():
         config.set("Config", "# number of layers printed with any specific K-factor")
         config.set("Config", "layers_per_k", str(self.layers_per_k))
 
+        config.set("Config", "# K-factor mode (Bands, Segmented or Ramp)")
+        config.set("Config", "k_mode", str(self.k_mode))
+
+        config.set("Config", "# number of K-factors printed along one layer in segmented mode (2 or 4)")
+        config.set("Config", "k_segments", str(self.k_segments))
+
+        config.set("Config", "# step values for the fine K-factor sweep")
+        config.set("Config", "fine_k_step", str(self.fine_k_step))
+
+        config.set("Config", "# half-width of the fine sweep in steps of the coarse sweep")
+        config.set("Config", "fine_span", str(self.fine_span))
+
+        if self.coarse_k:
+            config.set("Config", "# (start, stop, step, result) of the coarse sweep")
+            config.set("Config", "coarse_k", str(self.coarse_k))
+
+        config.set("Config", "# start, stop and step values of volumetric flow (mm3/s) for max flow pattern")
+        config.set("Config", "flow_start", str(self.flow_start))
+        config.set("Config", "flow_end", str(self.flow_end))
+        config.set("Config", "flow_step", str(self.flow_step))
+
         config.set("Config", "# Z-offset")
         config.set("Config", "z_offset", str(self.z_offset))
 
@@ -176,6 +273,29 @@ class SettingClass():
         config.set("Config", "# part cooling fan speed (0-100%)")
         config.set("Config", "def_cooling", str(self.def_cooling))
 
+        config.set("Config", "# distance between patterns printed on one plate")
+        config.set("Config", "plate_spacing", str(self.plate_spacing))
+
+        config.set("Config", "# tool printing the pattern and number of tools calibrated in one job (IDEX, toolchangers)")
+        config.set("Config", "tool", str(self.tool))
+        config.set("Config", "tool_count", str(self.tool_count))
+
+        config.set("Config", "# limits of the job checked before generation: number of bands, MB of G-code, minutes of printing (0 - no limit)")
+        config.set("Config", "limit_bands", str(self.limit_bands))
+        config.set("Config", "limit_size", str(self.limit_size))
+        config.set("Config", "limit_time", str(self.limit_time))
+        config.set("Config", "# jobs over the limits: Confirm (ask before generating) or Refuse")
+        config.set("Config", "limit_action", str(self.limit_action))
+
+        config.set("Config", "# profiles loaded from the profile database")
+        for kind in ('printer', 'firmware', 'nozzle', 'filament'): config.set("Config", kind+"_profile", getattr(self, kind+"_profile"))
+
+        for i, overrides in enumerate(self.plate_patterns):
+            section = "Pattern {}".format(i+1)
+            config.add_section(section)
+            for key in self.plate_keys:
+                if key in overrides: config.set(section, key, str(overrides[key]))
+
         with open(path, "w") as config_file:
             config.write(config_file)
         print("Configuration saved")
@@ -188,10 +308,21 @@ class SettingClass():
         config.read(path)
         self.speed_slow = float(config.get("Config", "speed_slow"))
         self.speed_fast = float(config.get("Config", "speed_fast"))
+        self.max_volumetric_flow = float(config.get("Config", "max_volumetric_flow", fallback="0.0"))
+        self.cap_to_flow = True if "true" in config.get("Config", "cap_to_flow", fallback="False").lower() else False
+        self.pattern_type = str(config.get("Config", "pattern_type", fallback="K-factor")) if str(config.get("Config", "pattern_type", fallback="K-factor")) in self.pattern_type_list else "K-factor"
         self.k_start = float(config.get("Config", "k_start"))
         self.k_end = float(config.get("Config", "k_end"))
         self.k_step = float(config.get("Config", "k_step"))
         self.layers_per_k = int(config.get("Config", "layers_per_k"))
+        self.k_mode = str(config.get("Config", "k_mode", fallback="Bands")) if str(config.get("Config", "k_mode", fallback="Bands")) in self.k_mode_list else "Bands"
+        self.k_segments = int(config.get("Config", "k_segments", fallback="4")) if int(config.get("Config", "k_segments", fallback="4")) in self.k_segments_list else 4
+        self.fine_k_step = float(config.get("Config", "fine_k_step", fallback=str(self.fine_k_step)))
+        self.fine_span = float(config.get("Config", "fine_span", fallback=str(self.fine_span)))
+        self.coarse_k = tuple(float(v) for v in re.findall("(\d+(?:\.\d+)?)", config.get("Config", "coarse_k"))) if config.has_option("Config", "coarse_k") else None
+        self.flow_start = float(config.get("Config", "flow_start", fallback=str(self.flow_start)))
+        self.flow_end = float(config.get("Config", "flow_end", fallback=str(self.flow_end)))
+        self.flow_step = float(config.get("Config", "flow_step", fallback=str(self.flow_step)))
         self.z_offset = float(config.get("Config", "z_offset"))
         self.size = tuple(float(v) for v in re.findall("(\d+(?:\.\d+)?)", config.get("Config", "size")))
         self.retract = tuple(float(v) for v in re.findall("(\d+(?:\.\d+)?)", config.get("Config", "retract")))
@@ -212,5 +343,22 @@ class SettingClass():
         self.def_speed_travel = float(config.get("Config", "def_speed_travel"))
         self.def_cooling = int(config.get("Config", "def_cooling"))
 
+        self.plate_spacing = float(config.get("Config", "plate_spacing", fallback=str(self.plate_spacing)))
+        self.tool = int(config.get("Config", "tool", fallback="0"))
+        self.tool_count = max(int(config.get("Config", "tool_count", fallback="1")), 1)
+        self.limit_bands = int(config.get("Config", "limit_bands", fallback=str(self.limit_bands)))
+        self.limit_size = float(config.get("Config", "limit_size", fallback=str(self.limit_size)))
+        self.limit_time = float(config.get("Config", "limit_time", fallback=str(self.limit_time)))
+        self.limit_action = str(config.get("Config", "limit_action", fallback="Confirm")) if str(config.get("Config", "limit_action", fallback="Confirm")) in self.limit_action_list else "Confirm"
+        for kind in ('printer', 'firmware', 'nozzle', 'filament'): setattr(self, kind+"_profile", str(config.get("Config", kind+"_profile", fallback="")))
+        self.plate_patterns = []
+        for section in config.sections():
+            if not section.startswith("Pattern"): continue
+            overrides = {}
+            for key in self.plate_keys:
+                if not config.has_option(section, key): continue
+                overrides[key] = int(config.get(section, key)) if key in ('temperature', 'tool') else float(config.get(section, key))
+            self.plate_patterns.append(overrides)
+
         print("Configuration loaded")
 
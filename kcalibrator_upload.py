@@ -0,0 +1,109 @@
+#! /usr/bin/env python
+#  -*- coding: utf-8 -*-
+# author: Victor Shapovalov (@ArtificalSUN, https://github.com/ArtificalSUN), 2022
+
+"""
+Direct upload of generated G-code to Moonraker (Klipper) or OctoPrint
+G-code is streamed into multipart upload with chunked transfer encoding while it is generated, no temporary file is written
+Connections are kept alive in a pool and reused by repeated uploads to the same printer
+"""
+
+import json, uuid, threading
+import http.client
+from urllib.parse import urlsplit
+
+host_list = ['Moonraker', 'OctoPrint',]
+endpoints = {'Moonraker': '/server/files/upload', 'OctoPrint': '/api/files/local'}
+
+def blocks(chunks, size = 65536):
+    """
+    Joins small pieces of G-code into blocks of at least size bytes, so every HTTP chunk is reasonably large
+    """
+    buffer, length = [], 0
+    for chunk in chunks:
+        data = chunk.encode() if isinstance(chunk, str) else chunk
+        buffer.append(data); length += len(data)
+        if length >= size:
+            yield b"".join(buffer)
+            buffer, length = [], 0
+    if buffer: yield b"".join(buffer)
+
+class ConnectionPool:
+    """
+    Keeps idle keep-alive connections for every printer, can be shared between threads
+    """
+    def __init__(self, timeout = 60):
+        self.timeout = timeout
+        self.idle = {}
+        self.lock = threading.Lock()
+
+    def get(self, scheme, netloc): # returns (connection, True if it was used before)
+        with self.lock:
+            idle = self.idle.get((scheme, netloc))
+            if idle: return idle.pop(), True
+        connection = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+        return connection(netloc, timeout = self.timeout), False
+
+    def put(self, scheme, netloc, connection):
+        with self.lock:
+            self.idle.setdefault((scheme, netloc), []).append(connection)
+
+    def close(self):
+        with self.lock:
+            for connections in self.idle.values():
+                for connection in connections: connection.close()
+            self.idle = {}
+
+pool = ConnectionPool()
+
+class Uploader:
+    """
+    Class to upload G-code to one printer
+    url is the address of Moonraker or OctoPrint (e.g. http://printer.local:7125), host is the kind of server from host_list
+    """
+    def __init__(self, url, host = 'Moonraker', api_key = None, connections = None):
+        if host not in endpoints: raise ValueError("Unknown printer host {}".format(host))
+        parts = urlsplit(url if "//" in url else "http://"+url)
+        self.scheme, self.netloc = parts.scheme, parts.netloc
+        self.path = parts.path.rstrip("/")+endpoints[host]
+        self.host = host
+        self.api_key = api_key
+        self.connections = connections or pool
+
+    def body(self, boundary, filename, chunks, start):
+        if start:
+            yield '--{b}\r\nContent-Disposition: form-data; name="print"\r\n\r\ntrue\r\n'.format(b=boundary).encode()
+        yield '--{b}\r\nContent-Disposition: form-data; name="file"; filename="{f}"\r\nContent-Type: application/octet-stream\r\n\r\n'.format(b=boundary, f=filename).encode()
+        yield from blocks(chunks)
+        yield '\r\n--{b}--\r\n'.format(b=boundary).encode()
+
+    def upload(self, filename, gcode, start = False):
+        """
+        Uploads G-code as filename and optionally starts printing it, returns response of the server
+        gcode is an iterable of G-code pieces or a function returning it; only with a function the upload is repeated
+        when a reused keep-alive connection turns out to be closed by the server
+        """
+        boundary = uuid.uuid4().hex
+        headers = {'Content-Type': 'multipart/form-data; boundary='+boundary}
+        if self.api_key: headers['X-Api-Key'] = self.api_key
+        while True:
+            connection, reused = self.connections.get(self.scheme, self.netloc)
+            chunks = gcode() if callable(gcode) else gcode
+            try:
+                connection.request('POST', self.path, body=self.body(boundary, filename, chunks, start), headers=headers, encode_chunked=True)
+                response = connection.getresponse()
+                data = response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                connection.close()
+                if reused and callable(gcode): continue
+                raise
+            except:
+                connection.close()
+                raise
+            break
+        if response.will_close: connection.close()
+        else: self.connections.put(self.scheme, self.netloc, connection)
+        if not 200 <= response.status < 300:
+            raise IOError("Upload to {n} failed: {s} {r}".format(n=self.netloc, s=response.status, r=response.reason))
+        try: return json.loads(data.decode()) if data else {}
+        except ValueError: return {}
@@ -0,0 +1,384 @@
+#! /usr/bin/env python
+#  -*- coding: utf-8 -*-
+# author: Victor Shapovalov (@ArtificalSUN, https://github.com/ArtificalSUN), 2022
+
+"""
+Streaming G-code analyzer and validator
+Every move is checked against the bed (round bed for Delta) and build height, extrusion must not go backwards while printing,
+feed rate must be set and (optionally) below the speed limit, volumetric flow of extruding moves is checked against the flow limit
+Files are read in chunks, with NumPy every chunk is parsed and checked with vectorized operations, otherwise line by line
+The vectorized parser reads numbers 8 characters at once from 64-bit words and parses chunks on all cores while earlier chunks are checked
+"""
+
+import os, re, sys, argparse
+from math import pi, sqrt, isnan
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import kcalibrator_settings as settings
+
+try:
+    import numpy as np # optional, makes validation many times faster
+except ImportError:
+    np = None
+
+nan = float("nan")
+OTHER, MOVE, SET, ABS, REL, E_ABS, E_REL = range(7) # kinds of lines
+commands = {"G0": MOVE, "G1": MOVE, "G92": SET, "G90": ABS, "G91": REL, "M82": E_ABS, "M83": E_REL}
+axes = "XYZEF"
+tolerance = 1e-3
+chunk_size = 512 << 10 # small enough for arrays of the vectorized parser to stay in the cache
+
+if np is not None:
+    powers = 10.0**np.arange(23) # exact powers of ten
+    int_powers = np.array([10**i for i in range(20)], np.uint64)
+    axis_index = np.full(256, -1, np.int8) # index of axis letter in axes
+    axis_index[[ord(axis) for axis in axes]] = np.arange(len(axes))
+    command_kinds = np.zeros((256, 100), np.int8) # kind of line by letter and number of the command
+    for name, kind in commands.items(): command_kinds[ord(name[0]), int(name[1:])] = kind
+
+class Limits:
+    """
+    Machine limits the G-code is checked against
+    """
+    def __init__(self, currentConfig, max_flow = None, max_speed = None):
+        self.delta = currentConfig.kinematics == 'Delta'
+        self.bed = currentConfig.bed_size
+        self.radius = currentConfig.bed_size[0]/2
+        self.area = pi*currentConfig.def_fil_dia**2/4
+        self.max_flow = max_flow # mm3/s
+        self.max_speed = max_speed # mm/s
+
+class State:
+    """
+    Machine state carried between chunks
+    """
+    def __init__(self):
+        self.position = [0.0, 0.0, 0.0, 0.0] # X, Y, Z, E
+        self.feed = nan # mm/min
+        self.relative = False
+        self.e_relative = False
+        self.line = 0 # number of lines processed
+
+def new_report():
+    return {'lines': 0, 'moves': 0, 'extruding_moves': 0, 'filament': 0.0, 'seconds': 0.0, 'max_flow': 0.0, 'max_speed': 0.0,
+            'min': [nan, nan, nan], 'max': [nan, nan, nan], 'error_count': 0, 'errors': []}
+
+def messages(limits, x, y, z, backwards, feed, flow):
+    """
+    Returns error messages for one move (the same checks for both implementations)
+    """
+    result = []
+    if limits.delta:
+        if x*x+y*y > (limits.radius+tolerance)**2: result.append("X{:.3f} Y{:.3f} is outside the round bed".format(x, y))
+    elif not (-tolerance <= x <= limits.bed[0]+tolerance and -tolerance <= y <= limits.bed[1]+tolerance): result.append("X{:.3f} Y{:.3f} is outside the bed".format(x, y))
+    if not -tolerance <= z <= limits.bed[2]+tolerance: result.append("Z{:.3f} is outside the build volume".format(z))
+    if backwards: result.append("extrusion goes backwards while printing")
+    if feed is not None:
+        if isnan(feed) or feed <= 0: result.append("feed rate is not set")
+        elif limits.max_speed and feed/60 > limits.max_speed+tolerance: result.append("speed {:.1f} mm/s is above {} mm/s".format(feed/60, limits.max_speed))
+    if flow is not None: result.append("volumetric flow {:.2f} mm3/s is above {} mm3/s".format(flow, limits.max_flow))
+    return result
+
+def add_errors(report, line, errors, max_errors):
+    report['error_count'] += len(errors)
+    for error in errors:
+        if len(report['errors']) < max_errors: report['errors'].append((line, error))
+
+word = re.compile(r"(?:^|(?<=\s))([A-Z])([-+.\d]+)")
+
+def parse_line(line):
+    """
+    Returns (kind, [X, Y, Z, E, F]) of G-code line, missing values are nan
+    """
+    line = line.split(";", 1)[0]
+    words = word.findall(line)
+    if not words or not line.startswith(words[0][0]+words[0][1]): return OTHER, None
+    letter, number = words[0]
+    kind = commands.get(letter+str(int(number)), OTHER) if number.isdigit() else OTHER
+    if kind not in (MOVE, SET): return kind, None
+    values = [nan]*5
+    for letter, value in words[1:]:
+        if letter in axes:
+            try: values[axes.index(letter)] = float(value)
+            except ValueError: pass
+    return kind, values
+
+def check_python(text, limits, state, report, max_errors):
+    """
+    Checks chunk of G-code line by line
+    """
+    for line in text.splitlines():
+        state.line += 1
+        kind, values = parse_line(line)
+        if kind == ABS: state.relative = state.e_relative = False
+        elif kind == REL: state.relative = state.e_relative = True
+        elif kind == E_ABS: state.e_relative = False
+        elif kind == E_REL: state.e_relative = True
+        if values is None: continue
+        if not isnan(values[4]): state.feed = values[4]
+        previous = state.position[:]
+        for i in range(4):
+            if isnan(values[i]): continue
+            relative = state.e_relative if i == 3 else state.relative
+            state.position[i] = previous[i]+values[i] if relative and kind == MOVE else values[i]
+        if kind != MOVE: continue
+        x, y, z, e = state.position
+        report['moves'] += 1
+        dx, dy, dz, de = (a-b for a, b in zip(state.position, previous))
+        length = sqrt(dx*dx+dy*dy+dz*dz)
+        feed = state.feed if length > 0 or de != 0 else None
+        flow = None
+        if feed is not None and not isnan(feed) and feed > 0:
+            report['seconds'] += (length or abs(de))/(feed/60)
+            report['max_speed'] = max(report['max_speed'], feed/60)
+        if de > 0: report['filament'] += de
+        if de > 0 and length > 0:
+            report['extruding_moves'] += 1
+            for i, v in enumerate((x, y, z)):
+                report['min'][i] = v if isnan(report['min'][i]) else min(report['min'][i], v)
+                report['max'][i] = v if isnan(report['max'][i]) else max(report['max'][i], v)
+            if feed is not None and not isnan(feed):
+                q = de*limits.area*feed/60/length
+                report['max_flow'] = max(report['max_flow'], q)
+                if limits.max_flow and q > limits.max_flow+tolerance: flow = q
+        errors = messages(limits, x, y, z, de < -tolerance*tolerance and (dx or dy), feed, flow)
+        if errors: add_errors(report, state.line, errors, max_errors)
+
+# codes of characters for the vectorized parser: digits 0..9, point 0x10, plus 0x40, minus 0x60,
+# characters which can not be a part of a number have bit 7 set: capital letters 0x81, whitespace 0x82, others 0x80
+codes = bytes(c-48 if 48 <= c <= 57 else 0x10 if c == 46 else 0x40 if c == 43 else 0x60 if c == 45 else 0x81 if 65 <= c <= 90 else 0x82 if c in b" \t\r\n" else 0x80 for c in range(256))
+comment = re.compile(rb";[^\n]*")
+number = re.compile(rb"[-+.\d]+")
+
+def byte_index(marker):
+    """
+    Index of the byte with the only set bit of 64-bit words, 8 for words without set bits
+    """
+    return (((((marker-np.uint64(1)) >> np.uint64(7)) & np.uint64(0x0101010101010101))*np.uint64(0x0101010101010101)) >> np.uint64(56)).astype(np.int64)
+
+def digits_value(x):
+    """
+    Integer value of eight digits in bytes of 64-bit words (the first digit in the lowest byte)
+    """
+    x = (x*np.uint64(1+(10 << 8)) >> np.uint64(8)) & np.uint64(0x00FF00FF00FF00FF)
+    x = (x*np.uint64(1+(100 << 16)) >> np.uint64(16)) & np.uint64(0x0000FFFF0000FFFF)
+    return x*np.uint64(1+(10000 << 32)) >> np.uint64(32)
+
+def packed_number(x):
+    """
+    Reads 64-bit words of character codes up to the first character which can not be a part of a number
+    Returns value of the digits as eight digit integer (without the point, followed by zeros), masks of the point and the signs and the end mask (bit 7 of the next character)
+    """
+    end = x & np.uint64(0x8080808080808080)
+    end &= ~end+np.uint64(1)
+    x = x & (end >> np.uint64(7))-np.uint64(1)
+    point, sign = x & np.uint64(0x1010101010101010), x & np.uint64(0x4040404040404040)
+    before = (point >> np.uint64(4))-(point != 0) # bytes before the point
+    digits = x & np.uint64(0x0F0F0F0F0F0F0F0F)
+    return digits_value((digits & before) << np.uint64(8) | digits & ~before), point, sign, end # digits before the point take its place
+
+def single(mask): # at most one bit set
+    return (mask & (mask-np.uint64(1))) == 0
+
+def numbers(data, packed, starts):
+    """
+    Returns values of numbers starting at positions starts of data (nan if not valid) and whether they are plain integers
+    packed are character codes of data as 64-bit words starting at every byte, numbers are parsed 8 characters at once
+    """
+    x = packed[starts]
+    value, point, sign, end = packed_number(x)
+    has_point = point != 0
+    valid = single(point) & ((sign >> np.uint64(8)) == 0) & (byte_index(end) > has_point*1+(sign != 0)) # sign only at the beginning, some digits
+    integer = valid & ~has_point & (sign == 0)
+    values = value/powers[8-byte_index(np.where(has_point, point << np.uint64(8), end))] # zeros after the number and digits after the point
+    long = np.flatnonzero(end == 0)
+    if long.size: # next 8 characters, exact integer of up to 15 digits is made first
+        tail, tail_point, tail_sign, tail_end = packed_number(packed[starts[long]+8])
+        length, in_tail = byte_index(tail_end), tail_point != 0
+        head_point = point[long] != 0
+        valid[long] &= single(tail_point) & (tail_sign == 0) & ~(head_point & in_tail) & (8+length > head_point*1+in_tail+(sign[long] != 0))
+        mantissa = (value[long]*int_powers[8-in_tail]+tail)//int_powers[8-length]
+        decimals = np.where(in_tail, length-1-byte_index(tail_point), np.where(head_point, 7+length-byte_index(point[long]), 0))
+        values[long] = mantissa/powers[decimals]
+        integer[long] &= valid[long] & ~in_tail
+    values[(x & np.uint64(0x20)) != 0] *= -1
+    values[~valid] = nan
+    if long.size:
+        for i in long[tail_end == 0]: # more than 15 characters
+            text = number.match(data, starts[i]).group()
+            try: values[i] = float(text)
+            except ValueError: values[i] = nan
+            integer[i] = text.isdigit()
+    return values, integer
+
+def parse_numpy(data):
+    """
+    Parses chunk of G-code (bytes ending with newline) into arrays: kind of every line and values of X, Y, Z, E, F (nan if missing)
+    """
+    if b";" in data: data = comment.sub(b"", data)
+    data = b"\n"+data+b" "*16 # every word is preceded by two characters and followed by two 64-bit words
+    b = np.frombuffer(data, np.uint8)
+    newlines = np.flatnonzero(b == 10)
+    rows = newlines.size-1
+    text = data.translate(codes)
+    c = np.frombuffer(text, np.uint8)
+    # numbers which are values of words: preceded by a letter at the beginning of the line or after whitespace
+    starts = np.flatnonzero((c[2:] < 0x80) & (c[1:-1] == 0x81) & (c[:-2] == 0x82))+2
+    values, integer = numbers(data, np.ndarray((len(text)-7,), "<u8", text, 0, (1,)), starts)
+    row = np.repeat(np.arange(rows), np.diff(np.searchsorted(starts, newlines)))
+    letter = b[starts-1]
+    first = b[starts-2] == 10
+    kinds = np.zeros(rows, np.int8)
+    index = np.flatnonzero(first & integer & (values < 100))
+    kinds[row[index]] = command_kinds[letter[index], values[index].astype(np.int64)]
+    columns = np.full((5, rows), nan)
+    has_values = (kinds == MOVE) | (kinds == SET)
+    axis = axis_index[letter]
+    index = np.flatnonzero((axis >= 0) & ~first & ~np.isnan(values) & has_values[row])
+    columns[axis[index], row[index]] = values[index]
+    return kinds, columns
+
+def last_event(mask, default_index = -1):
+    return np.maximum.accumulate(np.where(mask, np.arange(mask.size), default_index))
+
+def check_numpy(kinds, columns, limits, state, report, max_errors):
+    """
+    Checks chunk of G-code parsed by parse_numpy with vectorized operations
+    """
+    rows = kinds.size
+    if not rows: return
+    # absolute/relative modes of every line
+    modes = last_event((kinds == ABS) | (kinds == REL))
+    relative = np.where(modes >= 0, kinds[modes] == REL, state.relative)
+    e_modes = last_event((kinds == ABS) | (kinds == REL) | (kinds == E_ABS) | (kinds == E_REL))
+    e_relative = np.where(e_modes >= 0, (kinds[e_modes] == REL) | (kinds[e_modes] == E_REL), state.e_relative)
+    is_move = kinds == MOVE
+    positions = np.empty((4, rows))
+    for i in range(4):
+        given = ~np.isnan(columns[i])
+        rel = e_relative if i == 3 else relative
+        anchor = given & ((kinds == SET) | ~rel) # absolute values and G92
+        delta = np.where(given & ~anchor, columns[i], 0.0)
+        total = np.cumsum(delta)
+        anchors = last_event(anchor)
+        base = np.where(anchors >= 0, columns[i][anchors]-total[anchors], state.position[i])
+        positions[i] = base+total
+    feeds = last_event(~np.isnan(columns[4]))
+    feed = np.where(feeds >= 0, columns[4][feeds], state.feed)
+    previous = np.concatenate((np.array(state.position)[:, None], positions[:, :-1]), axis=1)
+    dx, dy, dz, de = positions-previous
+    length = np.sqrt(dx*dx+dy*dy+dz*dz)
+    moving = is_move & ((length > 0) | (de != 0))
+    feed_ok = moving & ~np.isnan(feed) & (feed > 0)
+    extruding = is_move & (de > 0) & (length > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        flow = np.where(extruding & ~np.isnan(feed), de*limits.area*feed/60/length, 0.0)
+        report['seconds'] += float(np.sum(np.where(length > 0, length, np.abs(de))[feed_ok]/(feed[feed_ok]/60)))
+    report['moves'] += int(is_move.sum())
+    report['extruding_moves'] += int(extruding.sum())
+    report['filament'] += float(de[is_move & (de > 0)].sum())
+    if feed_ok.any(): report['max_speed'] = max(report['max_speed'], float(feed[feed_ok].max())/60)
+    if extruding.any():
+        report['max_flow'] = max(report['max_flow'], float(flow.max()))
+        for i in range(3):
+            low, high = float(positions[i][extruding].min()), float(positions[i][extruding].max())
+            report['min'][i] = low if isnan(report['min'][i]) else min(report['min'][i], low)
+            report['max'][i] = high if isnan(report['max'][i]) else max(report['max'][i], high)
+    x, y, z = positions[0], positions[1], positions[2]
+    if limits.delta: outside = x*x+y*y > (limits.radius+tolerance)**2
+    else: outside = (x < -tolerance) | (x > limits.bed[0]+tolerance) | (y < -tolerance) | (y > limits.bed[1]+tolerance)
+    outside |= (z < -tolerance) | (z > limits.bed[2]+tolerance)
+    backwards = (de < -tolerance*tolerance) & ((dx != 0) | (dy != 0))
+    bad_feed = moving & ~feed_ok
+    if limits.max_speed: bad_feed |= moving & feed_ok & (feed/60 > limits.max_speed+tolerance)
+    too_fast = extruding & (flow > limits.max_flow+tolerance) if limits.max_flow else np.zeros(rows, bool)
+    for i in np.flatnonzero(is_move & (outside | backwards | bad_feed | too_fast)): # messages only for the few bad lines
+        errors = messages(limits, x[i], y[i], z[i], backwards[i], feed[i] if moving[i] else None, flow[i] if too_fast[i] else None)
+        add_errors(report, state.line+int(i)+1, errors, max_errors)
+    state.position = [float(p[-1]) for p in positions]
+    state.feed = float(feed[-1])
+    state.relative, state.e_relative = bool(relative[-1]), bool(e_relative[-1])
+    state.line += rows
+
+def blocks(source, size = None):
+    """
+    Yields pieces of G-code (bytes) ending with newline from file path or iterable of text pieces
+    """
+    size = size or chunk_size
+    if isinstance(source, str): pieces = _read(source, size)
+    else: pieces = (chunk.encode() for chunk in source)
+    buffer, length = [], 0
+    for piece in pieces:
+        buffer.append(piece); length += len(piece)
+        if length >= size:
+            data, start = b"".join(buffer), 0
+            while len(data)-start >= size: # large pieces are split too
+                cut = data.rfind(b"\n", start, start+size)+1 or data.find(b"\n", start+size)+1
+                if not cut: break
+                yield data[start:cut]
+                start = cut
+            buffer, length = [data[start:]], len(data)-start
+    data = b"".join(buffer)
+    if data: yield data if data.endswith(b"\n") else data+b"\n"
+
+def _read(path, size):
+    with open(path, "rb") as f:
+        while True:
+            piece = f.read(size)
+            if not piece: break
+            yield piece
+
+def parsed(pool, source, ahead):
+    """
+    Yields chunks of G-code parsed by parse_numpy in order, up to ahead chunks are parsed in advance
+    """
+    pending = deque()
+    for data in blocks(source):
+        pending.append(pool.submit(parse_numpy, data))
+        if len(pending) > ahead: yield pending.popleft().result()
+    while pending: yield pending.popleft().result()
+
+def validate(source, currentConfig, max_flow = None, max_speed = None, max_errors = 100, use_numpy = True):
+    """
+    Validates G-code from file path or iterable of text pieces (e.g. output of the generator)
+    Returns report with statistics, number of errors and first max_errors errors as (line number, message)
+    """
+    limits = Limits(currentConfig, max_flow, max_speed)
+    state, report = State(), new_report()
+    if use_numpy and np is not None:
+        workers = os.cpu_count() or 1
+        with ThreadPoolExecutor(workers) as pool: # NumPy releases the GIL, chunks are parsed in parallel and checked in order
+            for kinds, columns in parsed(pool, source, 2*workers): check_numpy(kinds, columns, limits, state, report, max_errors)
+    else:
+        for data in blocks(source): check_python(data.decode(errors="replace"), limits, state, report, max_errors)
+    report['lines'] = state.line
+    return report
+
+def report_text(report):
+    lines = ["{lines} lines, {moves} moves ({extruding_moves} extruding), filament {filament:.1f} mm, about {minutes:.0f} min".format(minutes=report['seconds']/60, **report),
+             "Extrusion from X{n[0]:.2f} Y{n[1]:.2f} Z{n[2]:.2f} to X{x[0]:.2f} Y{x[1]:.2f} Z{x[2]:.2f}".format(n=report['min'], x=report['max']),
+             "Maximum speed {max_speed:.1f} mm/s, maximum volumetric flow {max_flow:.2f} mm3/s".format(**report)]
+    lines.extend("Line {}: {}".format(line, error) for line, error in report['errors'])
+    if report['error_count'] > len(report['errors']): lines.append("... {} more errors".format(report['error_count']-len(report['errors'])))
+    lines.append("{} errors".format(report['error_count']) if report['error_count'] else "No errors")
+    return "\n".join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check G-code file against the printer described by configuration")
+    parser.add_argument("files", nargs="+", help="G-code files")
+    parser.add_argument("-c", "--config", default="Kcalibrator.cfg", help="configuration file with bed size and kinematics (default: %(default)s)")
+    parser.add_argument("--max-flow", type=float, help="maximum volumetric flow in mm3/s")
+    parser.add_argument("--max-speed", type=float, help="maximum speed in mm/s")
+    args = parser.parse_args(argv)
+    currentConfig = settings.SettingClass()
+    if os.path.exists(args.config): currentConfig.read_config(args.config)
+    failed = False
+    for path in args.files:
+        report = validate(path, currentConfig, args.max_flow, args.max_speed)
+        print("{}:\n{}".format(path, report_text(report)))
+        failed = failed or report['error_count'] > 0
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,187 @@
+#! /usr/bin/env python
+#  -*- coding: utf-8 -*-
+# author: Victor Shapovalov (@ArtificalSUN, https://github.com/ArtificalSUN), 2022
+
+"""
+Watch mode: regenerates G-code when configuration files change
+Configuration files (or directories with .cfg files) are watched with inotify on Linux, other systems poll modification times
+Bursts of changes (e.g. checkout of several files) are collected until nothing changes for the debounce time,
+then only the files with changed settings are regenerated: edits of comments or files saved without changes are skipped
+G-code is written to a temporary file and renamed, so printers and slicers never see partial files
+"""
+
+import os, sys, time, glob, select, argparse
+
+import kcalibrator_settings as settings
+import kcalibrator_generator as generator
+import kcalibrator_cost as cost
+
+try:
+    import ctypes, ctypes.util
+    libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    libc.inotify_init1, libc.inotify_add_watch # Linux only
+except (OSError, AttributeError):
+    libc = None
+
+IN_MODIFY, IN_CLOSE_WRITE, IN_MOVED_TO, IN_CREATE, IN_DELETE = 0x2, 0x8, 0x80, 0x100, 0x200
+IN_NONBLOCK, IN_CLOEXEC = 0o4000, 0o2000000
+
+class Inotify:
+    """
+    Notification about changes in directories (Linux inotify through libc)
+    """
+    def __init__(self, directories):
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0: raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE # editors often save by renaming a new file over the old one
+        for directory in directories:
+            if libc.inotify_add_watch(self.fd, os.fsencode(directory), mask) < 0: raise OSError(ctypes.get_errno(), "Can not watch {}".format(directory))
+
+    def wait(self, timeout):
+        """
+        Returns True if something has changed during timeout seconds (events are discarded, changes are found by comparing files)
+        """
+        ready = select.select([self.fd], [], [], timeout)[0]
+        if not ready: return False
+        try:
+            while os.read(self.fd, 65536): pass
+        except BlockingIOError: pass
+        return True
+
+    def close(self):
+        os.close(self.fd)
+
+class Poller:
+    """
+    Replacement of inotify for other systems: modification times of the files are compared every interval
+    """
+    def __init__(self, paths, interval):
+        self.paths = paths
+        self.interval = interval
+        self.last = snapshot(paths)
+
+    def wait(self, timeout):
+        deadline = time.monotonic()+timeout
+        while True:
+            current = snapshot(self.paths)
+            if current != self.last:
+                self.last = current
+                return True
+            remaining = deadline-time.monotonic()
+            if remaining <= 0: return False
+            time.sleep(min(remaining, self.interval))
+
+    def close(self): pass
+
+def config_files(paths): # configuration files of the paths, directories are searched for .cfg files
+    files = []
+    for path in paths:
+        files.extend(sorted(glob.glob(os.path.join(path, "*.cfg"))) if os.path.isdir(path) else [path])
+    return files
+
+def stamp(path): # (modification time, size) of the file or None if it does not exist
+    try:
+        info = os.stat(path)
+        return info.st_mtime_ns, info.st_size
+    except OSError:
+        return None
+
+def snapshot(paths): # stamps of all configuration files of the paths
+    return {path: stamp(path) for path in config_files(paths)}
+
+def write_atomic(path, chunks):
+    partial = os.path.join(os.path.dirname(path) or ".", "."+os.path.basename(path)+".tmp")
+    try:
+        with open(partial, "w") as out: out.writelines(chunks)
+        os.replace(partial, path)
+    except BaseException:
+        if os.path.exists(partial): os.remove(partial)
+        raise
+
+class Watcher:
+    """
+    Keeps settings of every watched configuration file and regenerates G-code of the changed ones
+    """
+    def __init__(self, paths, output = None, debounce = 0.5, interval = 1.0, poll = False):
+        self.paths = paths
+        self.poll = poll
+        self.output = output
+        self.debounce = debounce
+        self.interval = interval
+        self.stamps = {}
+        self.keys = {} # settings of the last generation for every file
+
+    def output_path(self, path):
+        return os.path.join(self.output or os.path.dirname(path), os.path.splitext(os.path.basename(path))[0]+".gcode")
+
+    def regenerate(self, path):
+        """
+        Generates G-code for configuration file if its settings have changed, returns True if G-code was written
+        """
+        started = time.perf_counter()
+        currentConfig = settings.SettingClass()
+        try:
+            currentConfig.read_config(path)
+            generator.plate_layout(currentConfig)
+        except Exception as e:
+            print("{}: {}".format(path, e))
+            return False
+        key = repr(sorted(vars(currentConfig).items()))
+        if self.keys.get(path) == key:
+            print("{}: settings unchanged".format(path))
+            return False
+        target = self.output_path(path)
+        try:
+            cost.check_limits(currentConfig) # nobody to confirm jobs over the limits
+            write_atomic(target, generator.generate(currentConfig))
+        except Exception as e: # settings the generator fails on must not stop watching the other files
+            print("{}: {}".format(path, e if isinstance(e, ValueError) else "{}: {}".format(type(e).__name__, e)))
+            return False
+        self.keys[path] = key
+        print("{} -> {} in {:.2f} s".format(path, target, time.perf_counter()-started))
+        return True
+
+    def changed(self):
+        """
+        Returns configuration files created or modified since the last call
+        """
+        stamps = snapshot(self.paths)
+        result = [path for path, value in stamps.items() if value is not None and value != self.stamps.get(path)]
+        self.stamps = stamps
+        return result
+
+    def notifier(self):
+        directories = sorted({path if os.path.isdir(path) else os.path.dirname(os.path.abspath(path)) for path in self.paths})
+        if libc is not None and not self.poll:
+            try: return Inotify(directories)
+            except OSError as e: print("{}, polling every {} s".format(e, self.interval))
+        return Poller(self.paths, self.interval)
+
+    def run(self, once = False):
+        for path in self.changed(): self.regenerate(path)
+        if once: return
+        notifier = self.notifier()
+        try:
+            while True:
+                if not notifier.wait(3600): continue
+                while notifier.wait(self.debounce): pass # wait until the burst of changes is over
+                for path in self.changed(): self.regenerate(path)
+        finally:
+            notifier.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Regenerate G-code whenever configuration files change")
+    parser.add_argument("paths", nargs="+", help="configuration files or directories with .cfg files")
+    parser.add_argument("-o", "--output", help="directory of generated G-code (default: next to every configuration file)")
+    parser.add_argument("--debounce", type=float, default=0.5, help="seconds without changes before regeneration (default: %(default)s)")
+    parser.add_argument("--interval", type=float, default=1.0, help="polling interval in seconds where inotify is not available (default: %(default)s)")
+    parser.add_argument("--poll", action="store_true", help="poll modification times even if inotify is available")
+    parser.add_argument("--once", action="store_true", help="generate all files and exit")
+    args = parser.parse_args(argv)
+    if args.output: os.makedirs(args.output, exist_ok=True)
+    try: Watcher(args.paths, args.output, args.debounce, args.interval, args.poll).run(args.once)
+    except KeyboardInterrupt: pass
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
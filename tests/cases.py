@@ -0,0 +1,37 @@
+#  -*- coding: utf-8 -*-
+
+"""
+Reference configurations of the golden and performance tests
+Every case is (settings changed from the defaults, (first band, last band, with brim)) and covers one branch of the generator
+"""
+
+import kcalibrator_settings as settings
+
+full = (0, None, True)
+
+cases = {
+    'default': ({}, full),
+    'single_perimeter': ({'double_perimeter': False, 'retract_at_layer_change': False}, full),
+    'delta_klipper': ({'kinematics': 'Delta', 'bed_size': (200.0, 200.0, 300.0), 'use_ABL': True, 'firmware': 'Klipper',
+                       'k_start': 0.02, 'k_end': 0.1, 'k_step': 0.02, 'size': (80.0, 60.0)}, full),
+    'fractions_rrf': ({'path_spd_fractions': (0.1, 0.5, 0.4), 'k_step': 0.03, 'layers_per_k': 3, 'firmware': 'RepRapFirmware'}, full),
+    'negative_range': ({'k_start': 0.1, 'k_end': 0.0, 'k_step': 0.02}, full),
+    'segmented': ({'k_mode': 'Segmented', 'k_segments': 4, 'k_end': 0.1}, full),
+    'ramp': ({'k_mode': 'Ramp', 'k_end': 0.1}, full),
+    'capped_flow': ({'max_volumetric_flow': 6.0, 'cap_to_flow': True, 'k_end': 0.1}, full),
+    'max_flow': ({'pattern_type': 'Max flow', 'flow_start': 5.0, 'flow_end': 15.0, 'flow_step': 2.5}, full),
+    'plate': ({'size': (90.0, 40.0), 'k_end': 0.1, 'plate_patterns': [{'temperature': 200}, {'temperature': 215, 'k_start': 0.05, 'k_end': 0.15}]}, full),
+    'multi_tool': ({'size': (90.0, 40.0), 'k_end': 0.1, 'tool_count': 2, 'firmware': 'Klipper'}, full),
+    'resume_bands': ({}, (5, 9, False)),
+}
+
+def config(name):
+    """
+    Returns configuration of the case
+    """
+    currentConfig = settings.SettingClass()
+    for key, value in cases[name][0].items(): setattr(currentConfig, key, value)
+    return currentConfig
+
+def generate_args(name):
+    return cases[name][1]
@@ -0,0 +1,93 @@
+#  -*- coding: utf-8 -*-
+
+"""
+Options and shared fixtures of the test suite
+--update-golden    rewrite golden G-code of the cases whose output has changed (only after intended changes of the output)
+--update-budgets   record timing and memory budgets measured on this machine (run without -n, the file is shared)
+--shard I/N        run only shard I of N (tests are assigned by hash of their id, so shards are stable between runs)
+Tests are independent, so pytest-xdist (-n auto) can be used as well
+"""
+
+import os, sys, json, time, zlib
+
+import pytest
+
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(tests_dir)) # modules of the repository
+sys.path.insert(0, tests_dir) # helpers of the tests
+
+budgets_path = os.path.join(tests_dir, "budgets.json")
+
+def pytest_addoption(parser):
+    parser.addoption("--update-golden", action="store_true", help="rewrite golden G-code of the changed cases")
+    parser.addoption("--update-budgets", action="store_true", help="record timing and memory budgets on this machine")
+    parser.addoption("--shard", default=os.environ.get("KCALIBRATOR_SHARD"), metavar="I/N", help="run only shard I of N of the tests")
+
+def pytest_collection_modifyitems(config, items):
+    shard = config.getoption("--shard")
+    if not shard: return
+    try:
+        index, count = (int(v) for v in shard.split("/"))
+        if not 1 <= index <= count: raise ValueError
+    except ValueError: raise pytest.UsageError("--shard must be I/N with 1 <= I <= N, not {}".format(shard))
+    selected, deselected = [], []
+    for item in items: (selected if zlib.crc32(item.nodeid.encode()) % count == index-1 else deselected).append(item)
+    if deselected: config.hook.pytest_deselected(items=deselected)
+    items[:] = selected
+
+def calibration_work(): # fixed pure-Python workload similar to G-code generation (float formatting and string joining)
+    lines = []
+    for i in range(20000):
+        x, y = i*0.0137, i*0.0291
+        lines.append("G1 X{:.3f} Y{:.3f} Z{:.3f} E{:.5f} F{}\n".format(x, y, 0.2, x*y*1e-3, 2400.0))
+    return "".join(lines)
+
+def best_time(function, repeat = 5, minimum = 0.05):
+    """
+    Returns time of one call of function in seconds, the shortest of repeat measurements (least disturbed by other processes)
+    Every measurement calls function as many times as needed to last at least minimum seconds
+    """
+    number = 1
+    while True:
+        started = time.perf_counter()
+        for i in range(number): function()
+        elapsed = time.perf_counter()-started
+        if elapsed >= minimum: break
+        number *= 2
+    best = elapsed/number
+    for i in range(repeat-1):
+        started = time.perf_counter()
+        for i in range(number): function()
+        best = min(best, (time.perf_counter()-started)/number)
+    return best
+
+@pytest.fixture
+def machine_unit():
+    """
+    Time of the calibration workload on this machine, budgets are kept in these units so they do not depend on machine speed
+    Measured right before every test, so the units follow changes of the load of the machine
+    """
+    return best_time(calibration_work)
+
+@pytest.fixture(scope="session")
+def budgets(request):
+    """
+    Budgets of the cases {"time": {case: machine units}, "memory": {case: bytes}}, saved at the end of the session with --update-budgets
+    """
+    try:
+        with open(budgets_path) as f: data = json.load(f)
+    except FileNotFoundError: data = {}
+    data.setdefault("time", {})
+    data.setdefault("memory", {})
+    yield data
+    if request.config.getoption("--update-budgets"):
+        with open(budgets_path, "w") as f:
+            json.dump({kind: dict(sorted(values.items())) for kind, values in sorted(data.items())}, f, indent=2)
+            f.write("\n")
+
+@pytest.fixture(scope="session")
+def budget_factor():
+    """
+    Extra allowance for noisy machines (KCALIBRATOR_BUDGET_FACTOR=2 doubles all timing budgets)
+    """
+    return float(os.environ.get("KCALIBRATOR_BUDGET_FACTOR", "1"))
@@ -0,0 +1,96 @@
+#  -*- coding: utf-8 -*-
+
+"""
+Stand-in printer firmware on a pseudo-terminal for the serial sender tests
+Checks line numbers and checksums like Marlin, answers "ok" or "Resend:", unpacks MeatPack,
+keeps heating commands busy without keepalive messages and records the fill of its receive buffer
+"""
+
+import os, re, pty, tty, time, select, threading
+
+import kcalibrator_meatpack as meatpack
+
+numbered_line = re.compile(r"^N(\d+) ?(.*)\*(\d+)$")
+
+class FakeFirmware:
+    """
+    Firmware thread serving the pseudo-terminal, use as context manager, the sender opens path
+    corrupt: line numbers received with a wrong checksum the first time (the firmware asks to resend them)
+    busy_seconds: time M109 and M190 take before their "ok"
+    """
+    def __init__(self, rx_buffer = 127, corrupt = (), busy_seconds = 0.0, meatpack = False):
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave) # no echo of the firmware output back to it
+        self.path = os.ttyname(self.slave)
+        self.rx_buffer = rx_buffer
+        self.corrupt = set(corrupt)
+        self.busy_seconds = busy_seconds
+        self.meatpack = meatpack
+        self.lines = [] # commands executed in order
+        self.resends = 0
+        self.max_pending = 0 # most bytes waiting in the receive buffer
+        self.expected = 1
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.running = False
+        self.thread.join()
+        os.close(self.master); os.close(self.slave)
+
+    @property
+    def overflow(self):
+        return self.max_pending > self.rx_buffer
+
+    def reply(self, text):
+        os.write(self.master, text.encode())
+
+    def run(self):
+        decoder = meatpack.Decoder()
+        pending, text, busy_until = bytearray(), "", None
+        self.reply("start\n")
+        while self.running:
+            if select.select([self.master], [], [], 0.002)[0]:
+                try: pending += os.read(self.master, 4096)
+                except OSError: return
+                self.max_pending = max(self.max_pending, len(pending))
+            if busy_until is not None:
+                if time.monotonic() < busy_until: continue # heating: nothing is read from the buffer and nothing is sent
+                busy_until = None
+                self.reply("ok\n")
+            while "\n" not in text and pending: # one byte after another, like the serial interrupt of the firmware
+                text += decoder.feed(bytes(pending[:1]))
+                del pending[:1]
+            if "\n" not in text: continue
+            line, _, text = text.partition("\n")
+            busy_until = self.execute(line.strip())
+
+    def execute(self, line): # returns time the firmware is busy until or None
+        if not line: return None
+        match = numbered_line.match(line)
+        if not match: # unnumbered commands of the sender
+            if line.startswith("M110"): self.expected = 1
+            elif line.startswith("M115"): self.reply("FIRMWARE_NAME:Fake\n"+("Cap:MEATPACK:1\n" if self.meatpack else ""))
+            self.reply("ok\n")
+            return None
+        n, command, cs = int(match.group(1)), match.group(2), int(match.group(3))
+        valid = checksum(line[:line.rindex("*")]) == cs and n not in self.corrupt
+        self.corrupt.discard(n)
+        if not valid or n != self.expected:
+            self.resends += 1
+            self.reply("Resend: {}\nok\n".format(self.expected))
+            return None
+        self.expected += 1
+        self.lines.append(command)
+        if command[:4] in ("M109", "M190") and self.busy_seconds: return time.monotonic()+self.busy_seconds
+        self.reply("ok\n")
+        return None
+
+def checksum(line):
+    cs = 0
+    for c in line.encode(): cs ^= c
+    return cs
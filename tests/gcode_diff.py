@@ -0,0 +1,73 @@
+#  -*- coding: utf-8 -*-
+
+"""
+Tolerance-aware comparison of G-code
+Lines are compared command by command: numbers of parameters (X12.345, ADVANCE=0.010) may differ within tolerance,
+so changes of float formatting or rounding do not fail the golden tests while any other change of the output does
+Comments are ignored (they do not reach the printer), extrusion is compared with relative tolerance because E is absolute
+"""
+
+import re
+
+# absolute tolerance of every parameter letter, other numbers use default_tolerance
+tolerances = {'X': 0.002, 'Y': 0.002, 'Z': 0.002, 'E': 0.0002, 'F': 0.1, 'S': 0.0015, 'K': 0.0015}
+default_tolerance = 0.0015
+e_relative = 1e-5 # part of the absolute E value also tolerated (rounding errors add up over the whole print)
+
+word = re.compile(r"^(?:([A-Z])|([A-Z_]+)=)(-?\d+(?:\.\d*)?|-?\.\d+)$")
+
+def tokens(line):
+    """
+    Returns (command, [parameters]) of the line without comment, parameter is (name, number) or (None, text)
+    """
+    code = line.split(";", 1)[0].split()
+    if not code: return None, []
+    parameters = []
+    for token in code[1:]:
+        match = word.match(token)
+        if match: parameters.append((match.group(1) or match.group(2), float(match.group(3))))
+        else: parameters.append((None, token))
+    return code[0], parameters
+
+def tolerance(name, value):
+    limit = tolerances.get(name, default_tolerance)
+    return limit+abs(value)*e_relative if name == 'E' else limit
+
+def compare_line(expected, actual):
+    """
+    Returns None if the lines are equivalent, otherwise the reason of the difference
+    """
+    command, parameters = tokens(expected)
+    other_command, other_parameters = tokens(actual)
+    if command != other_command: return "command {} instead of {}".format(other_command, command)
+    if len(parameters) != len(other_parameters): return "parameters differ"
+    for (name, value), (other_name, other_value) in zip(parameters, other_parameters):
+        if name != other_name: return "parameter {} instead of {}".format(other_name or other_value, name or value)
+        if name is None:
+            if value != other_value: return "{} instead of {}".format(other_value, value)
+        elif abs(value-other_value) > tolerance(name, value):
+            return "{n} differs by {d:.6g}".format(n=name, d=other_value-value)
+    return None
+
+def code_lines(text): # (line number, line) of the lines with commands
+    return [(number, line) for number, line in enumerate(text.splitlines(), 1) if line.split(";", 1)[0].strip()]
+
+def diff(expected, actual, max_differences = 20):
+    """
+    Returns list of (line number in expected, line number in actual, expected line, actual line, reason), empty if equivalent
+    Lines are paired in order, so an inserted or removed command is reported once together with the difference of line counts
+    """
+    if expected == actual: return []
+    expected_lines, actual_lines = code_lines(expected), code_lines(actual)
+    differences = []
+    for (number, line), (other_number, other_line) in zip(expected_lines, actual_lines):
+        reason = compare_line(line, other_line)
+        if reason is None: continue
+        differences.append((number, other_number, line, other_line, reason))
+        if len(differences) >= max_differences: return differences
+    if len(expected_lines) != len(actual_lines):
+        differences.append((len(expected_lines), len(actual_lines), "", "", "{} commands instead of {}".format(len(actual_lines), len(expected_lines))))
+    return differences
+
+def report(differences):
+    return "\n".join("line {}/{}: {}\n  - {}\n  + {}".format(n, m, reason, line, other) for n, m, line, other, reason in differences)
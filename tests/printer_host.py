@@ -0,0 +1,96 @@
+#  -*- coding: utf-8 -*-
+
+"""
+Local stand-in for Moonraker and OctoPrint used by the upload and fleet tests
+Accepts multipart uploads (chunked or with Content-Length) and records them, can be told to fail or to drop keep-alive connections
+"""
+
+import re, threading
+import http.server
+
+class Upload:
+    """
+    One upload received by the host
+    """
+    def __init__(self, path, headers, fields, filename, data):
+        self.path = path
+        self.headers = headers
+        self.fields = fields # form fields other than the file
+        self.filename = filename
+        self.data = data
+
+def parse_multipart(body, content_type):
+    boundary = re.search(r"boundary=(\S+)", content_type).group(1).encode()
+    fields, filename, data = {}, None, None
+    for part in body.split(b"--"+boundary)[1:-1]:
+        head, _, content = part[2:-2].partition(b"\r\n\r\n")
+        name = re.search(rb'name="([^"]*)"', head).group(1).decode()
+        match = re.search(rb'filename="([^"]*)"', head)
+        if match: filename, data = match.group(1).decode(), content
+        else: fields[name] = content.decode()
+    return fields, filename, data
+
+class PrinterHost:
+    """
+    HTTP server on a free local port, use as context manager
+    status is returned for every upload, the first fail_count uploads get 500 instead,
+    with drop_connections the connection is closed after every response although it was announced as keep-alive,
+    with garbage the response is not HTTP at all (http.client raises BadStatusLine)
+    """
+    def __init__(self, status = 201, fail_count = 0, drop_connections = False, garbage = False):
+        self.status = status
+        self.garbage = garbage
+        self.fail_count = fail_count
+        self.drop_connections = drop_connections
+        self.uploads = []
+        self.requests = 0
+        self.connections = 0
+        self.lock = threading.Lock()
+        host = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with host.lock: host.connections += 1
+
+            def read_body(self):
+                if self.headers.get("Transfer-Encoding", "").lower() != "chunked": return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                data = []
+                while True:
+                    size = int(self.rfile.readline().split(b";")[0], 16)
+                    data.append(self.rfile.read(size)); self.rfile.readline()
+                    if not size: return b"".join(data)
+
+            def do_POST(self):
+                body = self.read_body()
+                with host.lock:
+                    host.requests += 1
+                    failed = host.requests <= host.fail_count
+                    if not failed: host.uploads.append(Upload(self.path, dict(self.headers), *parse_multipart(body, self.headers["Content-Type"])))
+                if host.garbage:
+                    self.wfile.write(b"garbage\r\n\r\n")
+                    self.close_connection = True
+                    return
+                status = 500 if failed else host.status
+                reply = b'{"result": "ok"}'
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(reply)))
+                self.end_headers()
+                self.wfile.write(reply)
+                if host.drop_connections: self.close_connection = True
+
+            def log_message(self, *args): pass
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:{}".format(self.server.server_address[1])
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
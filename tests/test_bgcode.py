@@ -0,0 +1,75 @@
+#  -*- coding: utf-8 -*-
+
+"""
+Tests of binary G-code: written files read back with read_bgcode give the same G-code and sensible metadata
+"""
+
+import math
+
+import pytest
+
+import kcalibrator_generator as generator
+import kcalibrator_bgcode as bgcode
+import kcalibrator_meatpack as meatpack
+import cases
+
+def commands(name):
+    return list(generator.commands(generator.generate(cases.config(name), *cases.generate_args(name))))
+
+@pytest.mark.parametrize("compression", bgcode.compression_list)
+@pytest.mark.parametrize("use_meatpack", [True, False])
+def test_round_trip(compression, use_meatpack, tmp_path):
+    path = str(tmp_path/"test.bgcode")
+    bgcode.write_bgcode(cases.config('segmented'), path, compression=compression, use_meatpack=use_meatpack)
+    result = bgcode.read_bgcode(path)
+    lines = commands('segmented')
+    encoder = meatpack.Encoder()
+    assert result['gcode'] == "".join((encoder.prepare(line) if use_meatpack else line)+"\n" for line in lines)
+    assert result['file']['Producer'] == generator.versionstring
+
+def test_blocks_and_arguments(tmp_path):
+    path = str(tmp_path/"test.bgcode")
+    bgcode.write_bgcode(cases.config('default'), path, 5, 9, False, compression='deflate', use_meatpack=False)
+    assert bgcode.read_bgcode(path)['gcode'] == "".join(line+"\n" for line in commands('resume_bands'))
+    assert b"".join(bgcode.bgcode_chunks(cases.config('default'), 5, 9, False, compression='deflate', use_meatpack=False)) == open(path, "rb").read()
+
+def positive_e(lines): # sum of all increments of E, including moves pushing retracted filament back
+    e = total = 0.0
+    for line in lines:
+        words = dict((word[0], word[1:]) for word in line.split()[1:])
+        if 'E' not in words: continue
+        if line.startswith("G1") and float(words['E']) > e: total += float(words['E'])-e
+        e = float(words['E'])
+    return total
+
+def test_metadata(tmp_path):
+    path = str(tmp_path/"test.bgcode")
+    currentConfig = cases.config('default')
+    bgcode.write_bgcode(currentConfig, path)
+    result = bgcode.read_bgcode(path)
+    assert 'nozzle_diameter' not in result['printer'] # not known, line width is not the nozzle
+    assert result['printer']['temperature'] == "210" and result['printer']['bed_temperature'] == "60"
+    lines = commands('default')
+    deretractions = sum(line.startswith("G1 E0 ") for line in lines)
+    filament = float(result['print']['filament used [mm]'])
+    assert filament == pytest.approx(positive_e(lines)-deretractions*currentConfig.retract[0], abs=0.05)
+    assert float(result['print']['filament used [cm3]']) == pytest.approx(filament*math.pi/4*1.75**2/1000, abs=0.01)
+
+def test_damaged_file(tmp_path):
+    path = str(tmp_path/"test.bgcode")
+    bgcode.write_bgcode(cases.config('default'), path)
+    data = bytearray(open(path, "rb").read())
+    data[len(data)//2] ^= 0x55
+    open(path, "wb").write(bytes(data))
+    with pytest.raises(ValueError):
+        bgcode.read_bgcode(path)
+    open(path, "wb").write(b"; plain G-code\n")
+    with pytest.raises(ValueError):
+        bgcode.read_bgcode(path)
+
+@pytest.mark.parametrize("window", [11, 12])
+def test_heatshrink(window):
+    data = "".join(generator.generate(cases.config('ramp'))).encode()[:200000]+bytes(range(256))*3
+    packed = bgcode.heatshrink_compress(data, window, 4)
+    assert bgcode.heatshrink_decompress(packed, window, 4) == data
+    assert len(packed) < len(data)/2
@@ -0,0 +1,47 @@
+#  -*- coding: utf-8 -*-
+
+"""
+Tests of the command line interface: output formats, uploads and calibration history
+"""
+
+import os, gzip
+
+import kcalibrator_cli as cli
+import kcalibrator_bgcode as bgcode
+import kcalibrator_profiles as profiles
+from printer_host import PrinterHost
+
+def run(tmp_path, *args):
+    return cli.main(["-c", str(tmp_path/"missing.cfg")]+list(args))
+
+def test_binary_upload(tmp_path):
+    with PrinterHost() as host: assert run(tmp_path, "--binary", "--upload", host.url, "--compression", "deflate", "-o", str(tmp_path/"saved.bgcode")) == 0
+    received = host.uploads[0]
+    assert received.filename == "saved.bgcode" and received.data.startswith(bgcode.magic)
+    assert received.data == open(str(tmp_path/"saved.bgcode"), "rb").read()
+
+def test_compressed_upload(tmp_path):
+    with PrinterHost() as host: assert run(tmp_path, "--upload", host.url, "-o", str(tmp_path/"saved.gcode.gz"), "--level", "6") == 0
+    received = host.uploads[0]
+    assert received.filename == "saved.gcode.gz"
+    assert gzip.decompress(received.data) == gzip.decompress(open(str(tmp_path/"saved.gcode.gz"), "rb").read())
+
+def test_wrong_level_upload(tmp_path):
+    with PrinterHost() as host: assert run(tmp_path, "--upload", host.url, "-o", "pattern.gcode.gz", "--level", "15") == 1
+    assert not host.uploads
+
+def test_meatpack_with_compressed_output(tmp_path, capsys):
+    for output in ("pattern.gcode.gz", "pattern.bgcode"):
+        assert run(tmp_path, "--meatpack", "-o", str(tmp_path/output)) == 1
+        assert "--meatpack can not be combined" in capsys.readouterr().out
+        assert not os.path.exists(str(tmp_path/output))
+
+def test_record(tmp_path, capsys):
+    db = str(tmp_path/"profiles.db")
+    assert run(tmp_path, "--db", db, "--record", "0.052", "--height", "12.5") == 0
+    assert "recorded" in capsys.readouterr().out
+    with profiles.ProfileStore(db) as store: history = store.history()
+    assert len(history) == 1 and (history[0]['k'], history[0]['height']) == (0.052, 12.5)
+    assert os.listdir(str(tmp_path)) == ["profiles.db"] # nothing is generated
+    assert run(tmp_path, "--db", db, "--record", "0.05", "--pattern", "Max flow") == 1
+    with profiles.ProfileStore(db) as store: assert len(store.history()) == 1
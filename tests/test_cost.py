@@ -0,0 +1,48 @@
+#  -*- coding: utf-8 -*-
+
+"""
+Tests of the cost estimate and the limits of the job
+"""
+
+import pytest
+
+import kcalibrator_settings as settings
+import kcalibrator_cost as cost
+import cases
+
+@pytest.mark.parametrize("name", sorted(cases.cases))
+def test_estimate_matches_output(name):
+    currentConfig, args = cases.config(name), cases.generate_args(name)
+    job, actual = cost.estimate(currentConfig, *args), cost.measure(currentConfig, *args)
+    assert job.lines == pytest.approx(actual['lines'], rel=0.01)
+    assert job.moves == pytest.approx(actual['moves'], rel=0.01)
+    assert job.bytes == pytest.approx(actual['bytes'], rel=0.01)
+    assert job.filament == pytest.approx(actual['filament'], rel=0.01)
+    assert job.seconds == pytest.approx(actual['seconds'], rel=0.15)
+
+def test_estimate_does_not_generate_the_job():
+    currentConfig = cases.config('default')
+    currentConfig.k_mode, currentConfig.k_step, currentConfig.bed_size = 'Ramp', 0.0005, (235.0, 235.0, 500.0)
+    job = cost.estimate(currentConfig)
+    assert job.bands == 401
+    assert job.layers == 402
+    assert job.memory < 1 << 20 # the largest layer, not the whole job
+
+def test_limits():
+    currentConfig = cases.config('default')
+    job = cost.estimate(currentConfig)
+    assert cost.exceeded(job, currentConfig) == []
+    currentConfig.limit_bands, currentConfig.limit_size, currentConfig.limit_time = 10, 0.1, 10
+    assert len(cost.exceeded(job, currentConfig)) == 3
+    with pytest.raises(cost.LimitError):
+        cost.check_limits(currentConfig)
+    currentConfig.limit_bands = currentConfig.limit_size = currentConfig.limit_time = 0 # no limits
+    assert cost.exceeded(job, currentConfig) == []
+
+def test_limits_round_trip(tmp_path):
+    currentConfig = settings.SettingClass()
+    currentConfig.limit_bands, currentConfig.limit_size, currentConfig.limit_time, currentConfig.limit_action = 50, 2.5, 90.0, 'Refuse'
+    currentConfig.save_config(str(tmp_path/"Kcalibrator.cfg"))
+    loaded = settings.SettingClass()
+    loaded.read_config(str(tmp_path/"Kcalibrator.cfg"))
+    assert (loaded.limit_bands, loaded.limit_size, loaded.limit_time, loaded.limit_action) == (50, 2.5, 90.0, 'Refuse')
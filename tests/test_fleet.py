@@ -0,0 +1,69 @@
+#  -*- coding: utf-8 -*-
+
+"""
+Tests of the fleet dispatcher against local stand-ins of the printer hosts
+"""
+
+import asyncio
+
+import kcalibrator_generator as generator
+import kcalibrator_upload as upload
+import kcalibrator_fleet as fleet
+from printer_host import PrinterHost
+
+def write_fleet(tmp_path, printers):
+    path = tmp_path/"fleet.cfg"
+    path.write_text("".join("[{}]\n".format(name)+"".join("{} = {}\n".format(key, value) for key, value in keys.items()) for name, keys in printers.items()))
+    return str(path)
+
+def dispatch(jobs, **kwargs):
+    return asyncio.run(fleet.dispatch(jobs, connections=upload.ConnectionPool(), delay=0.0, **kwargs))
+
+def test_fleet_upload(tmp_path):
+    with PrinterHost() as voron, PrinterHost() as prusa:
+        path = write_fleet(tmp_path, {'Voron': {'url': voron.url, 'firmware': "Klipper", 'temperature': "(240, 100)"},
+                                      'Prusa': {'url': prusa.url, 'host': "OctoPrint", 'api_key': "secret", 'k_end': "0.1"}})
+        jobs = dispatch(fleet.read_fleet(path, base=str(tmp_path/"missing.cfg")))
+    assert [(job.name, job.status, job.attempts) for job in jobs] == [('Voron', 'ok', 1), ('Prusa', 'ok', 1)]
+    assert voron.uploads[0].data == "".join(generator.generate(jobs[0].config)).encode()
+    assert b"SET_PRESSURE_ADVANCE" in voron.uploads[0].data and b"M190 S100" in voron.uploads[0].data
+    assert prusa.uploads[0].headers["X-Api-Key"] == "secret"
+    assert jobs[0].bytes == len(voron.uploads[0].data)
+
+def test_failed_upload_is_retried():
+    with PrinterHost(fail_count=2) as host:
+        jobs = dispatch([fleet.PrinterJob('Ender', fleet.settings.SettingClass(), host.url)], retries=2)
+    assert (jobs[0].status, jobs[0].attempts) == ('ok', 3)
+    assert len(host.uploads) == 1
+
+def test_bad_printers_do_not_stop_the_fleet(tmp_path):
+    with PrinterHost() as good, PrinterHost(garbage=True) as broken:
+        path = write_fleet(tmp_path, {'Good': {'url': good.url},
+                                      'Typo': {'url': good.url, 'temperature': "abc"},
+                                      'NoUrl': {'firmware': "Klipper"},
+                                      'Broken': {'url': broken.url}})
+        jobs = dispatch(fleet.read_fleet(path, base=str(tmp_path/"missing.cfg")), retries=1)
+    status = {job.name: job.status for job in jobs}
+    assert status == {'Good': 'ok', 'Typo': 'failed', 'NoUrl': 'failed', 'Broken': 'failed'}
+    assert len(good.uploads) == 1
+    assert jobs[3].attempts == 2 # BadStatusLine of the broken host is retried like other upload errors
+    text = fleet.report(jobs, 1.0)
+    assert "temperature needs 2 values" in text and "has no url" in text and "1 ok, 3 failed" in text
+
+def test_backoff_releases_the_slot():
+    async def dispatch_and_look(jobs, uploads):
+        task = asyncio.ensure_future(fleet.dispatch(jobs, parallel=1, retries=1, delay=2.0, connections=upload.ConnectionPool()))
+        await asyncio.sleep(1.5)
+        seen = len(uploads) # the good printer uploads while the flaky one waits for its retry
+        return await task, seen
+    with PrinterHost(fail_count=1) as flaky, PrinterHost() as good:
+        jobs = [fleet.PrinterJob('Flaky', fleet.settings.SettingClass(), flaky.url), fleet.PrinterJob('Good', fleet.settings.SettingClass(), good.url)]
+        jobs, seen = asyncio.run(dispatch_and_look(jobs, good.uploads))
+    assert [(job.status, job.attempts) for job in jobs] == [('ok', 2), ('ok', 1)]
+    assert seen == 1 and jobs[0].seconds > 2.0
+
+def test_wrong_configuration_is_timed():
+    currentConfig = fleet.settings.SettingClass()
+    currentConfig.size = (1000, 30)
+    jobs = dispatch([fleet.PrinterJob('Huge', currentConfig, "http://127.0.0.1:9")])
+    assert jobs[0].status == 'failed' and jobs[0].seconds > 0
@@ -0,0 +1,56 @@
+#  -*- coding: utf-8 -*-
+
+"""
+Fuzzing of the generator (fixed seeds, so the run is repeatable) and regressions found by fuzzing
+Longer runs: python kcalibrator_fuzz.py -n 5000
+"""
+
+import time, multiprocessing
+
+import pytest
+
+import kcalibrator_generator as generator
+import kcalibrator_fuzz as fuzz
+
+def test_random_configurations():
+    cases = [(seed, fuzz.random_overrides(seed)) for seed in range(60)]
+    failures = [(seed, result['result'], result['message'], fuzz.describe(overrides))
+                for seed, overrides, result in fuzz.run_cases(cases, 2, timeout=30) if fuzz.failed(result)]
+    assert not failures
+
+@pytest.mark.parametrize("overrides", [
+    {'k_start': -0.05, 'k_end': 0.05},
+    {'k_start': 0.1, 'k_end': -0.1, 'k_step': 0.01},
+    {'pattern_type': 'Max flow', 'flow_start': 0.0},
+    {'speed_slow': 0.0},
+    {'def_layer': 0.0},
+    {'z_offset': -0.3},
+    {'bed_size': (180.0, 180.0, 20.0)},
+    {'size': (300.0, 300.0)},
+    {'kinematics': 'Delta', 'bed_size': (150.0, 150.0, 300.0)},
+])
+def test_invalid_settings_are_rejected(overrides):
+    with pytest.raises(ValueError):
+        generator.plate_layout(fuzz.make_config(overrides))
+
+@pytest.mark.parametrize("key", ['k_step', 'flow_step'])
+def test_zero_step_terminates(key):
+    overrides = {key: 0.0, 'pattern_type': 'Max flow' if key == 'flow_step' else 'K-factor'}
+    assert fuzz.check(overrides)['result'] == 'ok'
+    assert generator.band_count(fuzz.make_config(overrides)) == 1
+
+def test_odd_path_fractions():
+    for fractions in [(0.0, 1.0, 0.0), (0.5, 0.0, 0.5), (0.4, 0.4, 0.4)]:
+        result = fuzz.check({'path_spd_fractions': fractions})
+        assert result['result'] == 'ok', result['message']
+
+def hanging_check(overrides):
+    time.sleep(60)
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != "fork", reason="worker must inherit the patched check")
+def test_hanging_generation_is_killed(monkeypatch):
+    monkeypatch.setattr(fuzz, "check", hanging_check)
+    started = time.monotonic()
+    results = list(fuzz.run_cases([(0, {})], 1, timeout=0.5))
+    assert results[0][2]['result'] == 'timeout'
+    assert time.monotonic()-started < 10
@@ -0,0 +1,34 @@
+#  -*- coding: utf-8 -*-
+
+"""
+Tests of the tolerance-aware G-code comparison used by the golden tests
+"""
+
+import gcode_diff
+
+def test_identical():
+    assert gcode_diff.diff("G1 X1.000 Y2.000\n", "G1 X1.000 Y2.000\n") == []
+
+def test_rounding_is_tolerated():
+    assert gcode_diff.diff("G1 X1.000 Y2.000 E10.00000\nM117 K=0.010\n", "G1 X1.001 Y2.0 E10.00005\nM117 K=0.01\n") == []
+
+def test_comments_are_ignored():
+    assert gcode_diff.diff(";Generated with v1\nG28 ; home\n", ";Generated with v2\nG28\n") == []
+
+def test_moved_coordinate():
+    differences = gcode_diff.diff("G0 X1.000\nG1 X5.000 E1.00000\n", "G0 X1.000\nG1 X5.010 E1.00000\n")
+    assert len(differences) == 1
+    assert differences[0][:2] == (2, 2)
+    assert "X differs" in differences[0][4]
+
+def test_changed_command_and_text():
+    assert gcode_diff.diff("M900 K0.010\n", "M572 D0 S0.010\n")[0][4].startswith("command")
+    assert gcode_diff.diff("BED_MESH_CALIBRATE\nM117 Done\n", "BED_MESH_CALIBRATE\nM117 Fail\n")
+
+def test_extra_command():
+    differences = gcode_diff.diff("G28\nG90\n", "G28\nG90\nM84\n")
+    assert differences[-1][4] == "3 commands instead of 2"
+
+def test_extrusion_tolerance_grows_with_e():
+    assert gcode_diff.diff("G1 E7000.00000\n", "G1 E7000.05000\n") == []
+    assert gcode_diff.diff("G1 E7.00000\n", "G1 E7.05000\n")
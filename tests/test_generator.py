@@ -0,0 +1,101 @@
+#  -*- coding: utf-8 -*-
+
+"""
+Tests of the generator behaviour not covered by the golden output: warnings, validation of settings and G-code details
+"""
+
+import pytest
+
+import kcalibrator_generator as generator
+import cases
+
+def test_plate_temperatures_warning():
+    assert len(generator.plate_warnings(cases.config('plate'))) == 1 # one tool prints patterns at 200 and 215 C
+    assert generator.plate_warnings(cases.config('multi_tool')) == []
+    currentConfig = cases.config('plate')
+    currentConfig.plate_patterns = [{'temperature': 200, 'tool': 0}, {'temperature': 215, 'tool': 1}]
+    assert generator.plate_warnings(currentConfig) == [] # every tool keeps its own temperature
+
+def test_resume_does_not_home_z():
+    text = "".join(generator.generate(cases.config('resume_bands'), *cases.generate_args('resume_bands')))
+    lines = text.splitlines()
+    assert "G28 X Y" in lines and "G28" not in lines
+    assert not any(line.startswith(("G29", "BED_MESH_CALIBRATE", "G92 Z")) for line in lines)
+    assert lines.index("G0 Z5 F600") < lines.index("G28 X Y") < lines.index("M109 S210") # lifted off the pattern before homing and heating
+    currentConfig = cases.config('delta_klipper')
+    lines = "".join(generator.generate(currentConfig, 1, 2, False)).splitlines()
+    assert "G28" in lines and "BED_MESH_CALIBRATE" not in lines # Delta homes at the top, away from the pattern
+
+def test_delta_resume_keeps_z_offset():
+    currentConfig = cases.config('delta_klipper')
+    currentConfig.z_offset = 0.15
+    start = "".join(generator.generate(currentConfig, 0, 1, True)).splitlines()
+    lines = "".join(generator.generate(currentConfig, 1, 2, False)).splitlines()
+    home = lines.index("G28")
+    assert lines[home+1].startswith("G0 Z") and lines[home+2].startswith("G92 Z")
+    z, set_z = float(lines[home+1].split()[1][1:]), float(lines[home+2].split()[1][1:])
+    start_z = next(float(line.split()[1][1:]) for line in start if line.startswith("G0 Z"))
+    start_set_z = next(float(line.split()[1][1:]) for line in start if line.startswith("G92 Z"))
+    assert set_z-z == pytest.approx(start_set_z-start_z) == pytest.approx(-0.15) # printer Z is shifted by the offset like in the first job
+    assert z <= currentConfig.bed_size[2]
+
+def test_capped_fast_speed_warning():
+    currentConfig = cases.config('default')
+    currentConfig.max_volumetric_flow, currentConfig.cap_to_flow = 1.0, True
+    warnings = generator.flow_warnings(currentConfig)
+    assert len(warnings) == 1 and warnings[0].startswith("Fast segments are capped") # capped speeds are within the limit, but all equal
+    currentConfig.cap_to_flow = False
+    assert not any(warning.startswith("Fast segments are capped") for warning in generator.flow_warnings(currentConfig))
+    currentConfig.max_volumetric_flow, currentConfig.cap_to_flow = 1000.0, True
+    assert generator.flow_warnings(currentConfig) == []
+
+def retraction_states(lines):
+    """
+    Follows filament of every tool through the G-code (absolute E), returns list of (tool, retracted length) for every tool change
+    Fails if a tool is un-retracted more than it was retracted or extrudes while retracted
+    """
+    tool, e, retracted, parked = 0, 0.0, {}, []
+    for line in lines:
+        words = dict((word[0], word[1:]) for word in line.split()[1:])
+        if line.startswith("T"):
+            parked.append((tool, retracted.get(tool, 0.0)))
+            tool = int(line[1:])
+        elif line.startswith("G92") and 'E' in words: e = float(words['E'])
+        elif line.startswith("G1") and 'E' in words:
+            delta, e = float(words['E'])-e, float(words['E'])
+            if 'X' in words or 'Y' in words: assert retracted.get(tool, 0.0) < 1e-9, "T{} extrudes while retracted: {}".format(tool, line)
+            else:
+                retracted[tool] = round(retracted.get(tool, 0.0)-delta, 6)
+                assert retracted[tool] >= 0, "T{} is un-retracted more than it was retracted: {}".format(tool, line)
+    return parked
+
+@pytest.mark.parametrize("retract_at_layer_change", [True, False])
+@pytest.mark.parametrize("with_brim", [True, False])
+def test_tool_switch_retraction(retract_at_layer_change, with_brim):
+    currentConfig = cases.config('multi_tool')
+    currentConfig.retract_at_layer_change = retract_at_layer_change
+    lines = "".join(generator.generate(currentConfig, 0 if with_brim else 2, None, with_brim)).splitlines()
+    parked = retraction_states(lines)
+    retract = "G1 E-{R} F{S}".format(R=currentConfig.retract[0], S=currentConfig.retract[1]*60)
+    assert len(parked) > 10
+    assert all(length == currentConfig.retract[0] for tool, length in parked[1:]) # every tool is parked retracted, also between the brims
+    for i, line in enumerate(lines):
+        if line.startswith("T"): assert lines[i+1].startswith("G92 E") and (i < 20 or lines[i-2:i] == ["G92 E0", retract]), i # E is reset around every switch
+
+def test_plate_temperatures_wait_for_cooling():
+    lines = "".join(generator.generate(cases.config('plate'))).splitlines()
+    switches = [line for line in lines if line.startswith("M109")]
+    assert switches[0] == "M109 S210" and set(switches[1:]) == {"M109 R215", "M109 R200"} # M109 S of Marlin does not wait while cooling from 210 or 215
+    currentConfig = cases.config('plate')
+    currentConfig.firmware = 'Klipper'
+    assert set(line for line in "".join(generator.generate(currentConfig)).splitlines() if line.startswith("M109")) == {"M109 S210", "M109 S200", "M109 S215"}
+
+@pytest.mark.parametrize("height", [-0.9, -0.1, 16.8])
+def test_height_outside_pattern(height):
+    with pytest.raises(IndexError):
+        generator.k_at_height(height, 0, 0.2, 0.01, 0.2, 4)
+    with pytest.raises(IndexError):
+        generator.flow_at_height(height, 5, 25, 1, 0.2, 4)
+    assert generator.k_at_height(0.0, 0, 0.2, 0.01, 0.2, 4) == 0 and generator.k_at_height(16.7, 0, 0.2, 0.01, 0.2, 4) == 0.2
+    with pytest.raises(IndexError):
+        generator.KSequence(0, 0.2, 0.01)[-1] # no wrap around to the top band
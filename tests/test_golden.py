@@ -0,0 +1,72 @@
+#  -*- coding: utf-8 -*-
+
+"""
+Golden output tests: G-code of the reference configurations must stay equivalent to tests/golden/<case>.gcode.gz
+"""
+
+import os, gzip, hashlib
+
+import pytest
+
+import kcalibrator_settings as settings
+import kcalibrator_generator as generator
+import cases
+import gcode_diff
+
+golden_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden")
+
+def golden_path(name):
+    return os.path.join(golden_dir, name+".gcode.gz")
+
+def read_golden(name):
+    with gzip.open(golden_path(name), "rt", newline="") as f: return f.read()
+
+def write_golden(name, text):
+    os.makedirs(golden_dir, exist_ok=True)
+    with open(golden_path(name), "wb") as f: f.write(gzip.compress(text.encode(), 9, mtime=0)) # same output gives the same file
+
+def output(name):
+    return "".join(generator.generate(cases.config(name), *cases.generate_args(name)))
+
+@pytest.mark.parametrize("name", sorted(cases.cases))
+def test_golden(name, request):
+    text = output(name)
+    if not os.path.exists(golden_path(name)):
+        if request.config.getoption("--update-golden"):
+            write_golden(name, text)
+            pytest.skip("golden G-code of {} created".format(name))
+        pytest.fail("No golden G-code for {}, run pytest --update-golden".format(name))
+    expected = read_golden(name)
+    if text == expected: return
+    differences = gcode_diff.diff(expected, text)
+    if differences and request.config.getoption("--update-golden"):
+        write_golden(name, text)
+        pytest.skip("golden G-code of {} updated".format(name))
+    assert not differences, "G-code of {} ({}) differs from golden ({}):\n{}".format(
+        name, hashlib.sha256(text.encode()).hexdigest()[:12], hashlib.sha256(expected.encode()).hexdigest()[:12], gcode_diff.report(differences))
+
+@pytest.mark.parametrize("name", ['default', 'plate', 'multi_tool'])
+def test_repeatable(name):
+    """
+    Generation has no state left between runs
+    """
+    assert output(name) == output(name)
+
+@pytest.mark.parametrize("name", ['default', 'delta_klipper', 'fractions_rrf', 'segmented', 'max_flow', 'plate', 'multi_tool'])
+def test_config_file_round_trip(name, tmp_path):
+    """
+    Configuration saved to Kcalibrator.cfg and read back generates the same G-code
+    """
+    path = str(tmp_path/"Kcalibrator.cfg")
+    cases.config(name).save_config(path)
+    currentConfig = settings.SettingClass()
+    currentConfig.read_config(path)
+    assert "".join(generator.generate(currentConfig, *cases.generate_args(name))) == output(name)
+
+def test_chunks_are_lines():
+    """
+    Every chunk yielded by the generator consists of whole lines (streaming consumers rely on it), only the end of the file has no line break
+    """
+    chunks = list(generator.generate(cases.config('segmented')))
+    for chunk in chunks[:-1]:
+        assert chunk == "" or chunk.endswith("\n")
@@ -0,0 +1,54 @@
+#  -*- coding: utf-8 -*-
+
+"""
+Tests of MeatPack packing: the decoder (working like the firmware) must give back the G-code exactly
+"""
+
+import pytest
+
+import kcalibrator_generator as generator
+import kcalibrator_meatpack as meatpack
+import cases
+
+def plain(name): # G-code as the firmware sees it: commands without comments and empty lines
+    return "".join(line+"\n" for line in generator.commands(generator.generate(cases.config(name))))
+
+@pytest.mark.parametrize("name", ['default', 'delta_klipper', 'segmented', 'max_flow'])
+def test_round_trip(name):
+    stream = b"".join(meatpack.Encoder(no_spaces=False).pack(generator.generate(cases.config(name))))
+    assert meatpack.Decoder().feed(stream) == plain(name)
+
+def test_round_trip_no_spaces():
+    encoder, decoder = meatpack.Encoder(), meatpack.Decoder()
+    stream = b"".join(encoder.pack(generator.generate(cases.config('default'))))
+    expected = "".join(encoder.prepare(line)+"\n" for line in plain('default').splitlines())
+    assert decoder.feed(stream) == expected
+    assert "M117 K=0.000\n" in expected # messages keep their spaces
+
+def test_stream_split_anywhere():
+    """
+    Decoder keeps its state between pieces, so the stream can be read in pieces of any size (like from the serial port)
+    """
+    stream = b"".join(meatpack.Encoder().pack(generator.generate(cases.config('segmented'))))
+    whole = meatpack.Decoder().feed(stream)
+    decoder = meatpack.Decoder()
+    assert "".join(decoder.feed(stream[i:i+7]) for i in range(0, len(stream), 7)) == whole
+
+def test_unpacked_text_passes_through():
+    decoder = meatpack.Decoder()
+    encoder = meatpack.Encoder()
+    text = "M115\n"+decoder.feed(b"M110 N0\n")
+    assert text == "M115\nM110 N0\n"
+    assert decoder.feed(encoder.start()+encoder.encode("G1X1.5E0.1\n")+encoder.stop()+b"M105\n") == "G1X1.5E0.1\nM105\n"
+
+@pytest.mark.parametrize("no_spaces, ratio", [(True, 0.55), (False, 0.65)])
+def test_savings(no_spaces, ratio):
+    size, packed = meatpack.savings(generator.generate(cases.config('default')), no_spaces)
+    assert size == len(plain('default'))
+    assert packed == len(b"".join(meatpack.Encoder(no_spaces).pack(generator.generate(cases.config('default')))))
+    assert packed < size*ratio
+
+def test_capability():
+    assert meatpack.supports_meatpack([b"FIRMWARE_NAME:Marlin", b"Cap:MEATPACK:1"])
+    assert not meatpack.supports_meatpack([b"FIRMWARE_NAME:Marlin", b"Cap:MEATPACK:0"])
+    assert not meatpack.supports_meatpack(["FIRMWARE_NAME:Marlin", "Cap:EEPROM:1"])
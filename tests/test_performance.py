@@ -0,0 +1,76 @@
+#  -*- coding: utf-8 -*-
+
+"""
+Performance regression tests: every reference case must be generated within its budget from tests/budgets.json
+Time budgets are kept in units of the calibration workload of conftest.py, memory budgets are peaks of traced allocations
+A change which makes generation faster should record the new budgets (pytest tests/test_performance.py --update-budgets),
+so later changes can not give the speed back unnoticed
+"""
+
+import collections, tracemalloc
+
+import pytest
+
+import kcalibrator_generator as generator
+import kcalibrator_validate as validator
+import cases
+from conftest import best_time
+
+time_margin = 2.0 # recorded budget is this many times the measured time
+memory_margin = 1.5
+memory_slack = 64 << 10 # bytes added to memory budgets (allocations of the interpreter itself)
+
+def consume(name):
+    currentConfig = cases.config(name)
+    collections.deque(generator.generate(currentConfig, *cases.generate_args(name)), maxlen=0) # streamed like to a file or printer
+
+def peak_memory(name, **overrides): # peak of memory allocated while the case is generated
+    tracemalloc.start()
+    try:
+        currentConfig = cases.config(name)
+        for key, value in overrides.items(): setattr(currentConfig, key, value)
+        collections.deque(generator.generate(currentConfig, *cases.generate_args(name)), maxlen=0)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+@pytest.mark.parametrize("name", sorted(cases.cases))
+def test_time_budget(name, request, machine_unit, budgets, budget_factor):
+    units = best_time(lambda: consume(name))/machine_unit
+    if request.config.getoption("--update-budgets"):
+        budgets["time"][name] = round(units*time_margin, 3)
+        return
+    if name not in budgets["time"]: pytest.fail("No time budget for {}, run pytest --update-budgets".format(name))
+    budget = budgets["time"][name]*budget_factor
+    assert units <= budget, "{} took {:.3f} units ({:.4f} s), budget is {:.3f} units".format(name, units, units*machine_unit, budget)
+
+@pytest.mark.parametrize("name", sorted(cases.cases))
+def test_memory_budget(name, request, budgets):
+    peak = peak_memory(name)
+    if request.config.getoption("--update-budgets"):
+        budgets["memory"][name] = int(peak*memory_margin)+memory_slack
+        return
+    if name not in budgets["memory"]: pytest.fail("No memory budget for {}, run pytest --update-budgets".format(name))
+    assert peak <= budgets["memory"][name], "{} used {} bytes, budget is {}".format(name, peak, budgets["memory"][name])
+
+@pytest.mark.skipif(validator.np is None, reason="NumPy is not installed")
+def test_validation_budget(request, machine_unit, budgets, budget_factor):
+    """
+    Vectorized validation of a few MB of G-code, budget is kept per MB
+    """
+    currentConfig = cases.config('default')
+    text = "".join(generator.generate(currentConfig))*10
+    units = best_time(lambda: validator.validate([text], currentConfig))/machine_unit/(len(text)/1e6)
+    if request.config.getoption("--update-budgets"):
+        budgets["time"]["validation"] = round(units*time_margin, 3)
+        return
+    if "validation" not in budgets["time"]: pytest.fail("No time budget for validation, run pytest --update-budgets")
+    budget = budgets["time"]["validation"]*budget_factor
+    assert units <= budget, "validation took {:.3f} units ({:.4f} s) per MB, budget is {:.3f} units".format(units, units*machine_unit, budget)
+
+def test_streaming():
+    """
+    G-code is streamed: memory used during generation does not grow with the height of the pattern
+    """
+    low, high = peak_memory('default', k_end=0.1), peak_memory('default', k_end=0.5)
+    assert high < low*1.2
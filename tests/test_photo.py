@@ -0,0 +1,70 @@
+#  -*- coding: utf-8 -*-
+
+"""
+Tests of the photo analysis on synthetic photos of the pattern: stripes on the wall are the stronger the farther the band is from the best one
+"""
+
+import pytest
+
+import kcalibrator_photo as photo
+import kcalibrator_preview as preview
+import kcalibrator_generator as generator
+import cases
+
+np = pytest.importorskip("numpy")
+
+px_per_mm, width = 20, 300
+
+def synthetic_photo(currentConfig, best, bulge = 0.0, seed = 1):
+    """
+    Returns grayscale photo of the wall from the bed to the top of the pattern with lighting gradient across it and a little noise,
+    every band except the best one has stripes of flow changes, bulge brightens the corners of the best band
+    """
+    bands = preview.bands(currentConfig)
+    top = bands[-1][1]
+    rows = int(round(top*px_per_mm))
+    x = np.arange(width, dtype=float)
+    image = np.empty((rows, width))
+    for row in range(rows):
+        height = (1-(row+0.5)/rows)*top
+        band = next((i for i, (bottom, upper, label) in enumerate(bands) if bottom <= height < upper), 0)
+        image[row] = 120+40*x/width+8*abs(band-best)*np.sin(x/3) # gradient of the light and stripes where the flow changes
+        if band == best and bulge:
+            edge = int(width*photo.corner_width)
+            image[row, :edge] += bulge
+            image[row, -edge:] += bulge
+    return image+np.random.RandomState(seed).normal(0, 1, image.shape)
+
+@pytest.mark.parametrize("best", [0, 7, 20])
+def test_best_band(best):
+    currentConfig = cases.config('default')
+    result = photo.analyze(synthetic_photo(currentConfig, best), currentConfig)
+    bottom, top, label = preview.bands(currentConfig)[best]
+    assert (result['band'], result['label']) == (best, label)
+    assert result['height'] == round((bottom+top)/2-currentConfig.def_layer, 3)
+    c = currentConfig
+    assert result['k'] == generator.k_at_height(result['height'], c.k_start, c.k_end, c.k_step, c.def_layer, c.layers_per_k, c.k_mode, 1)
+    assert result['k'] == pytest.approx(c.k_start+best*c.k_step, abs=c.k_step/2) # middle of the band is calculated back to its K-factor
+
+def test_corner_bulge():
+    currentConfig = cases.config('default')
+    score, uniformity, bulge = photo.band_scores(synthetic_photo(currentConfig, 7, bulge=60), currentConfig)
+    assert int(np.argmax(bulge)) == 7 # bulged corners are found even on the smoothest band
+    assert int(np.argmin(score)) in (6, 8) # the band with bulged corners loses to its neighbours
+
+def test_cropped_pgm_file(tmp_path):
+    currentConfig = cases.config('default')
+    wall = np.clip(synthetic_photo(currentConfig, 12), 0, 255).astype(np.uint8)
+    image = np.zeros((wall.shape[0]+40, wall.shape[1]+60), dtype=np.uint8) # wall on the dark background
+    image[10:10+wall.shape[0], 30:30+wall.shape[1]] = wall
+    path = tmp_path/"pattern.pgm"
+    path.write_bytes("P5\n# photo\n{} {}\n255\n".format(image.shape[1], image.shape[0]).encode()+image.tobytes())
+    np.testing.assert_array_equal(photo.read_pnm(str(path)), image)
+    result = photo.analyze(str(path), currentConfig, crop=(30, 10, 30+wall.shape[1], 10+wall.shape[0]))
+    assert result['band'] == 12
+
+def test_flow_pattern_is_refused():
+    currentConfig = cases.config('default')
+    currentConfig.pattern_type = 'Max flow'
+    with pytest.raises(ValueError):
+        photo.analyze(np.zeros((100, 100)), currentConfig)
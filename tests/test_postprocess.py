@@ -0,0 +1,54 @@
+#  -*- coding: utf-8 -*-
+
+"""
+Tests of the post-processor applying K-factor to sliced G-code
+"""
+
+import pytest
+
+import kcalibrator_postprocess as postprocess
+
+def apply(tmp_path, text, k = 0.045, fw = 'Marlin/Lerdge'):
+    path = tmp_path/"part.gcode"
+    path.write_bytes(text.encode())
+    stats = postprocess.process_file(str(path), k, fw)
+    return path.read_bytes().decode(), stats
+
+@pytest.mark.parametrize("fw, line, expected", [
+    ('Marlin/Lerdge', "M900 K0.1", "M900 K0.045"),
+    ('Marlin/Lerdge', "M900 T1 K0.1 ; tool 1", "M900 T1 K0.045 ; tool 1"),
+    ('RepRapFirmware', "M572 D1 S0.1", "M572 D1 S0.045"),
+    ('Klipper', "SET_PRESSURE_ADVANCE EXTRUDER=extruder1 ADVANCE=0.1 SMOOTH_TIME=0.04", "SET_PRESSURE_ADVANCE EXTRUDER=extruder1 ADVANCE=0.045 SMOOTH_TIME=0.04"),
+    ('Klipper', "SET_PRESSURE_ADVANCE ADVANCE=0.1", "SET_PRESSURE_ADVANCE ADVANCE=0.045"),
+    ('Klipper', "M900 T1 K0.1", "SET_PRESSURE_ADVANCE EXTRUDER=extruder1 ADVANCE=0.045"), # other firmware: converted keeping the tool
+    ('Marlin/Lerdge', "M572 D1 S0.1", "M900 T1 K0.045"),
+    ('RepRapFirmware', "SET_PRESSURE_ADVANCE EXTRUDER=extruder ADVANCE=0.1", "M572 D0 S0.045"),
+    ('RepRapFirmware', "M900 K0.1", "M572 D0 S0.045"),
+    ('Marlin/Lerdge', "SET_PRESSURE_ADVANCE EXTRUDER=hotend_left ADVANCE=0.1", "SET_PRESSURE_ADVANCE EXTRUDER=hotend_left ADVANCE=0.045"),
+])
+def test_replace(tmp_path, fw, line, expected):
+    text, stats = apply(tmp_path, "G28\n{}\nG1 X10 E1.0\n".format(line), fw=fw)
+    assert text.splitlines()[1].rstrip() == expected
+    assert (stats['replaced'], stats['inserted']) == (1, 0)
+
+def test_multi_tool_file(tmp_path):
+    text, stats = apply(tmp_path, "T0\nM572 D0 S0.1\nT1\nM572 D1 S0.2\nG1 X1 E1\n", fw='RepRapFirmware')
+    assert text.split() == "T0 M572 D0 S0.045 T1 M572 D1 S0.045 G1 X1 E1".split()
+
+@pytest.mark.parametrize("line", ["SET_PRESSURE_ADVANCE SMOOTH_TIME=0.04", "M900", "M572 D0"])
+def test_commands_without_k_are_kept(tmp_path, line):
+    text, stats = apply(tmp_path, "G28\n{}\nG1 X10 E1.0\n".format(line), fw='Klipper')
+    assert line in text.splitlines()
+    assert (stats['replaced'], stats['inserted']) == (0, 1)
+
+@pytest.mark.parametrize("extrusion", ["G1 X10 Y10 E1.5", "G1 X10 Y10 E.0123", "G1 X10 Y10 E-.5"])
+def test_insert_before_first_extrusion(tmp_path, extrusion):
+    text, stats = apply(tmp_path, "G28\nG1 Z0.2 F600\n{}\n".format(extrusion))
+    assert text.splitlines() == ["G28", "G1 Z0.2 F600", "M900 K0.045", "M117 K=0.045", extrusion]
+    assert stats['inserted'] == 1
+
+def test_in_place_and_rewrite(tmp_path):
+    text, stats = apply(tmp_path, "M900 K0.10000\nG1 X1 E1\n")
+    assert stats['in_place'] and text.splitlines()[0].rstrip() == "M900 K0.045"
+    text, stats = apply(tmp_path, "M900 K1\nG1 X1 E1\n")
+    assert not stats['in_place'] and text == "M900 K0.045\nG1 X1 E1\n"
@@ -0,0 +1,63 @@
+#  -*- coding: utf-8 -*-
+
+"""
+Tests of the K-factor prediction from calibration history: nearest neighbour search and the predicted range
+"""
+
+import random
+from math import sqrt
+
+import pytest
+
+import kcalibrator_settings as settings
+import kcalibrator_predict as predict
+
+def result(k, temperature = 210, speed_fast = 100, k_step = 0.002, filament = "PLA", firmware = "Marlin/Lerdge", nozzle = "0.4"):
+    return {'k': k, 'temperature': temperature, 'speed_fast': speed_fast, 'k_step': k_step, 'filament': filament, 'firmware': firmware, 'nozzle': nozzle}
+
+def calibrated_config(): # configuration calibrated in the same conditions as the results above
+    currentConfig = settings.SettingClass()
+    currentConfig.temperature, currentConfig.speed_fast, currentConfig.firmware = (210, 60), 100, "Marlin/Lerdge"
+    currentConfig.filament_profile, currentConfig.nozzle_profile = "PLA", "0.4"
+    return currentConfig
+
+def test_coarse_results():
+    fine = [result(0.050), result(0.052), result(0.051)]
+    coarse = [result(0.09, k_step=0.01)]*3 # coarse passes of the same calibrations
+    start, end, step = predict.Predictor(fine+coarse, 0.002).predict(calibrated_config())
+    assert start <= 0.050 and 0.052 <= end < 0.06 # only fine results are used
+    start, end, step = predict.Predictor(fine[:2]+coarse, 0.002).predict(calibrated_config())
+    assert start <= 0.050 and 0.09 <= end # too few fine results, coarse ones are used with lower weight
+    coarse_end = predict.Predictor(fine[:2]+coarse[:1], 0.002).predict(calibrated_config())[1]
+    assert coarse_end < predict.Predictor(fine[:2]+[result(0.09)], 0.002).predict(calibrated_config())[1] # coarse result pulls the range less
+
+@pytest.mark.parametrize("dimensions", [1, 2, 5])
+def test_nearest_matches_brute_force(dimensions):
+    rng = random.Random(dimensions)
+    points = [tuple(rng.uniform(-10, 10) for d in range(dimensions)) for i in range(300)]
+    points += points[:20] # equal points
+    tree = predict.KDTree(points, list(range(len(points))))
+    for j in range(50):
+        query = tuple(rng.uniform(-12, 12) for d in range(dimensions))
+        for k in (1, 5, 30):
+            found = tree.nearest(query, k)
+            expected = sorted(sqrt(sum((a-b)**2 for a, b in zip(query, point))) for point in points)[:k]
+            assert [distance for distance, payload in found] == pytest.approx(expected)
+            assert all(distance == pytest.approx(sqrt(sum((a-b)**2 for a, b in zip(query, points[payload])))) for distance, payload in found)
+    assert len(tree.nearest(points[0], 1000)) == len(points)
+    assert predict.KDTree([], []).nearest((0,)*dimensions, 3) == []
+
+def test_short_history():
+    history = [result(0.05), result(0.06), result(None)] # results without K do not count
+    assert predict.Predictor(history).predict(calibrated_config()) is None
+    assert predict.Predictor([]).predict(calibrated_config()) is None
+    assert predict.Predictor(history+[result(0.055)]).predict(calibrated_config()) is not None
+
+@pytest.mark.parametrize("values", [[0.05, 0.052, 0.051], [0.0, 0.001, 0.002], [0.02, 0.3, 0.6, 0.1, 0.04], [0.5]*5])
+def test_range_covers_neighbours(values):
+    history = [result(k) for k in values]+[result(1.5, filament="TPU"), result(0.9, firmware="Klipper")] # far results are not neighbours
+    currentConfig = calibrated_config()
+    start, end, step = predict.Predictor(history).predict(currentConfig)
+    assert 0.0 <= start <= min(values) and max(values) <= end < 1.0
+    assert step >= currentConfig.fine_k_step and (end-start)/step <= 30
+    assert {row['k'] for distance, row in predict.Predictor(history).neighbours(currentConfig, len(values))} == set(values)
@@ -0,0 +1,47 @@
+#  -*- coding: utf-8 -*-
+
+"""
+Tests of the toolpath preview: geometry taken from the G-code, band labels of plates and conversion to the canvas
+"""
+
+import pytest
+
+import kcalibrator_generator as generator
+import kcalibrator_preview as preview
+import cases
+
+def test_toolpath():
+    currentConfig = cases.config('default')
+    brim, pattern = preview.toolpath(currentConfig)
+    assert len(brim) == 20 and len(pattern) == 2 # brim loops and two perimeters of the pattern
+    center = generator.plate_layout(currentConfig)[0]
+    for line in pattern:
+        xs, ys = [point[0] for point in line], [point[1] for point in line]
+        assert max(xs)-min(xs) == pytest.approx(currentConfig.size[0], abs=2*currentConfig.def_line_width+1e-3)
+        assert (max(xs)+min(xs))/2 == pytest.approx(center[0], abs=1e-3) and (max(ys)+min(ys))/2 == pytest.approx(center[1], abs=1e-3)
+    assert all(len(point) == 2 for line in brim+pattern for point in line)
+
+def test_plate_band_labels():
+    currentConfig = cases.config('plate')
+    first, second = generator.plate_configs(currentConfig)
+    labels = [label for bottom, top, label in preview.plate_bands(currentConfig)]
+    assert labels[0] == "K={} | K={}".format(first.k_start, second.k_start) # every pattern has its own K-factor range
+    assert preview.plate_bands(cases.config('default')) == preview.bands(cases.config('default'))
+    currentConfig.plate_patterns[1]['k_end'] = second.k_end+0.05 # the longer pattern goes on alone
+    assert preview.plate_bands(currentConfig)[-1][2].startswith("- | K=")
+
+def test_transform():
+    to_screen = preview.transform((0, 0, 100, 50), 210, 110, margin=5)
+    assert to_screen((0, 0)) == pytest.approx((5, 105)) and to_screen((100, 50)) == pytest.approx((205, 5)) # Y axis of the canvas goes down
+    to_screen = preview.transform((0, 0, 100, 100), 210, 110, margin=5)
+    assert to_screen((0, 0)) == pytest.approx((55, 105)) and to_screen((100, 100)) == pytest.approx((155, 5)) # equal scale, centered
+    to_screen = preview.transform((0, 0, 100, 100), 210, 110, margin=5, equal=False)
+    assert to_screen((100, 100)) == pytest.approx((205, 5))
+
+def test_decimate():
+    to_screen = preview.transform((0, 0, 10, 10), 20, 20, margin=0)
+    points = [(i/100, 5) for i in range(1001)]
+    result = preview.decimate(points, to_screen)
+    assert len(result) == 21 # one point per pixel and the last point
+    assert result[0] == to_screen(points[0]) and result[-1] == to_screen(points[-1])
+    assert preview.decimate([], to_screen) == [] and preview.decimate([(1, 1)], to_screen) == [to_screen((1, 1))]
@@ -0,0 +1,55 @@
+#  -*- coding: utf-8 -*-
+
+"""
+Tests of the profile store: profiles saved from one configuration are applied to another one
+"""
+
+import pytest
+
+import kcalibrator_settings as settings
+import kcalibrator_profiles as profiles
+
+@pytest.fixture
+def store(tmp_path):
+    with profiles.ProfileStore(str(tmp_path/"profiles.db")) as store: yield store
+
+def test_round_trip(store):
+    source = settings.SettingClass()
+    source.bed_size, source.kinematics, source.retract = (300, 300, 400), 'Delta', (0.8, 35)
+    source.temperature, source.k_end, source.retract_at_layer_change = (245, 90), 0.08, False
+    store.save_profile('printer', "Kossel", source)
+    store.save_profile('filament', "PETG", source)
+    assert source.printer_profile == "Kossel" and store.profile_names('printer') == ["Kossel"]
+    currentConfig = settings.SettingClass()
+    store.load(currentConfig, printer="Kossel", filament="PETG", nozzle=None)
+    for key in profiles.profile_keys['printer']+profiles.profile_keys['filament']:
+        assert getattr(currentConfig, key) == getattr(source, key), key # values come back through apply_overrides with their types
+    assert (currentConfig.printer_profile, currentConfig.filament_profile) == ("Kossel", "PETG")
+    assert currentConfig.def_line_width == settings.SettingClass().def_line_width # nozzle settings are not touched
+
+def test_later_kinds_override_earlier(store):
+    currentConfig = settings.SettingClass()
+    currentConfig.retract = (1.0, 30)
+    store.save_profile('printer', "Ender", currentConfig)
+    store.save_profile('filament', "TPU", currentConfig)
+    with store.db: store.db.execute("INSERT INTO profiles (kind, name, key, value) VALUES ('filament', 'TPU', 'retract', '(3.0, 20)')") # flexible filament retracts more
+    loaded = settings.SettingClass()
+    store.load(loaded, filament="TPU", printer="Ender") # order of the arguments does not matter
+    assert loaded.retract == (3.0, 20)
+
+def test_missing_profile(store):
+    store.save_profile('printer', "Ender", settings.SettingClass())
+    currentConfig = settings.SettingClass()
+    with pytest.raises(KeyError):
+        store.load(currentConfig, printer="Ender", filament="PLA")
+    assert currentConfig.printer_profile != "Ender" # nothing is applied
+    assert store.delete_profile('printer', "Ender") and not store.delete_profile('printer', "Ender")
+    with pytest.raises(KeyError):
+        store.load(currentConfig, printer="Ender")
+
+def test_unknown_kind(store):
+    with pytest.raises(ValueError):
+        store.load(settings.SettingClass(), extruder="Hemera")
+    with pytest.raises(ValueError):
+        store.save_profile('extruder', "Hemera", settings.SettingClass())
+    assert store.profile_names('extruder') == []
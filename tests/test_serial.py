@@ -0,0 +1,74 @@
+#  -*- coding: utf-8 -*-
+
+"""
+Tests of the serial sender against stand-in firmware on a pseudo-terminal
+"""
+
+import pytest
+
+import kcalibrator_generator as generator
+import kcalibrator_serial as serial_sender
+import kcalibrator_meatpack as meatpack
+import cases
+from fake_firmware import FakeFirmware
+
+pytest.importorskip("pty") # POSIX only
+
+def job(count = 400): # start G-code and the beginning of the brim
+    return list(generator.commands(generator.generate(cases.config('default'))))[:count]
+
+def stream(firmware, lines, **kwargs):
+    port = serial_sender.PosixPort(firmware.path)
+    try:
+        sender = serial_sender.Sender(port, **kwargs)
+        sender.wait_start()
+        return sender.send(line+"\n" for line in lines)
+    finally:
+        port.close()
+
+@pytest.mark.parametrize("flow", serial_sender.flow_list)
+def test_stream(flow):
+    lines = job()
+    with FakeFirmware() as firmware: stats = stream(firmware, lines, flow=flow)
+    assert firmware.lines == lines
+    assert not firmware.overflow
+    assert (stats['lines'], stats['resends'], stats['timeouts']) == (len(lines), 0, 0)
+    assert stats['max_in_flight'] == (1 if flow == 'ping-pong' else 4)
+
+def test_resend():
+    lines = job()
+    with FakeFirmware(corrupt=(5, 120, 200)) as firmware: stats = stream(firmware, lines)
+    assert firmware.lines == lines # every line executed once and in order
+    assert stats['resends'] >= 3 and not firmware.overflow
+
+def test_heating_without_keepalive_does_not_overflow():
+    """
+    Silence while the firmware heats is not a lost "ok": the window stays closed until M109 and M190 are finished
+    """
+    lines = job(60)
+    with FakeFirmware(busy_seconds=0.6) as firmware: stats = stream(firmware, lines, timeout=0.2)
+    assert firmware.lines == lines
+    assert not firmware.overflow, "receive buffer held {} bytes".format(firmware.max_pending)
+    assert stats['timeouts'] == 0
+
+def test_lost_ok_is_recovered():
+    lines = job(60)
+    with FakeFirmware() as firmware:
+        reply = firmware.reply
+        dropped = []
+        def lossy(text): # the "ok" for the 10th line is lost on the way
+            if text == "ok\n" and len(firmware.lines) == 10 and not dropped:
+                dropped.append(text)
+                return
+            reply(text)
+        firmware.reply = lossy
+        stats = stream(firmware, lines, timeout=0.2, flow='ping-pong')
+    assert firmware.lines == lines and stats['timeouts'] == 1
+
+def test_meatpack_stream():
+    lines = job()
+    with FakeFirmware(meatpack=True) as firmware: stats = stream(firmware, lines, use_meatpack=True)
+    encoder = meatpack.Encoder()
+    assert firmware.lines == [encoder.prepare(line) for line in lines]
+    assert stats['bytes'] < sum(len(line)+1 for line in lines) # packed lines are shorter even with line numbers and checksums
+    assert not firmware.overflow
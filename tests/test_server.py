@@ -0,0 +1,129 @@
+#  -*- coding: utf-8 -*-
+
+"""
+Tests of the generation service over real sockets: G-code is streamed in blocks, responses end with the connection closed and the service shuts down
+"""
+
+import json, socket, asyncio, threading
+
+import pytest
+
+import kcalibrator_server as server
+import kcalibrator_generator as generator
+import cases
+
+timeout = 20 # seconds, a hanging connection fails the test instead of hanging it
+
+class RunningService:
+    """
+    Service listening on a free port of localhost in its own event loop thread, use as context manager
+    """
+    def __init__(self, base, workers = 1):
+        self.service = server.Service(base, workers)
+        self.loop = asyncio.new_event_loop()
+        self.started = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.server = self.loop.run_until_complete(asyncio.start_server(self.service.handle, "127.0.0.1", 0))
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.started.set()
+        self.loop.run_forever()
+        self.server.close()
+        self.loop.run_until_complete(self.server.wait_closed())
+        self.loop.close()
+
+    def __enter__(self):
+        self.thread.start()
+        self.started.wait(timeout)
+        return self
+
+    def __exit__(self, *args):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout)
+        closing = threading.Thread(target=self.service.close, daemon=True)
+        closing.start()
+        closing.join(timeout)
+        assert not closing.is_alive(), "shutdown of the worker pool hangs"
+
+    def post(self, path, body):
+        """
+        Sends request and returns (status, body) of the response read until the server closes the connection
+        """
+        with socket.create_connection(("127.0.0.1", self.port), timeout=timeout) as s:
+            s.sendall("POST {} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {}\r\n\r\n".format(path, len(body)).encode()+body)
+            response = b""
+            while True:
+                try: data = s.recv(65536)
+                except socket.timeout: pytest.fail("connection is not closed after the response")
+                if not data: break
+                response += data
+        head, _, content = response.partition(b"\r\n\r\n")
+        self.headers = head.decode("latin-1").lower()
+        return int(head.split()[1]), content
+
+def test_generate_until_eof():
+    base = cases.config('default')
+    with RunningService(base) as running:
+        for i in range(2): # the first request starts the worker process
+            status, content = running.post("/generate", json.dumps({'k_end': 0.05+0.01*i}).encode())
+            assert status == 200
+            currentConfig = cases.config('default')
+            currentConfig.k_end = 0.05+0.01*i
+            assert content == "".join(generator.generate(currentConfig)).encode()
+
+def test_streamed_and_cached():
+    base = cases.config('default')
+    base.k_end = 0.5 # G-code of a few blocks
+    expected = "".join(generator.generate(base)).encode()
+    with RunningService(base) as running:
+        results = [None]*3
+        def get(i): results[i] = running.post("/generate", b"{}")
+        clients = [threading.Thread(target=get, args=(i,)) for i in range(3)]
+        for client in clients: client.start()
+        for client in clients: client.join(timeout)
+        assert results == [(200, expected)]*3
+        assert running.service.metrics.counters['generations'] == 1 # the others followed the same generation or got it from the cache
+        blocks = next(iter(running.service.cache.entries.values()))
+        assert len(blocks) > 3 and max(len(block) for block in blocks) < 2*server.block_size # sent in blocks while generated
+        assert running.post("/generate", b"{}") == (200, expected)
+        assert "content-length: {}".format(len(expected)) in running.headers # cached result has known length
+        status, content = running.post("/generate", json.dumps({'k_end': 0.4}).encode())
+        assert status == 200 and content.endswith(expected[-100:]) and "content-length" not in running.headers # streamed until closed
+    assert running.service.metrics.counters['cache_hits']+running.service.metrics.counters['coalesced'] == 3
+
+def test_generation_is_followed_while_it_grows():
+    async def scenario():
+        generation = server.Generation()
+        received = []
+        async def client():
+            await generation.started()
+            async for block in generation.follow(): received.append(block)
+        task = asyncio.ensure_future(client())
+        for block in (b"G28\n", b"G1 X1\n"):
+            generation.add(block)
+            await asyncio.sleep(0)
+        assert received == [b"G28\n", b"G1 X1\n"] and not task.done() # blocks arrive before the end of the generation
+        generation.finish()
+        await task
+        failed = server.Generation()
+        failed.finish(ValueError("limit"))
+        with pytest.raises(ValueError): await failed.started()
+        return received
+    assert asyncio.run(scenario()) == [b"G28\n", b"G1 X1\n"]
+
+def test_invalid_settings():
+    with RunningService(cases.config('default')) as running:
+        status, content = running.post("/generate", json.dumps({'temperature': "[240, 80, 1]"}).encode())
+        assert status == 400 and "error" in json.loads(content.decode())
+        status, content = running.post("/generate", b"[1, 2]")
+        assert status == 400
+
+def test_job_over_limits():
+    base = cases.config('default')
+    base.limit_bands = 5
+    with RunningService(base) as running:
+        status, content = running.post("/generate", b"{}")
+        assert status == 422 and "error" in json.loads(content.decode())
+        assert running.post("/generate", json.dumps({'k_end': 0.03}).encode())[0] == 200 # the service goes on
@@ -0,0 +1,48 @@
+#  -*- coding: utf-8 -*-
+
+"""
+Tests of the settings: refinement of the sweep and overrides given as text
+"""
+
+import pytest
+
+import kcalibrator_settings as settings
+
+def test_refine_keeps_first_coarse_sweep():
+    currentConfig = settings.SettingClass()
+    currentConfig.refine(0.08)
+    assert currentConfig.coarse_k == (0.0, 0.2, 0.01, 0.08)
+    assert (currentConfig.k_start, currentConfig.k_end, currentConfig.k_step) == (0.07, 0.09, 0.002)
+    currentConfig.fine_k_step = 0.0005
+    currentConfig.refine(0.084)
+    assert currentConfig.coarse_k == (0.0, 0.2, 0.01, 0.08)
+    assert currentConfig.k_step == 0.0005
+
+def test_refine_with_new_coarse_sweep():
+    currentConfig = settings.SettingClass()
+    currentConfig.refine(0.08)
+    currentConfig.k_start, currentConfig.k_end, currentConfig.k_step = 0.0, 1.0, 0.05 # new coarse sweep for other filament
+    currentConfig.refine(0.4)
+    assert currentConfig.coarse_k == (0.0, 1.0, 0.05, 0.4)
+
+@pytest.mark.parametrize("fine_k_step", [0.01, 0.02, 0.0])
+def test_refine_rejects_step_not_finer(fine_k_step):
+    currentConfig = settings.SettingClass()
+    currentConfig.fine_k_step = fine_k_step
+    with pytest.raises(ValueError):
+        currentConfig.refine(0.08)
+    assert (currentConfig.k_start, currentConfig.k_end, currentConfig.k_step, currentConfig.coarse_k) == (0.0, 0.2, 0.01, None)
+
+def test_overrides():
+    currentConfig = settings.SettingClass()
+    currentConfig.apply_overrides({'temperature': "[240, 80]", 'k_end': "0.5", 'firmware': "Klipper", 'double_perimeter': "false"})
+    assert (currentConfig.temperature, currentConfig.k_end, currentConfig.firmware, currentConfig.double_perimeter) == ((240, 80), 0.5, 'Klipper', False)
+
+@pytest.mark.parametrize("key, text", [('temperature', "abc"), ('temperature', "[240, 80, 1]"), ('size', "(100)"), ('k_end', "abc"), ('firmware', "Smoothie")])
+def test_invalid_overrides(key, text):
+    with pytest.raises(ValueError):
+        settings.SettingClass().apply_overrides({key: text})
+
+def test_unknown_override():
+    with pytest.raises(KeyError):
+        settings.SettingClass().apply_overrides({'plate_patterns': "[]"})
@@ -0,0 +1,54 @@
+#  -*- coding: utf-8 -*-
+
+"""
+Tests of the direct upload against a local stand-in of the printer host
+"""
+
+import pytest
+
+import kcalibrator_generator as generator
+import kcalibrator_upload as upload
+import cases
+from printer_host import PrinterHost
+
+def gcode():
+    return generator.generate(cases.config('default'))
+
+def test_moonraker_upload_is_complete():
+    with PrinterHost() as host:
+        uploader = upload.Uploader(host.url, 'Moonraker', connections=upload.ConnectionPool())
+        assert uploader.upload("test.gcode", gcode, start=True) == {'result': 'ok'}
+    received = host.uploads[0]
+    assert received.path == "/server/files/upload"
+    assert received.headers["Transfer-Encoding"] == "chunked" # streamed while generated
+    assert received.filename == "test.gcode" and received.fields == {'print': 'true'}
+    assert received.data == "".join(gcode()).encode()
+
+def test_octoprint_api_key():
+    with PrinterHost() as host:
+        upload.Uploader(host.url+"/", 'OctoPrint', "secret", upload.ConnectionPool()).upload("test.gcode", gcode)
+    assert host.uploads[0].path == "/api/files/local"
+    assert host.uploads[0].headers["X-Api-Key"] == "secret"
+    assert host.uploads[0].fields == {}
+
+def test_connection_is_reused():
+    connections = upload.ConnectionPool()
+    with PrinterHost() as host:
+        uploader = upload.Uploader(host.url, connections=connections)
+        for i in range(3): uploader.upload("test{}.gcode".format(i), gcode)
+    connections.close()
+    assert len(host.uploads) == 3 and host.connections == 1
+
+def test_closed_keep_alive_connection_is_retried():
+    connections = upload.ConnectionPool()
+    with PrinterHost(drop_connections=True) as host:
+        uploader = upload.Uploader(host.url, connections=connections)
+        for i in range(3): uploader.upload("test{}.gcode".format(i), gcode)
+    connections.close()
+    assert [received.filename for received in host.uploads] == ["test0.gcode", "test1.gcode", "test2.gcode"]
+    assert all(received.data == host.uploads[0].data for received in host.uploads)
+
+def test_error_status():
+    with PrinterHost(status=403) as host:
+        with pytest.raises(IOError, match="403"):
+            upload.Uploader(host.url, connections=upload.ConnectionPool()).upload("test.gcode", gcode)
@@ -0,0 +1,56 @@
+#  -*- coding: utf-8 -*-
+
+"""
+Tests of the G-code validator: the vectorized parser and checks must give the same results as the line by line ones
+"""
+
+import random
+
+import pytest
+
+import kcalibrator_generator as generator
+import kcalibrator_validate as validator
+import cases
+
+np = pytest.importorskip("numpy")
+
+lines = ["G1 X10.5 Y-2 E0.12345 F1800", "G92 E0", "G1 X+.5 Y5. Z0.2", "G1 X123456789.125 E-0.5", "G1 X1.2.3 Y- Z1-2 E+-1", "M83",
+         "G1 X0.00000000000000001 Y1234567890123456789.5", " G1 X5", "G1X5 Y3", "G01 X7", "G1.0 X1", "N5 G1 X1", "G1 X5 X6 ;X7",
+         "G1 E-.5", "G1 X12345678 Y123456789012345 Z1234567890123456 E.", "; G1 X1", "g1 x1", "G1 X1\tY2\r", "T0", "G1 X-. Y+. Z-0 E+0.", "G1 X10 E0.5"]
+
+def parsed_lines(lines): # kinds and values of lines parsed by both parsers
+    kinds, columns = validator.parse_numpy(("\n".join(lines)+"\n").encode())
+    expected = [validator.parse_line(line) for line in lines]
+    return kinds, columns, expected
+
+def assert_same(kinds, columns, expected):
+    for i, (kind, values) in enumerate(expected):
+        assert kinds[i] == kind, i
+        np.testing.assert_array_equal(columns[:, i], values if values else [validator.nan]*5, err_msg=str(i))
+
+def test_parser_edge_cases():
+    assert_same(*parsed_lines(lines))
+
+def test_parser_random_numbers():
+    rng = random.Random(1)
+    numbers = ["".join(rng.choice("0123456789"*rng.randint(1, 8)+".-+") for i in range(rng.randint(1, 19))) for j in range(20000)]
+    assert_same(*parsed_lines([rng.choice(["G1 X", "G0 Y", "G92 E", "G1 F", "G", "M", "G1 X1 E"])+number for number in numbers]))
+
+@pytest.mark.parametrize("name", sorted(cases.cases))
+def test_implementations_agree(name):
+    currentConfig, args = cases.config(name), cases.generate_args(name)
+    fast = validator.validate(generator.generate(currentConfig, *args), currentConfig, max_flow=8, max_speed=100, max_errors=1000)
+    slow = validator.validate(generator.generate(currentConfig, *args), currentConfig, max_flow=8, max_speed=100, max_errors=1000, use_numpy=False)
+    for key, value in slow.items():
+        if key in ('filament', 'seconds', 'max_flow', 'max_speed'): assert fast[key] == pytest.approx(value, rel=1e-12), key
+        else: assert fast[key] == value, key
+    assert fast['error_count'] > 0 # limits are low enough to check the messages too
+
+@pytest.mark.parametrize("use_numpy", [True, False])
+def test_chunks_carry_state(monkeypatch, use_numpy):
+    currentConfig = cases.config('negative_range')
+    whole = validator.validate(generator.generate(currentConfig), currentConfig, max_flow=8, use_numpy=use_numpy)
+    monkeypatch.setattr(validator, "chunk_size", 4096)
+    assert len(list(validator.blocks(generator.generate(currentConfig)))) > 20 # the generator yields whole layers
+    chunked = validator.validate(generator.generate(currentConfig), currentConfig, max_flow=8, use_numpy=use_numpy)
+    assert chunked == pytest.approx(whole, rel=1e-12)
@@ -0,0 +1,22 @@
+#  -*- coding: utf-8 -*-
+
+"""
+Tests of the watch mode: configuration files are regenerated independently of each other
+"""
+
+import os, re
+
+import kcalibrator_settings as settings
+import kcalibrator_watch as watch
+
+def test_failing_file_does_not_stop_watching(tmp_path, capsys):
+    settings.SettingClass().save_config(str(tmp_path/"good.cfg"))
+    text = (tmp_path/"good.cfg").read_text()
+    (tmp_path/"bad.cfg").write_text(re.sub(r"(?m)^temperature = .*$", "temperature = (abc)", text)) # read, but the generator fails on it
+    watcher = watch.Watcher([str(tmp_path)])
+    watcher.run(once=True)
+    assert "bad.cfg: IndexError" in capsys.readouterr().out
+    assert sorted(os.listdir(str(tmp_path))) == ["bad.cfg", "good.cfg", "good.gcode"] # no partial G-code is left
+    (tmp_path/"bad.cfg").write_text(text)
+    assert [watcher.regenerate(path) for path in watcher.changed()] == [True] # fixed file is generated, the other one is unchanged
+    assert (tmp_path/"bad.gcode").read_text() == (tmp_path/"good.gcode").read_text()